@@ -1 +1,3 @@
- 
\ No newline at end of file
+__version__ = "0.1"
+
+from .translator import iter_translate, translate
@@ -0,0 +1,591 @@
+import math
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .assembler import VARIABLE_BASE_ADDRESS
+from .code_writer import CALLER_FRAME_SIZE, MEMORY_SEGMENT_MAP, STACK_BASE_ADDRESS
+from .parser import OPCODES, ArithmeticCommand, Command, CommandArray, CommandType
+
+# The function every program starts in, called by the bootstrap code
+ENTRY_POINT = "Sys.init"
+
+# Number of times the stack depth at a label may grow before the analysis stops following it and considers the
+# depth unbounded, which only happens in loops that push more values than they pop
+MAX_LABEL_WIDENINGS = 16
+
+# Number of entries of the segments whose size is fixed. Static variables are allocated from 16 up to the stack.
+SEGMENT_SIZES = {
+    "temp": 8,
+    "pointer": 2,
+    "static": STACK_BASE_ADDRESS - VARIABLE_BASE_ADDRESS,
+}
+
+# Largest constant an A-instruction can load
+MAX_CONSTANT = 32767
+
+UNARY_OPERATIONS = (ArithmeticCommand.NEG, ArithmeticCommand.NOT)
+
+# First word of every command that is not an arithmetic command, by its type
+COMMAND_WORDS = {command_type: word for word, (command_type, operation) in OPCODES.items() if operation is None}
+
+def select_commands(commands: Iterable[Command], predicate: Callable[[CommandType, object], bool]) -> Iterator[Command]:
+    """
+    Helper function that yields the commands whose type and first argument match `predicate`. Passes that only look
+    at a few kinds of commands use it so that for a `CommandArray`, only the matching commands are created.
+    """
+    if isinstance(commands, CommandArray):
+        matching = {opcode for opcode, (type, arg1) in enumerate(commands.opcode_table) if predicate(type, arg1)}
+
+        for index, opcode in enumerate(commands.opcodes):
+            if opcode in matching:
+                yield commands[index]
+    else:
+        for command in commands:
+            if predicate(command.type, command.arg1):
+                yield command
+
+def is_function_or_pointer_pop(type: CommandType, arg1) -> bool:
+    return type == CommandType.C_FUNCTION or (type in (CommandType.C_POP, CommandType.C_MOVE) and arg1 == "pointer")
+
+def is_function_or_call(type: CommandType, arg1) -> bool:
+    return type in (CommandType.C_FUNCTION, CommandType.C_CALL)
+
+def functions_modifying_pointers(commands: Iterable[Command]) -> Set[str]:
+    """
+    Returns the names of the functions that change THIS or THAT, i.e. that contain a `pop pointer` command.
+
+    Only these functions have to save and restore THIS and THAT on every call: a function that never changes
+    them leaves the caller's values in place, and every function it calls that does change them restores them
+    before returning.
+
+    Args:
+        commands (Iterable[Command]): The commands of one or more .vm files, in program order.
+    """
+    functions = set()
+    current_function = None
+
+    for command in select_commands(commands, is_function_or_pointer_pop):
+        if command.type == CommandType.C_FUNCTION:
+            current_function = command.arg1
+        elif command.type in (CommandType.C_POP, CommandType.C_MOVE) and command.arg1 == "pointer":
+            if current_function is not None:
+                functions.add(current_function)
+
+    return functions
+
+def build_call_graph(commands: Iterable[Command]) -> Dict[str, Set[str]]:
+    """
+    Returns a dictionary mapping the name of every function defined in `commands` to the names of the functions it calls.
+    Calls made outside of any function are ignored.
+
+    Args:
+        commands (Iterable[Command]): The commands of one or more .vm files, in program order.
+    """
+    call_graph: Dict[str, Set[str]] = {}
+    current_function = None
+
+    for command in select_commands(commands, is_function_or_call):
+        if command.type == CommandType.C_FUNCTION:
+            current_function = command.arg1
+            call_graph.setdefault(current_function, set())
+        elif command.type == CommandType.C_CALL and current_function is not None:
+            call_graph[current_function].add(command.arg1)
+
+    return call_graph
+
+def reachable_functions(call_graph: Dict[str, Set[str]], entry_point: str = ENTRY_POINT) -> Set[str]:
+    """
+    Returns the names of the functions that can be called, directly or indirectly, from `entry_point`,
+    including the entry point itself. The VM language has no indirect calls, so every other function is dead code.
+    """
+    reachable = {entry_point}
+    pending = [entry_point]
+
+    while pending:
+        for callee in call_graph.get(pending.pop(), ()):
+            if callee not in reachable:
+                reachable.add(callee)
+                pending.append(callee)
+
+    return reachable
+
+def kept_functions_by_module(call_graphs: List[Dict[str, Set[str]]]) -> List[Optional[List[str]]]:
+    """
+    Takes the call graph of every module of a program, and returns for every module the sorted names of the
+    functions it defines that can be reached from `Sys.init`. If the program does not define `Sys.init`
+    every function is kept, and None is returned for every module.
+    """
+    program_call_graph: Dict[str, Set[str]] = {}
+    for call_graph in call_graphs:
+        program_call_graph.update(call_graph)
+
+    if ENTRY_POINT not in program_call_graph:
+        return [None] * len(call_graphs)
+
+    reachable = reachable_functions(program_call_graph)
+
+    return [sorted(function for function in call_graph if function in reachable) for call_graph in call_graphs]
+
+def remove_functions(
+    commands: Iterable[Command],
+    kept_functions: Collection[str],
+    key: Callable[[object], Command] = None,
+) -> Iterator[Command]:
+    """
+    Yields every command except those belonging to a function that is not in `kept_functions`.
+    Commands before the first function are always kept.
+
+    If `key` is given, `commands` can hold other items that carry a command, such as commands paired with their
+    line numbers, and `key` returns the command of an item. The items are yielded as they are.
+    """
+    keep = True
+
+    for item in commands:
+        command = item if key is None else key(item)
+
+        if command.type == CommandType.C_FUNCTION:
+            keep = command.arg1 in kept_functions
+
+        if keep:
+            yield item
+
+def format_command(command: Command) -> str:
+    """
+    Helper function that returns a command the way it is written in a .vm file, e.g. `push local 2`.
+    """
+    if command.type == CommandType.C_ARITHMETIC:
+        return command.arg1.value
+
+    return " ".join(str(part) for part in (COMMAND_WORDS[command.type], command.arg1, command.arg2) if part is not None)
+
+def stack_effect(command: Command) -> Tuple[int, int]:
+    """
+    Helper function that returns the number of values a command pops from the stack, and the number it then pushes.
+    """
+    if command.type == CommandType.C_ARITHMETIC:
+        return (1, 1) if command.arg1 in UNARY_OPERATIONS else (2, 1)
+
+    if command.type == CommandType.C_PUSH:
+        return 0, 1
+
+    if command.type in (CommandType.C_POP, CommandType.C_IF, CommandType.C_RETURN):
+        return 1, 0
+
+    if command.type == CommandType.C_CALL:
+        return command.arg2, 1
+
+    return 0, 0
+
+def segment_limit(command_type: CommandType, segment: str) -> Optional[float]:
+    """
+    Helper function that returns the number of entries a push or pop can address in `segment`, which is infinite
+    for segments without a fixed size, or None for other commands. Pops of constants and invalid segments
+    have no valid index at all.
+    """
+    if command_type not in (CommandType.C_PUSH, CommandType.C_POP):
+        return None
+
+    if segment == "constant":
+        return MAX_CONSTANT + 1 if command_type == CommandType.C_PUSH else 0
+
+    if segment in SEGMENT_SIZES:
+        return SEGMENT_SIZES[segment]
+
+    return math.inf if segment in MEMORY_SEGMENT_MAP else 0
+
+class FunctionStackUsage:
+    """
+    What the stack analysis found out about a single function, or about the code outside of any function.
+    """
+    __slots__ = ("name", "local_count", "max_depth", "call_depths", "issues")
+
+    def __init__(self, name: Optional[str], local_count: int = 0):
+        # None for the code outside of any function
+        self.name = name
+        self.local_count = local_count
+
+        # Most values the function holds on its own stack at any point, or None if a loop makes it unbounded
+        self.max_depth = 0
+
+        # Every function called, mapped to the most values on the stack at any of the calls, including the arguments.
+        # None if the stack is unbounded at one of the calls.
+        self.call_depths: Dict[str, Optional[int]] = {}
+
+        # Problems found, such as underflows and out of range segment accesses, in the order of the commands
+        self.issues: List[str] = []
+
+    @property
+    def is_safe(self) -> bool:
+        """
+        True if the stack depth is bounded and the analysis found no problems.
+        """
+        return self.max_depth is not None and not self.issues
+
+class OpcodeTable:
+    """
+    What the stack analysis needs to know about every distinct command of a `CommandArray`, by opcode, so it is
+    worked out once per program rather than for every command.
+    """
+    __slots__ = ("types", "effects", "control_opcodes", "limits", "local_opcodes", "argument_opcodes")
+
+    def __init__(self, commands: CommandArray):
+        self.types = [type for type, _ in commands.opcode_table]
+
+        # Calls pop as many values as they have arguments, which the opcode does not include
+        self.effects = [stack_effect(Command.from_parts(type, arg1, 0)) for type, arg1 in commands.opcode_table]
+
+        # Commands that do more than move the stack: labels, jumps, calls and returns
+        self.control_opcodes = {
+            opcode for opcode, type in enumerate(self.types)
+            if type in (CommandType.C_LABEL, CommandType.C_GOTO, CommandType.C_IF, CommandType.C_CALL, CommandType.C_RETURN)
+        }
+
+        # See `segment_limit`. The size of the local and argument segments depends on the function.
+        self.limits = [segment_limit(type, arg1) for type, arg1 in commands.opcode_table]
+
+        self.local_opcodes = [
+            opcode for opcode, (type, arg1) in enumerate(commands.opcode_table)
+            if arg1 == "local" and self.limits[opcode] is not None
+        ]
+        self.argument_opcodes = [
+            opcode for opcode, (type, arg1) in enumerate(commands.opcode_table)
+            if arg1 == "argument" and self.limits[opcode] is not None
+        ]
+
+    def function_limits(self, local_count: float, argument_count: float) -> List[Optional[float]]:
+        """
+        Returns `limits` for a function with the given size of the local and argument segments.
+        """
+        limits = self.limits.copy()
+
+        for opcode in self.local_opcodes:
+            limits[opcode] = local_count
+        for opcode in self.argument_opcodes:
+            limits[opcode] = argument_count
+
+        return limits
+
+def call_argument_counts(commands: CommandArray) -> Dict[str, int]:
+    """
+    Returns the fewest arguments every called function is called with, which bounds the argument segment.
+    """
+    calls = {opcode: arg1 for opcode, (type, arg1) in enumerate(commands.opcode_table) if type == CommandType.C_CALL}
+    counts: Dict[str, int] = {}
+
+    for opcode, argument_count in zip(commands.opcodes, commands.args):
+        function_name = calls.get(opcode)
+        if function_name is not None:
+            counts[function_name] = min(counts.get(function_name, argument_count), argument_count)
+
+    return counts
+
+def segment_issue(command: Command, usage: FunctionStackUsage, argument_count: Optional[int]) -> Optional[str]:
+    """
+    Helper function that returns why a push or pop accesses a segment out of its bounds, or None if it does not.
+    The local and argument segments are only checked inside functions, and the argument segment only when the
+    function is called by the code being analyzed.
+    """
+    if command.type not in (CommandType.C_PUSH, CommandType.C_POP):
+        return None
+
+    segment, index = command.arg1, command.arg2
+
+    if segment not in MEMORY_SEGMENT_MAP and segment != "constant":
+        return f"invalid memory segment: {segment}"
+
+    if index < 0:
+        return "the index cannot be negative"
+
+    if segment == "constant":
+        if command.type == CommandType.C_POP:
+            return "constants cannot be popped"
+        if index > MAX_CONSTANT:
+            return f"out of range for constants, which go up to {MAX_CONSTANT}"
+    elif segment in SEGMENT_SIZES:
+        if index >= SEGMENT_SIZES[segment]:
+            return f"out of range for the {segment} segment, which has size {SEGMENT_SIZES[segment]}"
+    elif segment == "local":
+        if usage.name is not None and index >= usage.local_count:
+            return f"out of range for the local segment, which has size {usage.local_count}"
+    elif segment == "argument":
+        if argument_count is not None and index >= argument_count:
+            return f"out of range for the argument segment, which has size {argument_count} in some calls"
+
+    return None
+
+def analyze_function(
+    usage: FunctionStackUsage,
+    commands: CommandArray,
+    opcodes: OpcodeTable,
+    start: int,
+    end: int,
+    argument_count: Optional[int] = None,
+):
+    """
+    Runs an abstract interpretation of the commands of one function, from `start` to `end` in `commands`,
+    and fills in `usage`.
+
+    The commands are first split into blocks of straight-line code, which start at labels and end at jumps and returns,
+    and every block is summed up by how far it moves the stack and how low and high it takes it. Every block is
+    then given the range of stack depths it can be reached with, counted from the function's locals, which is
+    carried along every jump and merged with the other ranges reaching the same block until no range changes.
+    A range that keeps growing makes the depth unbounded after `MAX_LABEL_WIDENINGS` merges.
+    """
+    command_opcodes, args, opcode_table = commands.opcodes, commands.args, commands.opcode_table
+    types, effects, control_opcodes = opcodes.types, opcodes.effects, opcodes.control_opcodes
+
+    # The local segment can only be checked in functions, and the argument segment when the function is called
+    limits = opcodes.function_limits(
+        math.inf if usage.name is None else usage.local_count,
+        math.inf if argument_count is None else argument_count,
+    )
+
+    # Problems keyed by the index of the command, so a command reached along several paths is reported once.
+    # The end of the function is reported under `end`.
+    issues: Dict[int, str] = {}
+
+    # (first command, end, depth at the end, lowest depth, highest depth, calls, last command type, jump target),
+    # with depths relative to the start of the block, and calls as (function name, depth before the call)
+    blocks = []
+    labels: Dict[str, int] = {}
+
+    first = start
+    depth = lowest = highest = 0
+    calls = []
+
+    for index in range(start, end):
+        opcode = command_opcodes[index]
+
+        limit = limits[opcode]
+        if limit is not None and not 0 <= args[index] < limit:
+            command = commands[index]
+            issues[index] = f"`{format_command(command)}`: {segment_issue(command, usage, argument_count)}"
+
+        # Most commands only move the stack
+        if opcode not in control_opcodes:
+            pops, pushes = effects[opcode]
+
+            depth -= pops
+            if depth < lowest:
+                lowest = depth
+
+            depth += pushes
+            if depth > highest:
+                highest = depth
+
+            continue
+
+        type = types[opcode]
+
+        if type == CommandType.C_LABEL:
+            # Labels start a new block, which the previous one runs into
+            if index != first:
+                blocks.append((first, index, depth, lowest, highest, calls, None, None))
+                first = index
+                depth = lowest = highest = 0
+                calls = []
+
+            labels[opcode_table[opcode][1]] = len(blocks)
+
+        pops, pushes = effects[opcode]
+
+        if type == CommandType.C_CALL:
+            calls.append((opcode_table[opcode][1], depth))
+            pops = args[index]
+
+        depth -= pops
+        if depth < lowest:
+            lowest = depth
+
+        depth += pushes
+        if depth > highest:
+            highest = depth
+
+        if type in (CommandType.C_GOTO, CommandType.C_IF, CommandType.C_RETURN):
+            blocks.append((first, index + 1, depth, lowest, highest, calls, type, opcode_table[opcode][1]))
+            first = index + 1
+            depth = lowest = highest = 0
+            calls = []
+
+    if first < end or not blocks:
+        blocks.append((first, end, depth, lowest, highest, calls, None, None))
+
+    # Lowest and highest depth every block has been reached with
+    block_depths: Dict[int, Tuple[int, float]] = {}
+    widenings: Dict[int, int] = {}
+    max_depth = 0
+
+    pending = [(0, 0, 0)]
+
+    while pending:
+        block_index, low, high = pending.pop()
+
+        if block_index == len(blocks):
+            # Code outside of any function ends the program, but a function would run on into the next one
+            if usage.name is not None:
+                issues.setdefault(end, "the end of the function can be reached without returning")
+            continue
+
+        if block_index in block_depths:
+            previous_low, previous_high = block_depths[block_index]
+
+            if previous_low <= low and high <= previous_high:
+                continue
+
+            if high > previous_high:
+                widenings[block_index] = widenings.get(block_index, 0) + 1
+                if widenings[block_index] > MAX_LABEL_WIDENINGS:
+                    high = math.inf
+
+            low, high = min(low, previous_low), max(high, previous_high)
+
+        block_depths[block_index] = (low, high)
+        first, last, depth, lowest, highest, calls, type, target = blocks[block_index]
+
+        if low + lowest < 0:
+            report_underflow(commands, first, last, low, issues)
+
+        for function_name, call_depth in calls:
+            previous = usage.call_depths.get(function_name, 0)
+            usage.call_depths[function_name] = (
+                None if previous is None or high == math.inf else max(previous, max(high + call_depth, 0))
+            )
+
+        max_depth = max(max_depth, high + highest)
+        low, high = max(low + depth, 0), max(high + depth, 0)
+
+        if type in (CommandType.C_GOTO, CommandType.C_IF):
+            if target in labels:
+                pending.append((labels[target], low, high))
+            else:
+                command = commands[last - 1]
+                issues.setdefault(last - 1, f"`{format_command(command)}`: the label is not defined in the function")
+
+        if type is None or type == CommandType.C_IF:
+            pending.append((block_index + 1, low, high))
+
+    for block_index, (low, high) in block_depths.items():
+        label = format_command(commands[blocks[block_index][0]])
+
+        if high == math.inf:
+            issues.setdefault(blocks[block_index][0], f"`{label}`: the stack grows without bound in this loop")
+        elif low != high:
+            issues.setdefault(blocks[block_index][0], f"`{label}`: reached with stack depths from {low} to {high}")
+
+    usage.max_depth = None if max_depth == math.inf else max_depth
+    usage.issues = [issues[index] for index in sorted(issues)]
+
+def report_underflow(commands: CommandArray, first: int, last: int, depth: int, issues: Dict[int, str]):
+    """
+    Helper function that finds the first command of a block that pops more values than the stack holds when the
+    block is entered with `depth` values, and adds it to `issues`.
+    """
+    for index in range(first, last):
+        command = commands[index]
+        pops, pushes = stack_effect(command)
+
+        if depth < pops:
+            issues.setdefault(index, f"`{format_command(command)}`: underflows the stack, since it pops {pops} and the depth can be {depth}")
+            return
+
+        depth += pushes - pops
+
+def analyze_stack(
+    commands: Iterable[Command],
+    argument_counts: Dict[str, int] = None,
+) -> Dict[Optional[str], FunctionStackUsage]:
+    """
+    Checks how every function uses the stack and its segments, without running it. See `analyze_function`.
+
+    Args:
+        commands (Iterable[Command]): The commands of one or more .vm files, in program order.
+        argument_counts (Dict[str, int]): The fewest arguments every function is called with, see
+            `call_argument_counts`. If not given, only the calls in `commands` are counted.
+
+    Returns:
+        The usage of every function by name, and of the code outside of any function under None if there is any.
+    """
+    if not isinstance(commands, CommandArray):
+        commands = CommandArray(commands)
+
+    if argument_counts is None:
+        argument_counts = call_argument_counts(commands)
+
+    functions = {opcode for opcode, (type, _) in enumerate(commands.opcode_table) if type == CommandType.C_FUNCTION}
+    starts = [index for index, opcode in enumerate(commands.opcodes) if opcode in functions]
+
+    opcodes = OpcodeTable(commands)
+    usages: Dict[Optional[str], FunctionStackUsage] = {}
+
+    if not starts or starts[0] > 0:
+        usages[None] = FunctionStackUsage(None)
+        analyze_function(usages[None], commands, opcodes, 0, starts[0] if starts else len(commands))
+
+    for start, end in zip(starts, starts[1:] + [len(commands)]):
+        function = commands[start]
+
+        if function.arg1 not in usages:
+            usages[function.arg1] = FunctionStackUsage(function.arg1, function.arg2)
+            analyze_function(usages[function.arg1], commands, opcodes, start + 1, end, argument_counts.get(function.arg1))
+
+    return usages
+
+def safe_functions(usages: Dict[Optional[str], FunctionStackUsage]) -> Set[Optional[str]]:
+    """
+    Returns the names of the functions whose stack use the analysis could check, i.e. that never underflow, hold
+    a bounded number of values, and only access their segments within bounds. See `CodeWriter` for how this is used.
+    """
+    return {name for name, usage in usages.items() if usage.is_safe}
+
+def stack_requirements(
+    usages: Dict[Optional[str], FunctionStackUsage],
+    pointer_saving_functions: Collection[str] = None,
+) -> Dict[Optional[str], Optional[int]]:
+    """
+    Returns the number of words of stack every function needs, from the start of its frame to the deepest point
+    reached by it and every function it calls. This is None for functions that are recursive, have an unbounded
+    depth, or call a function outside of `usages`.
+
+    The code outside of any function has no frame, so its requirement is the stack the whole program needs
+    when there is no `Sys.init`. See `CodeWriter.write_function` for the layout of frames.
+    """
+    requirements: Dict[Optional[str], Optional[int]] = {}
+    in_progress = set()
+
+    def requirement(name: Optional[str]) -> Optional[int]:
+        if name in requirements:
+            return requirements[name]
+
+        # Recursive calls have no bound without knowing how deep they go. The requirement of the functions in
+        # the cycle is stored once they are done, which makes it None as well.
+        if name in in_progress:
+            return None
+
+        usage = usages.get(name)
+
+        if usage is None or usage.max_depth is None:
+            requirements[name] = None
+            return None
+
+        in_progress.add(name)
+        needed = usage.max_depth
+
+        for callee, call_depth in usage.call_depths.items():
+            callee_needed = requirement(callee)
+
+            if needed is None or call_depth is None or callee_needed is None:
+                needed = None
+            else:
+                needed = max(needed, call_depth + callee_needed)
+
+        in_progress.discard(name)
+
+        if needed is not None and name is not None:
+            saves_pointers = pointer_saving_functions is None or name in pointer_saving_functions
+            needed += CALLER_FRAME_SIZE + 2 * saves_pointers + usage.local_count
+
+        requirements[name] = needed
+        return needed
+
+    for name in usages:
+        requirement(name)
+
+    return requirements
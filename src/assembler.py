@@ -0,0 +1,207 @@
+import sys
+from array import array
+from typing import Dict, Iterable, List, Tuple
+
+PREDEFINED_SYMBOLS = {
+    "SP": 0,
+    "LCL": 1,
+    "ARG": 2,
+    "THIS": 3,
+    "THAT": 4,
+    **{f"R{register}": register for register in range(16)},
+    "SCREEN": 16384,
+    "KBD": 24576,
+}
+
+# Variables are allocated from this address upwards, in order of first use
+VARIABLE_BASE_ADDRESS = 16
+
+# Largest value an A-instruction can hold
+MAX_ADDRESS = 0x7FFF
+
+# Number of words in the instruction memory
+ROM_SIZE = 32768
+
+# The `a` bit and `c1`-`c6` bits of every computation, i.e. bits 12 to 6 of a C-instruction
+COMP_CODES = {
+    "0": 0b0101010,
+    "1": 0b0111111,
+    "-1": 0b0111010,
+    "D": 0b0001100,
+    "A": 0b0110000,
+    "!D": 0b0001101,
+    "!A": 0b0110001,
+    "-D": 0b0001111,
+    "-A": 0b0110011,
+    "D+1": 0b0011111,
+    "A+1": 0b0110111,
+    "D-1": 0b0001110,
+    "A-1": 0b0110010,
+    "D+A": 0b0000010,
+    "D-A": 0b0010011,
+    "A-D": 0b0000111,
+    "D&A": 0b0000000,
+    "D|A": 0b0010101,
+    "M": 0b1110000,
+    "!M": 0b1110001,
+    "-M": 0b1110011,
+    "M+1": 0b1110111,
+    "M-1": 0b1110010,
+    "D+M": 0b1000010,
+    "D-M": 0b1010011,
+    "M-D": 0b1000111,
+    "D&M": 0b1000000,
+    "D|M": 0b1010101,
+}
+
+# Commutative computations may be written either way around, e.g. `M+D` instead of `D+M`
+COMP_CODES.update({
+    "1+D": COMP_CODES["D+1"],
+    "1+A": COMP_CODES["A+1"],
+    "1+M": COMP_CODES["M+1"],
+    "A+D": COMP_CODES["D+A"],
+    "M+D": COMP_CODES["D+M"],
+    "A&D": COMP_CODES["D&A"],
+    "M&D": COMP_CODES["D&M"],
+    "A|D": COMP_CODES["D|A"],
+    "M|D": COMP_CODES["D|M"],
+})
+
+JUMP_CODES = {
+    "": 0b000,
+    "JGT": 0b001,
+    "JEQ": 0b010,
+    "JGE": 0b011,
+    "JLT": 0b100,
+    "JNE": 0b101,
+    "JLE": 0b110,
+    "JMP": 0b111,
+}
+
+# Bits of the destination field of a C-instruction
+DEST_A = 0b100
+DEST_D = 0b010
+DEST_M = 0b001
+
+C_INSTRUCTION_PREFIX = 0b111 << 13
+
+def strip_line(line: str) -> str:
+    """
+    Helper function that removes comments and all whitespace from a line of assembly.
+    """
+    return "".join(line.split("//", 1)[0].split())
+
+def encode_c_instruction(instruction: str) -> int:
+    """
+    Encodes a C-instruction of the form `dest=comp;jump`, where `dest` and `jump` are optional.
+    """
+    dest, comp, jump = "", instruction, ""
+
+    if "=" in comp:
+        dest, comp = comp.split("=", 1)
+    if ";" in comp:
+        comp, jump = comp.split(";", 1)
+
+    if comp not in COMP_CODES:
+        raise ValueError(f"Invalid instruction: {instruction}: Unknown computation {comp}")
+    if jump not in JUMP_CODES:
+        raise ValueError(f"Invalid instruction: {instruction}: Unknown jump {jump}")
+
+    dest_bits = 0
+    for register in dest:
+        if register == "A":
+            dest_bits |= DEST_A
+        elif register == "D":
+            dest_bits |= DEST_D
+        elif register == "M":
+            dest_bits |= DEST_M
+        else:
+            raise ValueError(f"Invalid instruction: {instruction}: Unknown destination {dest}")
+
+    return C_INSTRUCTION_PREFIX | (COMP_CODES[comp] << 6) | (dest_bits << 3) | JUMP_CODES[jump]
+
+def assemble_with_symbols(assembly: str) -> Tuple[array, Dict[str, int]]:
+    """
+    Assembles Hack assembly into machine code, and also returns the symbol table that was used.
+
+    This is a classic two pass assembler: the first pass records the ROM address of every label,
+    and the second pass encodes every instruction, allocating RAM for variables as they are first seen.
+
+    Args:
+        assembly (str): The assembly to assemble, as generated by `CodeWriter`.
+
+    Returns:
+        A tuple of the machine code as an `array("H")` of 16-bit words, and a dictionary mapping every
+        label, variable and predefined symbol to its value.
+    """
+    symbols = dict(PREDEFINED_SYMBOLS)
+    instructions: List[str] = []
+
+    for line in assembly.splitlines():
+        line = strip_line(line)
+
+        if line == "":
+            continue
+
+        if line.startswith("("):
+            if not line.endswith(")"):
+                raise ValueError(f"Invalid label: {line}")
+
+            label = line[1:-1]
+            if label in symbols:
+                raise ValueError(f"Duplicate label: {label}")
+
+            symbols[label] = len(instructions)
+            continue
+
+        instructions.append(line)
+
+    words = array("H")
+    next_variable_address = VARIABLE_BASE_ADDRESS
+
+    for instruction in instructions:
+        if not instruction.startswith("@"):
+            words.append(encode_c_instruction(instruction))
+            continue
+
+        symbol = instruction[1:]
+
+        if symbol.isdigit():
+            value = int(symbol)
+            if value > MAX_ADDRESS:
+                raise ValueError(f"Invalid instruction: {instruction}: Constants can be at most {MAX_ADDRESS}")
+        else:
+            value = symbols.get(symbol)
+
+            if value is None:
+                value = next_variable_address
+                symbols[symbol] = value
+                next_variable_address += 1
+
+        words.append(value)
+
+    return words, symbols
+
+def assemble(assembly: str) -> array:
+    """
+    Assembles Hack assembly into machine code. See `assemble_with_symbols` for details.
+    """
+    return assemble_with_symbols(assembly)[0]
+
+def format_hack(words: Iterable[int]) -> str:
+    """
+    Returns machine code in the textual `.hack` format read by the nand2tetris CPU emulator,
+    with every word written as 16 binary digits on its own line.
+    """
+    return "".join(f"{word:016b}\n" for word in words)
+
+def pack_words(words: array) -> bytes:
+    """
+    Returns machine code as packed binary, with every word stored as 2 bytes in big-endian order.
+    """
+    words = array("H", words)
+
+    if sys.byteorder == "little":
+        words.byteswap()
+
+    return words.tobytes()
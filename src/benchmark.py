@@ -0,0 +1,174 @@
+import os
+import platform
+import random
+import tempfile
+import time
+from typing import Dict, Iterable, List
+from . import __version__
+from .analysis import build_call_graph, kept_functions_by_module
+from .code_writer import MEMORY_SEGMENT_MAP, count_instructions, fast_path_instruction_counts
+from .parser import ArithmeticCommand, Parser
+from .translator import translate_commands
+
+# Relative weights of each kind of command in the generated workloads
+WORKLOAD_MIXES: Dict[str, Dict[str, float]] = {
+    "arithmetic": {"push constant": 0.45, "push segment": 0.05, "pop segment": 0.05, "arithmetic": 0.4, "comparison": 0.05},
+    "segment": {"push constant": 0.15, "push segment": 0.4, "pop segment": 0.35, "arithmetic": 0.05, "comparison": 0.05},
+    "comparison": {"push constant": 0.4, "push segment": 0.05, "pop segment": 0.05, "arithmetic": 0.05, "comparison": 0.45},
+    "mixed": {"push constant": 0.3, "push segment": 0.2, "pop segment": 0.15, "arithmetic": 0.2, "comparison": 0.15},
+}
+
+COMPARISONS = [ArithmeticCommand.EQ, ArithmeticCommand.GT, ArithmeticCommand.LT]
+OTHER_ARITHMETIC = [operation for operation in ArithmeticCommand if operation not in COMPARISONS]
+
+UNARY_ARITHMETIC = (ArithmeticCommand.NEG, ArithmeticCommand.NOT)
+
+def random_segment_access(rng: random.Random):
+    """
+    Helper function that returns a random segment and an index that is valid for it.
+    """
+    segment = rng.choice(list(MEMORY_SEGMENT_MAP))
+
+    if segment == "pointer":
+        return segment, rng.randint(0, 1)
+    if segment == "temp":
+        return segment, rng.randint(0, 7)
+
+    return segment, rng.randint(0, 15)
+
+def generate_workload(mix: str, size: int, seed: int = 0) -> List[str]:
+    """
+    Generates a synthetic VM program of `size` commands, with commands drawn according to `WORKLOAD_MIXES[mix]`.
+    The program never pops from an empty stack, so it is also valid to run.
+    """
+    weights = WORKLOAD_MIXES[mix]
+    kinds = list(weights)
+    rng = random.Random(seed)
+
+    lines = []
+    depth = 0
+
+    while len(lines) < size:
+        kind = rng.choices(kinds, weights=[weights[kind] for kind in kinds])[0]
+
+        # Keep the stack deep enough for the command, pushing a constant instead when it is not
+        required_depth = 2 if kind in ("arithmetic", "comparison") else 1 if kind == "pop segment" else 0
+        if depth < required_depth:
+            kind = "push constant"
+
+        if kind == "push constant":
+            lines.append(f"push constant {rng.randint(0, 32767)}")
+            depth += 1
+        elif kind == "push segment":
+            lines.append("push {} {}".format(*random_segment_access(rng)))
+            depth += 1
+        elif kind == "pop segment":
+            lines.append("pop {} {}".format(*random_segment_access(rng)))
+            depth -= 1
+        elif kind == "comparison":
+            lines.append(rng.choice(COMPARISONS).value)
+            depth -= 1
+        else:
+            operation = rng.choice(OTHER_ARITHMETIC)
+            lines.append(operation.value)
+            if operation not in UNARY_ARITHMETIC:
+                depth -= 1
+
+    return lines
+
+def benchmark_file(
+    input_file: str,
+    repeat: int = 3,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    backend: str = "stack",
+) -> dict:
+    """
+    Translates a .vm file `repeat` times and returns the fastest parse and code generation times,
+    along with the size of the generated code.
+
+    The file is translated the way `hack-vm-translate` translates a program made of it alone: functions that
+    cannot be reached from `Sys.init` are left out, and code generation includes the analyses run by
+    `translate_commands`.
+    """
+    parse_seconds = float("inf")
+    codegen_seconds = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        commands = Parser(input_file).parse_all()
+        parse_seconds = min(parse_seconds, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        kept_functions = kept_functions_by_module([build_call_graph(commands)])[0]
+        assembly = translate_commands(
+            commands,
+            os.path.basename(input_file).removesuffix(".vm"),
+            optimize,
+            shared_comparisons,
+            kept_functions,
+            backend,
+        )
+        codegen_seconds = min(codegen_seconds, time.perf_counter() - start)
+
+    command_count = len(commands)
+    instruction_count = count_instructions(assembly)
+
+    return {
+        "commands": command_count,
+        "parse_seconds": parse_seconds,
+        "codegen_seconds": codegen_seconds,
+        "commands_per_second": command_count / (parse_seconds + codegen_seconds) if command_count else 0.0,
+        "bytes_written": len(assembly.encode()),
+        "instructions": instruction_count,
+        "instructions_per_command": instruction_count / command_count if command_count else 0.0,
+    }
+
+def run_benchmarks(
+    size: int = 100_000,
+    mixes: Iterable[str] = tuple(WORKLOAD_MIXES),
+    input_files: Iterable[str] = (),
+    repeat: int = 3,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    seed: int = 0,
+    backend: str = "stack",
+) -> dict:
+    """
+    Benchmarks the translator on a synthetic workload for every mix in `mixes` and on every file in `input_files`.
+    Returns a JSON serializable report that can be compared between releases. The report also lists the
+    instructions taken by every push and pop with a specialized sequence, next to the general one.
+    """
+    results = []
+
+    with tempfile.TemporaryDirectory() as workload_dir:
+        workloads = []
+
+        for mix in mixes:
+            workload_file = os.path.join(workload_dir, f"{mix.capitalize()}.vm")
+
+            with open(workload_file, "w") as file:
+                file.writelines(f"{line}\n" for line in generate_workload(mix, size, seed))
+
+            workloads.append((f"synthetic:{mix}", workload_file))
+
+        workloads += [(input_file, input_file) for input_file in input_files]
+
+        for name, input_file in workloads:
+            result = benchmark_file(input_file, repeat, optimize, shared_comparisons, backend)
+            results.append({"name": name, **result})
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "options": {
+            "size": size,
+            "repeat": repeat,
+            "optimize": optimize,
+            "shared_comparisons": shared_comparisons,
+            "seed": seed,
+            "backend": backend,
+        },
+        "results": results,
+        "fast_paths": fast_path_instruction_counts(),
+    }
@@ -0,0 +1,238 @@
+import functools
+import hashlib
+import json
+import os
+from typing import Dict, Optional, Set, TextIO, Tuple
+from . import __version__
+from .files import write_atomically
+
+# Used when neither --cache-dir nor HACK_VM_TRANSLATE_CACHE_DIR is set
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "hack-vm-translator",
+)
+
+DEFAULT_MAX_CACHE_SIZE = 256 * 1024 * 1024
+
+CACHE_FILE_EXTENSION = ".asm"
+
+# Each entry may have a small JSON file of metadata next to it, such as what the generated code uses
+METADATA_FILE_EXTENSION = ".meta.json"
+
+# Call graphs of files are stored next to the translations, so unchanged files never have to be parsed
+CALL_GRAPH_FILE_EXTENSION = ".calls.json"
+
+# Modules whose code decides the generated assembly. A hash of their source is part of every key, so changes to
+# the code generator invalidate the cache even when the version number stays the same.
+CODE_GENERATION_MODULES = (
+    "analysis",
+    "code_writer",
+    "optimizer",
+    "parser",
+    "peephole",
+    "register_writer",
+    "translator",
+)
+
+@functools.lru_cache(maxsize=None)
+def code_generation_digest() -> str:
+    """
+    Returns a hash of the source of every module in `CODE_GENERATION_MODULES`, computed once per process.
+    """
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    for module in CODE_GENERATION_MODULES:
+        with open(os.path.join(directory, f"{module}.py"), "rb") as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+def file_digest(input_file: str) -> str:
+    """
+    Returns a hash of the contents of a file, read in blocks so large files are never held in memory.
+    """
+    digest = hashlib.sha256()
+
+    with open(input_file, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+class TranslationCache:
+    """
+    An on-disk cache mapping the contents of a .vm file to the assembly generated for it.
+
+    Entries are keyed by a hash of the file contents, the file name (which static symbols and labels are
+    namespaced by), the translator version, the source of the code generator and the translation options,
+    so any change to one of them results in a miss. Each entry is stored in its own file, and the modification time of that file records when it was
+    last used so the least recently used entries can be evicted once the cache grows past `max_size` bytes.
+    Entries can be written directly to `path(key)`, e.g. by a `CodeWriter`, and read back with `open` so large
+    translations are never held in memory.
+
+    The call graph of every file is cached as well, keyed by the file contents alone, so that deciding which
+    functions to leave out of a program does not parse the files whose translation is already cached.
+    """
+    def __init__(self, directory: str = None, max_size: int = DEFAULT_MAX_CACHE_SIZE):
+        if directory is None:
+            directory = os.environ.get("HACK_VM_TRANSLATE_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+        self.directory = directory
+        self.max_size = max_size
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, input_file: str, options: dict, contents_digest: str = None) -> str:
+        """
+        Returns the cache key for translating `input_file` with the given options.
+
+        Args:
+            input_file (str): The path of the .vm file.
+            options (dict): Every option that affects the generated assembly. Values must be JSON serializable.
+            contents_digest (str): The `file_digest` of `input_file`, if it is already known.
+        """
+        return hashlib.sha256(json.dumps({
+            "version": __version__,
+            "code_generation": code_generation_digest(),
+            "filename": os.path.basename(input_file),
+            "options": options,
+            "contents": contents_digest or file_digest(input_file),
+        }, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the cached assembly for `key`, or None if it is not in the cache.
+        """
+        path = self.path(key)
+
+        try:
+            with open(path, "r") as file:
+                assembly = file.read()
+        except FileNotFoundError:
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return assembly
+
+    def __contains__(self, key: str) -> bool:
+        """
+        Returns whether the entry for `key` and its metadata are both in the cache, so `open` would return it.
+        """
+        return os.path.exists(self.path(key)) and os.path.exists(self.metadata_path(key))
+
+    def open(self, key: str) -> Optional[Tuple[TextIO, dict]]:
+        """
+        Opens the cached assembly for `key` for reading, and returns it along with the metadata stored with it.
+        Returns None if the entry or its metadata is not in the cache.
+        """
+        path = self.path(key)
+
+        try:
+            with open(self.metadata_path(key), "r") as file:
+                metadata = json.load(file)
+
+            entry = open(path, "r")
+        except FileNotFoundError:
+            return None
+
+        # Mark the entry and its metadata as recently used, so they are evicted together
+        for used_path in (path, self.metadata_path(key)):
+            try:
+                os.utime(used_path)
+            except FileNotFoundError:
+                pass
+
+        return entry, metadata
+
+    def put(self, key: str, assembly: str, metadata: dict = None):
+        """
+        Stores the assembly for `key`, along with `metadata` if it is given. The entry is written to a temporary
+        file first and renamed into place, so concurrent builds sharing the cache never read a partial entry.
+        """
+        write_atomically(self.path(key), assembly)
+
+        if metadata is not None:
+            self.put_metadata(key, metadata)
+
+    def metadata_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + METADATA_FILE_EXTENSION)
+
+    def put_metadata(self, key: str, metadata: dict):
+        """
+        Stores the metadata of the entry for `key`, which has to be JSON serializable. Store it once the entry
+        itself is in place, since `open` only returns entries that have metadata.
+        """
+        write_atomically(self.metadata_path(key), json.dumps(metadata))
+
+    def call_graph_path(self, contents_digest: str) -> str:
+        key = hashlib.sha256(f"{__version__}:{code_generation_digest()}:{contents_digest}".encode()).hexdigest()
+        return os.path.join(self.directory, key + CALL_GRAPH_FILE_EXTENSION)
+
+    def get_call_graph(self, contents_digest: str) -> Optional[Dict[str, Set[str]]]:
+        """
+        Returns the cached call graph of the file with the given `file_digest`, see `analysis.build_call_graph`,
+        or None if it is not in the cache.
+        """
+        path = self.call_graph_path(contents_digest)
+
+        try:
+            with open(path, "r") as file:
+                call_graph = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        # Mark the call graph as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return {function: set(callees) for function, callees in call_graph.items()}
+
+    def put_call_graph(self, contents_digest: str, call_graph: Dict[str, Set[str]]):
+        """
+        Stores the call graph of the file with the given `file_digest`.
+        """
+        data = {function: sorted(callees) for function, callees in call_graph.items()}
+        write_atomically(self.call_graph_path(contents_digest), json.dumps(data))
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache is no larger than `max_size` bytes.
+        """
+        entries = []
+        total_size = 0
+
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith((CACHE_FILE_EXTENSION, METADATA_FILE_EXTENSION, CALL_GRAPH_FILE_EXTENSION)):
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        entries.sort()
+
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+            total_size -= size
@@ -0,0 +1,81 @@
+import json
+import socket
+from typing import Iterable, List, Tuple, Union
+
+# Address the server listens on when neither a Unix socket nor a port is given
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7355
+
+class TranslationClient:
+    """
+    A client for the server started by `hack-vm-translate serve`.
+
+    Requests and responses are single lines of JSON, so one connection can be reused for any number of
+    translations. This module only depends on the standard library, so clients start up quickly.
+    """
+    def __init__(self, socket_path: str = None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """
+        Args:
+            socket_path (str): The path of the Unix socket the server listens on. If not given, the client
+                connects to `host` and `port` over TCP instead.
+        """
+        if socket_path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(socket_path)
+        else:
+            self.socket = socket.create_connection((host, port))
+
+        self.file = self.socket.makefile("rwb")
+        self.request_count = 0
+
+    def translate(
+        self,
+        modules: List[Tuple[str, Union[str, Iterable[str]]]],
+        emit: str = "asm",
+        optimize: bool = False,
+        shared_comparisons: bool = False,
+        remove_unused_functions: bool = True,
+        backend: str = "stack",
+    ) -> str:
+        """
+        Translates a program on the server and returns the assembly, or the machine code in the `.hack` format
+        if `emit` is `hack`. See `translator.translate_program` for the other arguments.
+        """
+        self.request_count += 1
+
+        request = {
+            "id": self.request_count,
+            "modules": [
+                {"name": module_name, "source": source if isinstance(source, str) else "\n".join(source)}
+                for module_name, source in modules
+            ],
+            "emit": emit,
+            "optimize": optimize,
+            "shared_comparisons": shared_comparisons,
+            "remove_unused_functions": remove_unused_functions,
+            "backend": backend,
+        }
+
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection")
+
+        response = json.loads(line)
+
+        if "error" in response:
+            raise RuntimeError(f"Translation failed: {response['error']}")
+
+        return response["output"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self) -> "TranslationClient":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
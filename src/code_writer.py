@@ -1,4 +1,7 @@
+import io
 import os
+from typing import Collection, Dict, Optional, TextIO, Union
+from .files import AtomicFile
 from .parser import Command, CommandType, ArithmeticCommand 
 
 MEMORY_SEGMENT_MAP = {
@@ -14,366 +17,580 @@ MEMORY_SEGMENT_MAP = {
 
 STACK_POINTER = "SP"
 
+# Number of characters of generated assembly collected in memory before they are written out in one go
+DEFAULT_OUTPUT_BUFFER_SIZE = 1 << 20
+
 TEMP_BASE_ADDRESS = 5
 
+# The jump condition used by each comparison command to decide if the result is true
+COMPARISON_JUMPS = {
+    ArithmeticCommand.EQ: "JEQ",
+    ArithmeticCommand.GT: "JGT",
+    ArithmeticCommand.LT: "JLT",
+}
+
+# Register used by the shared comparison routines to hold the return address
+RETURN_ADDRESS_REGISTER = "R13"
+
+# Registers used to pass the address of the callee and the number of arguments to the shared call routine
+CALL_TARGET_REGISTER = "R13"
+CALL_ARGUMENT_COUNT_REGISTER = "R14"
+
+# Labels of the shared routines implementing `call` and `return`. `$` cannot appear in VM function names,
+# so these never clash with the labels of the program.
+CALL_ROUTINE_LABEL = "VM$CALL"
+RETURN_ROUTINE_LABEL = "VM$RETURN"
+RETURN_RESTORING_POINTERS_ROUTINE_LABEL = "VM$RETURN_RESTORING_POINTERS"
+
+# Number of words pushed by the caller on every call: the return address and the saved LCL and ARG
+CALLER_FRAME_SIZE = 3
+
+STACK_BASE_ADDRESS = 256
+
+# Bottom of the heap, where the stack must end
+HEAP_BASE_ADDRESS = 2048
+
+# Segments that map to a fixed register, so their templates take the register name in the `address` slot
+DIRECT_SEGMENTS = ("static", "temp", "pointer")
+
+# Segments that are addressed through a base pointer
+INDIRECT_SEGMENTS = ("local", "argument", "this", "that")
+
+# Constants the Hack ALU can produce in a single instruction, so they never need an A-instruction to load
+ALU_CONSTANTS = (-1, 0, 1)
+
+# Largest offset into an indirect segment that is read by stepping A up from the base address one at a time.
+# Beyond this, adding the offset to the base address in D is as short.
+MAX_STEPPED_LOAD_OFFSET = 2
+
+# Largest offset into an indirect segment that is written by stepping A up from the base address one at a time.
+# Larger offsets keep the address in a temporary register while the value is popped, which takes more instructions.
+MAX_STEPPED_STORE_OFFSET = 6
+
 class CodeWriter:
-    def __init__(self, output_file_path: str):
-        if not output_file_path.endswith(".asm"):
-            raise ValueError(f"Invalid file extension: {output_file_path}")
+    def __init__(
+        self,
+        output: Union[str, TextIO],
+        shared_comparisons: bool = False,
+        pointer_saving_functions: Collection[str] = None,
+        buffer_size: int = DEFAULT_OUTPUT_BUFFER_SIZE,
+        safe_functions: Collection[Optional[str]] = None,
+    ):
+        """
+        Args:
+            output (str | TextIO): Either the path of the .asm file to create, or an already open
+                text stream to write to, such as `sys.stdout`. Streams are not closed by `close()`, and their static
+                symbols are named after `set_filename` rather than the output path. Files are written to a
+                temporary file and only renamed to `output` by `close()`, so no one ever sees a partial file.
+                Use the writer in a `with` block, or call `discard()` on failure, to delete the temporary file.
+            shared_comparisons (bool): If set, `eq`, `gt` and `lt` jump to the shared routines written by
+                `write_comparison_routines` instead of inlining the whole comparison at every call site.
+            pointer_saving_functions (Collection[str]): Names of the functions that change THIS or THAT, and so have to
+                save and restore them. See `analysis.functions_modifying_pointers`. If not given, every function
+                saves them, which is always correct but makes every call slower.
+            buffer_size (int): Number of characters collected in memory before they are written to `output`.
+                Call `flush()` to write them out earlier.
+            safe_functions (Collection[str | None]): Names of the functions whose stack use has been checked, see
+                `analysis.safe_functions`, with None standing for the code outside of any function. Their pops
+                leave the popped value in RAM above the stack pointer instead of clearing it to 0, which saves an
+                instruction per pop. If not given, every pop clears its slot.
+        """
+        if isinstance(output, str):
+            if not output.endswith(".asm"):
+                raise ValueError(f"Invalid file extension: {output}")
+
+            self.sink = AtomicFile(output)
+            self.owns_output_file = True
+            self.filename = os.path.basename(output).split(".")[0]
+        else:
+            self.sink = output
+            self.owns_output_file = False
+            self.filename = ""
 
-        self.output_file = open(output_file_path, "w")
-        if not self.output_file:
-            raise FileNotFoundError(f"Could not open output file: {output_file_path}")
-        
-        self.filename = os.path.basename(output_file_path).split(".")[0]
+        # Commands are translated into this buffer, which is written to the sink in large blocks rather than
+        # a few lines at a time. In-memory streams are written to directly, since buffering them gains nothing.
+        if isinstance(output, io.StringIO):
+            self.output_file = output
+            self.sink = None
+        else:
+            self.output_file = io.StringIO()
+
+        self.buffer_size = buffer_size
 
         # This counter is used to create unique labels for each arithmetic command
         self.label_counter = 0
-        
+
+        # Prepended to generated labels so that translations of several files can share one .asm file
+        self.label_prefix = ""
+
+        self.shared_comparisons = shared_comparisons
+
+        # Number of comparison commands that were translated into calls to the shared routines
+        self.comparison_call_count = 0
+
+        self.pointer_saving_functions = pointer_saving_functions
+
+        self.safe_functions = safe_functions or ()
+
+        # Name of the function being translated, which labels are scoped to
+        self.current_function = None
+
+        # Whether the current function saved THIS and THAT on entry and has to restore them on return
+        self.current_function_saves_pointers = False
+
+        # Set once a call or return has been written, since those jump to the routines written by `write_call_routines`
+        self.uses_call_routines = False
+
+        # Templates used for the current function, which depend on whether its pops have to clear the stack
+        self.select_templates()
+
+    def set_filename(self, filename: str):
+        """
+        Informs the writer that the translation of a new .vm file has started.
+        Static variables and generated labels are namespaced by this name so they stay unique
+        when the output of several files is merged into one program.
+
+        Args:
+            filename (str): The name of the .vm file without its directory or extension, e.g. `Foo`.
+        """
+        self.filename = filename
+        self.label_prefix = f"{filename}."
+
     def write_command(self, command: Command):
+        self.translate_command(command)
+
+        if self.sink is not None and self.output_file.tell() >= self.buffer_size:
+            self.flush()
+
+    def translate_command(self, command: Command):
         if command.type == CommandType.C_ARITHMETIC:
             self.write_arithmetic(command)
         elif command.type == CommandType.C_PUSH or command.type == CommandType.C_POP:
             self.write_push_pop(command)
+        elif command.type == CommandType.C_MOVE:
+            self.write_move(command)
+        elif command.type == CommandType.C_LABEL:
+            self.write_label(command.arg1)
+        elif command.type == CommandType.C_GOTO:
+            self.write_goto(command.arg1)
+        elif command.type == CommandType.C_IF:
+            self.write_if(command.arg1)
+        elif command.type == CommandType.C_FUNCTION:
+            self.write_function(command.arg1, command.arg2)
+        elif command.type == CommandType.C_CALL:
+            self.write_call(command.arg1, command.arg2)
+        elif command.type == CommandType.C_RETURN:
+            self.write_return()
 
-    # This is extremely messy and should eventually be refactored
-    # There are a lot of duplicate assembly lines that can be refactored into repeatable functions
     def write_arithmetic(self, command: Command):
-        if command.arg1 == ArithmeticCommand.ADD:
-            self.output_file.writelines([
-                "// add\n",
-                *self.pop_from_stack(),
-                *self.point_to_top_of_stack(),
-                "M=D+M\n",
-                *self.increment_stack_pointer()
-            ])
-        elif command.arg1 == ArithmeticCommand.SUB:
-            self.output_file.writelines([
-                "// sub\n",
-                *self.pop_from_stack(),
-                *self.point_to_top_of_stack(),
-                "M=M-D\n",
-                *self.increment_stack_pointer()
-            ])
-        elif command.arg1 == ArithmeticCommand.NEG:
-            self.output_file.writelines([
-                "// neg\n",
-                *self.point_to_top_of_stack(),
-                "M=-M\n",
-                *self.increment_stack_pointer()
-            ])
-        elif command.arg1 == ArithmeticCommand.EQ:
-            self.output_file.writelines([
-                "// eq\n",
-                # Get the value at the top of the stack
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M\n",
-                # Clear the value at the top of the stack
-                "M=0\n",
-                # Decrement the stack pointer and subtract the stored value with the current value
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M-D\n",
-                # Jump logic to set the value at the top of the stack to 1 if the result is 0
-                f"@IS_EQ_{self.label_counter}\n",
-                "D;JEQ\n",
-                f"(NOT_EQ_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                "   M=0\n",
-                f"   @END_EQ_{self.label_counter}\n",
-                "   0;JMP\n",
-                f"(IS_EQ_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                # -1 is the largest value in a 16-bit register so we use it to indicate true
-                "   M=-1\n",
-                f"(END_EQ_{self.label_counter})\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n",
-            ])
+        if self.shared_comparisons and command.arg1 in COMPARISON_JUMPS:
+            self.write_comparison_call(command)
+            return
 
-            # Increment the label counter so the next command that involves jumping will have a unique label
-            self.label_counter += 1
+        template = self.templates[(CommandType.C_ARITHMETIC, command.arg1)]
 
-        elif command.arg1 == ArithmeticCommand.GT:
-            self.output_file.writelines([
-                "// gt\n",
-                # Get the value at the top of the stack
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M\n",
-                # Clear the value at the top of the stack
-                "M=0\n",
-                # Decrement the stack pointer and subtract the stored value with the current value
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M-D\n",
-                # Jump logic to set the value at the top of the stack to 1 if the result is 0
-                f"@IS_GT_{self.label_counter}\n",
-                "D;JGT\n",
-                f"(NOT_GT_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                "   M=0\n",
-                f"   @END_GT_{self.label_counter}\n",
-                "   0;JMP\n",
-                f"(IS_GT_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                # -1 is the largest value in a 16-bit register so we use it to indicate true
-                "   M=-1\n",
-                f"(END_GT_{self.label_counter})\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n",
-            ])
+        if command.arg1 in COMPARISON_JUMPS:
+            self.output_file.write(template.format(prefix=self.label_prefix, id=self.label_counter))
 
             # Increment the label counter so the next command that involves jumping will have a unique label
             self.label_counter += 1
+            return
 
-        elif command.arg1 == ArithmeticCommand.LT:
-            self.output_file.writelines([
-                "// lt\n",
-                # Get the value at the top of the stack
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M\n",
-                # Clear the value at the top of the stack
-                "M=0\n",
-                # Decrement the stack pointer and subtract the stored value with the current value
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M-D\n",
-                # Jump logic to set the value at the top of the stack to 1 if the result is 0
-                f"@IS_LT_{self.label_counter}\n",
-                "D;JLT\n",
-                f"(NOT_LT_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                "   M=0\n",
-                f"   @END_LT_{self.label_counter}\n",
-                "   0;JMP\n",
-                f"(IS_LT_{self.label_counter})\n",
-                f"   @{STACK_POINTER}\n",
-                "   A=M\n",
-                # -1 is the largest value in a 16-bit register so we use it to indicate true
-                "   M=-1\n",
-                f"(END_LT_{self.label_counter})\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n",
-            ])
+        self.output_file.write(template)
 
-            # Increment the label counter so the next command that involves jumping will have a unique label
-            self.label_counter += 1
+    def write_push_pop(self, command: Command):
+        segment = command.arg1
+        index = command.arg2
 
-        elif command.arg1 == ArithmeticCommand.AND:
-            self.output_file.writelines([
-                "// and\n",
-                # Get the value at the top of the stack
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M\n",
-                # Clear the value at the top of the stack
-                "M=0\n",
-                # Decrement the stack pointer and AND the stored value with the current value
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "M=D&M\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n",
-            ])
-        elif command.arg1 == ArithmeticCommand.OR:
-            self.output_file.writelines([
-                "// or\n",
-                # Get the value at the top of the stack
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "D=M\n",
-                # Clear the value at the top of the stack
-                "M=0\n",
-                # Decrement the stack pointer and OR the stored value with the current value
-                f"@{STACK_POINTER}\n",
-                "AM=M-1\n",
-                "M=D|M\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n",
-            ])
-        elif command.arg1 == ArithmeticCommand.NOT:
-            self.output_file.writelines([
-                "// not\n",
-                *self.point_to_top_of_stack(),
-                "M=!M\n",   
-                *self.increment_stack_pointer()
-            ])
+        # Constants and offsets with a shorter sequence than the general template are looked up by their value
+        template = self.fast_path_templates.get((command.type, segment, index))
 
-    def write_push_pop(self, command: Command):
-        if not command.arg1 or not command.arg2:
+        if template is not None:
+            self.output_file.write(template)
+            return
+
+        if not segment or index is None:
             raise ValueError("Invalid command")
-        
-        if command.type == CommandType.C_POP and command.arg1 == "constant":
-            raise ValueError("Cannot pop constant")
-        
-        if command.arg1 == "constant":
+
+        template = self.templates.get((command.type, segment))
+
+        if template is None:
+            if segment == "constant":
+                raise ValueError("Cannot pop constant")
+            raise ValueError(f"Invalid memory segment: {segment}")
+
+        # Negative constants are only produced by the optimizer and need more than one instruction to load
+        if segment == "constant" and index < 0:
             self.output_file.writelines([
-                f"// push constant {command.arg2}\n",
-                *self.push_to_stack(command.arg2),
+                f"// push constant {index}\n",
+                *self.push_to_stack(index),
                 *self.increment_stack_pointer()
             ])
             return
-        
-        if command.arg1 not in MEMORY_SEGMENT_MAP:
-            raise ValueError(f"Invalid memory segment: {command.arg1}")
-
-        # Handle static segment
-        if command.arg1 == "static":
-            dest_address = f"{self.filename}.{command.arg2}"
-
-            if command.type == CommandType.C_PUSH:
-                self.output_file.writelines([
-                    f"// push static {command.arg2}\n",
-                    f"@{dest_address}\n",
-                    "D=M\n",
-                    f"@{STACK_POINTER}\n",
-                    "A=M\n",
-                    "M=D\n",
-                    f"@{STACK_POINTER}\n",
-                    "M=M+1\n",
-                ])
-                return
-            
-            if command.type == CommandType.C_POP:
-                self.output_file.writelines([
-                    f"// pop static {command.arg2}\n",
-                    *self.pop_from_stack(),
-                    f"@{dest_address}\n",
-                    "M=D\n",
-                ])
-                return
-
-        # Handle temp segment
-        if command.arg1 == "temp":
-            if int(command.arg2) > 7:
-                raise ValueError(f"Temp register address out of bounds: {command.arg2}")
-            
-            dest_segment = f"R{TEMP_BASE_ADDRESS + int(command.arg2)}"
-
-            if command.type == CommandType.C_PUSH:
-                self.output_file.writelines([
-                    f"// push temp {command.arg2}\n",
-                    f"@{dest_segment}\n",
-                    "D=M\n",
-                    f"@{STACK_POINTER}\n",
-                    "A=M\n",
-                    "M=D\n",
-                    f"@{STACK_POINTER}\n",
-                    "M=M+1\n",
-                ])
-                return
-            
-            if command.type == CommandType.C_POP:
-                self.output_file.writelines([
-                    f"// pop temp {command.arg2}\n",
-                    f"@{STACK_POINTER}\n",
-                    "AM=M-1\n",
-                    "D=M\n",
-                    "M=0\n",
-                    f"@{dest_segment}\n",
-                    "M=D\n",
-                ])
-                return
 
-        dest_segment = MEMORY_SEGMENT_MAP[command.arg1]
+        address = self.direct_address(segment, index) if segment in DIRECT_SEGMENTS else None
 
+        self.output_file.write(template.format(index=index, address=address))
 
-        # Handle pointer segment
-        if command.arg1 == "pointer":
-            if int(command.arg2) not in (0, 1):
-                raise ValueError(f"Pointer values can only be 0 or 1")
-            
-            dest_segment = "THIS" if int(command.arg2) == 0 else "THAT"
+    def write_move(self, command: Command):
+        """
+        Writes a `C_MOVE` command, which copies `command.source` into `command.arg1`/`command.arg2`
+        directly instead of pushing it to the stack and popping it again.
+        """
+        source = command.source
 
-            if command.type == CommandType.C_PUSH:
-                self.output_file.writelines([
-                    f"// push {command.arg1} {command.arg2}\n",
-                    f"@{dest_segment}\n",
-                    "D=M\n",
-                    f"@{STACK_POINTER}\n",
-                    "A=M\n",
-                    "M=D\n",
-                    f"@{STACK_POINTER}\n",
-                    "M=M+1\n",
-                ])
-                return
-            
-            if command.type == CommandType.C_POP:
-                self.output_file.writelines([
-                    f"// pop {command.arg1} {command.arg2}\n",
-                    # Set the address to the top of the stack
-                    f"@{STACK_POINTER}\n",
-                    "AM=M-1\n",
-                    "D=M\n",
-                    # Clear the value at the top of the stack
-                    "M=0\n",
-                    # Store the value in THIS or THAT
-                    f"@{dest_segment}\n",
-                    "M=D\n"
-                ])
-                return
-
-        # Handle LOCAL, ARGUMENT, THIS, THAT
-        if command.type == CommandType.C_PUSH:
-            self.output_file.writelines([
-                f"// push {command.arg1} {command.arg2}\n",
-                # Take the address of the segment
-                f"@{dest_segment}\n",
-                "D=M\n",
-                # Increment the address by the offset
-                f"@{command.arg2}\n",
-                f"D=D+A\n",
-                # Take the value at the selected address and push it to the stack
-                "A=D\n",
-                "D=M\n",
-                f"@{STACK_POINTER}\n",
-                "A=M\n",
-                "M=D\n",
-                # Increment the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M+1\n"
-            ])
+        if command.arg1 == "constant":
+            raise ValueError("Cannot pop constant")
 
-        if command.type == CommandType.C_POP:
-            self.output_file.writelines([
-                f"// pop {command.arg1} {command.arg2}\n",
-                # Decrement the stack pointer
-                f"@{STACK_POINTER}\n",
-                "M=M-1\n"
-                # Calculate the selected address
-                f"@{dest_segment}\n",
+        lines = [f"// push {source.arg1} {source.arg2} / pop {command.arg1} {command.arg2}\n"]
+
+        dest_address = self.direct_address(command.arg1, command.arg2)
+
+        if dest_address is not None:
+            lines += [
+                *self.load_segment_value(source.arg1, source.arg2),
+                f"@{dest_address}\n",
+                "M=D\n",
+            ]
+        elif command.arg2 <= MAX_STEPPED_STORE_OFFSET:
+            lines += [
+                *self.load_segment_value(source.arg1, source.arg2),
+                *self.point_to_segment_offset(command.arg1, command.arg2),
+                "M=D\n",
+            ]
+        else:
+            lines += [
+                # Calculate the selected address and store it in a temporary register
+                f"@{MEMORY_SEGMENT_MAP[command.arg1]}\n",
                 "D=M\n",
                 f"@{command.arg2}\n",
                 "D=D+A\n",
-                # Store the address in a temporary register
                 "@R15\n",
                 "M=D\n",
-                # Take the value addressed by the stack pointer
-                f"@{STACK_POINTER}\n",
-                "A=M\n",
-                "D=M\n",
-                # Clear the value from the stack
-                "M=0\n",
-                # Store this value in the selected address
+                # Store the source value in the selected address
+                *self.load_segment_value(source.arg1, source.arg2),
                 "@R15\n",
                 "A=M\n",
                 "M=D\n",
-            ])
+            ]
+
+        self.output_file.writelines(lines)
 
-    def decrement_stack_pointer(self):
+    def select_templates(self):
+        """
+        Helper function that picks the templates for the code that follows, leaving out the stores that clear
+        popped values if the current function is in `safe_functions`.
+        """
+        if self.current_function in self.safe_functions:
+            self.templates = TEMPLATES_WITHOUT_CLEARING
+            self.fast_path_templates = FAST_PATH_TEMPLATES_WITHOUT_CLEARING
+        else:
+            self.templates = TEMPLATES
+            self.fast_path_templates = FAST_PATH_TEMPLATES
+
+    def scoped_label(self, label: str) -> str:
+        """
+        Helper function that returns the assembly label of a VM label. Labels are scoped to the function
+        they appear in, or to the file for code outside of any function.
+        """
+        return f"{self.current_function or self.filename}${label}"
+
+    def write_label(self, label: str):
+        self.output_file.write(f"({self.scoped_label(label)})\n")
+
+    def write_goto(self, label: str):
+        self.output_file.writelines([
+            f"// goto {label}\n",
+            f"@{self.scoped_label(label)}\n",
+            "0;JMP\n",
+        ])
+
+    def write_if(self, label: str):
+        """
+        Writes an `if-goto` command, which pops the value at the top of the stack and jumps if it is not 0.
+        """
+        self.output_file.writelines([
+            f"// if-goto {label}\n",
+            *self.point_to_top_of_stack(),
+            "D=M\n",
+            f"@{self.scoped_label(label)}\n",
+            "D;JNE\n",
+        ])
+
+    def write_function(self, function_name: str, local_count: int):
+        """
+        Writes the entry point of a function.
+
+        The caller has already pushed the return address and its LCL and ARG. If the function changes THIS or
+        THAT it pushes them as well, which gives the standard 5 word frame, and otherwise leaves them out.
+        The local segment then starts at the top of the stack and every local is initialized to 0.
+        """
+        self.current_function = function_name
+        self.current_function_saves_pointers = (
+            self.pointer_saving_functions is None or function_name in self.pointer_saving_functions
+        )
+        self.select_templates()
+
+        lines = [f"// function {function_name} {local_count}\n", f"({function_name})\n"]
+
+        if self.current_function_saves_pointers:
+            for pointer in ("THIS", "THAT"):
+                lines += [
+                    f"@{pointer}\n",
+                    "D=M\n",
+                    f"@{STACK_POINTER}\n",
+                    "A=M\n",
+                    "M=D\n",
+                    *self.increment_stack_pointer(),
+                ]
+
+        lines += [
+            f"@{STACK_POINTER}\n",
+            "D=M\n",
+            "@LCL\n",
+            "M=D\n",
+        ]
+
+        if local_count > 0:
+            # Clear every local and move the stack pointer past them in one go
+            lines += ["A=D\n"]
+            lines += ["M=0\n", "A=A+1\n"] * local_count
+            lines += [
+                "D=A\n",
+                f"@{STACK_POINTER}\n",
+                "M=D\n",
+            ]
+
+        self.output_file.writelines(lines)
+
+    def write_call(self, function_name: str, argument_count: int):
+        """
+        Writes a call as a jump to the shared call routine, passing the address of the callee in R13,
+        the number of arguments in R14 and the return address in D.
+        """
+        return_label = f"{self.current_function or self.filename}$ret.{self.label_counter}"
+
+        if argument_count in (0, 1):
+            load_argument_count = [f"@{CALL_ARGUMENT_COUNT_REGISTER}\n", f"M={argument_count}\n"]
+        else:
+            load_argument_count = [
+                f"@{argument_count}\n",
+                "D=A\n",
+                f"@{CALL_ARGUMENT_COUNT_REGISTER}\n",
+                "M=D\n",
+            ]
+
+        self.output_file.writelines([
+            f"// call {function_name} {argument_count}\n",
+            f"@{function_name}\n",
+            "D=A\n",
+            f"@{CALL_TARGET_REGISTER}\n",
+            "M=D\n",
+            *load_argument_count,
+            f"@{return_label}\n",
+            "D=A\n",
+            f"@{CALL_ROUTINE_LABEL}\n",
+            "0;JMP\n",
+            f"({return_label})\n",
+        ])
+
+        self.label_counter += 1
+        self.uses_call_routines = True
+
+    def write_return(self):
+        routine_label = (
+            RETURN_RESTORING_POINTERS_ROUTINE_LABEL if self.current_function_saves_pointers else RETURN_ROUTINE_LABEL
+        )
+
+        self.output_file.writelines([
+            "// return\n",
+            f"@{routine_label}\n",
+            "0;JMP\n",
+        ])
+
+        self.uses_call_routines = True
+
+    def write_init(self):
+        """
+        Writes the bootstrap code, which sets up the stack and calls `Sys.init`.
+        This should be written once per program, before any other code.
+        """
+        self.output_file.writelines([
+            "// bootstrap\n",
+            f"@{STACK_BASE_ADDRESS}\n",
+            "D=A\n",
+            f"@{STACK_POINTER}\n",
+            "M=D\n",
+        ])
+
+        self.write_call("Sys.init", 0)
+
+    def write_call_routines(self):
+        """
+        Writes the shared routines that every call and return jumps to. This should be written once per program,
+        after all other code, if any call or return was written. Execution jumps over the routines, so they are
+        only ever entered through a call or return.
+
+        `VM$CALL` pushes the return address, LCL and ARG, points ARG at the arguments and jumps to the callee.
+        `VM$RETURN` copies the return value to the first argument, pops the frame and jumps back to the caller.
+        `VM$RETURN_RESTORING_POINTERS` first restores THAT and THIS, for functions that saved them.
+        """
+        lines = [
+            "// shared call and return routines\n",
+            "@END_CALL_ROUTINES\n",
+            "0;JMP\n",
+            f"({CALL_ROUTINE_LABEL})\n",
+            # Push the return address, which is passed in D
+            f"   @{STACK_POINTER}\n",
+            "   A=M\n",
+            "   M=D\n",
+            # Push the caller's LCL and ARG
+            "   @LCL\n",
+            "   D=M\n",
+            f"   @{STACK_POINTER}\n",
+            "   AM=M+1\n",
+            "   M=D\n",
+            "   @ARG\n",
+            "   D=M\n",
+            f"   @{STACK_POINTER}\n",
+            "   AM=M+1\n",
+            "   M=D\n",
+            # ARG = SP - argument count - 3
+            f"   @{STACK_POINTER}\n",
+            "   MD=M+1\n",
+            f"   @{CALL_ARGUMENT_COUNT_REGISTER}\n",
+            "   D=D-M\n",
+            f"   @{CALLER_FRAME_SIZE}\n",
+            "   D=D-A\n",
+            "   @ARG\n",
+            "   M=D\n",
+            # Jump to the callee
+            f"   @{CALL_TARGET_REGISTER}\n",
+            "   A=M\n",
+            "   0;JMP\n",
+            f"({RETURN_RESTORING_POINTERS_ROUTINE_LABEL})\n",
+            # Pop THAT and THIS off the end of the frame, leaving LCL where it would be without them
+            "   @LCL\n",
+            "   AM=M-1\n",
+            "   D=M\n",
+            "   @THAT\n",
+            "   M=D\n",
+            "   @LCL\n",
+            "   AM=M-1\n",
+            "   D=M\n",
+            "   @THIS\n",
+            "   M=D\n",
+            f"({RETURN_ROUTINE_LABEL})\n",
+            # Store the return address, since it is overwritten by the return value if there are no arguments
+            "   @LCL\n",
+            "   D=M\n",
+            f"   @{CALLER_FRAME_SIZE}\n",
+            "   A=D-A\n",
+            "   D=M\n",
+            f"   @{CALL_ARGUMENT_COUNT_REGISTER}\n",
+            "   M=D\n",
+            # Move the return value to the first argument and drop everything above it
+            f"   @{STACK_POINTER}\n",
+            "   AM=M-1\n",
+            "   D=M\n",
+            "   @ARG\n",
+            "   A=M\n",
+            "   M=D\n",
+            "   D=A+1\n",
+            f"   @{STACK_POINTER}\n",
+            "   M=D\n",
+            # Restore the caller's ARG and LCL
+            "   @LCL\n",
+            "   AM=M-1\n",
+            "   D=M\n",
+            "   @ARG\n",
+            "   M=D\n",
+            "   @LCL\n",
+            "   A=M-1\n",
+            "   D=M\n",
+            "   @LCL\n",
+            "   M=D\n",
+            # Return to the caller
+            f"   @{CALL_ARGUMENT_COUNT_REGISTER}\n",
+            "   A=M\n",
+            "   0;JMP\n",
+            "(END_CALL_ROUTINES)\n",
+        ]
+
+        self.output_file.writelines(lines)
+
+    def write_comparison_call(self, command: Command):
+        """
+        Writes a comparison as a call to its shared routine. The return address is passed in D
+        and the routine jumps back to it once the result has been pushed to the stack.
+        """
+        return_label = f"{self.label_prefix}RETURN_{command.arg1.name}_{self.label_counter}"
+
+        self.output_file.writelines([
+            f"// {command.arg1.value}\n",
+            f"@{return_label}\n",
+            "D=A\n",
+            f"@{comparison_routine_label(command.arg1)}\n",
+            "0;JMP\n",
+            f"({return_label})\n",
+        ])
+
+        self.label_counter += 1
+        self.comparison_call_count += 1
+
+    def write_comparison_routines(self):
+        """
+        Writes the shared routines used by comparisons when `shared_comparisons` is set.
+        This should be written once per program, before any other code. Execution jumps over the routines,
+        so they are only ever entered through a call.
+
+        Each routine expects the return address in D, pops two values from the stack and pushes -1 if
+        the comparison holds or 0 otherwise, and then jumps back to the return address.
+        """
+        lines = [
+            "// shared comparison routines\n",
+            "@END_COMPARISON_ROUTINES\n",
+            "0;JMP\n",
+        ]
+
+        for operation, jump in COMPARISON_JUMPS.items():
+            routine_label = comparison_routine_label(operation)
+
+            lines += [
+                f"({routine_label})\n",
+                # Store the return address
+                f"   @{RETURN_ADDRESS_REGISTER}\n",
+                "   M=D\n",
+                # Get the value at the top of the stack
+                f"   @{STACK_POINTER}\n",
+                "   AM=M-1\n",
+                "   D=M\n",
+                # Decrement the stack pointer and subtract the stored value with the current value
+                f"   @{STACK_POINTER}\n",
+                "   AM=M-1\n",
+                "   D=M-D\n",
+                # Assume the comparison holds and overwrite the result with 0 if it does not
+                "   M=-1\n",
+                f"   @{routine_label}_END\n",
+                f"   D;{jump}\n",
+                f"   @{STACK_POINTER}\n",
+                "   A=M\n",
+                "   M=0\n",
+                f"({routine_label}_END)\n",
+                # Increment the stack pointer and return to the caller
+                f"   @{STACK_POINTER}\n",
+                "   M=M+1\n",
+                f"   @{RETURN_ADDRESS_REGISTER}\n",
+                "   A=M\n",
+                "   0;JMP\n",
+            ]
+
+        lines.append("(END_COMPARISON_ROUTINES)\n")
+
+        self.output_file.writelines(lines)
+
+    @staticmethod
+    def decrement_stack_pointer():
         """
         Helper function that returns the instructions to decrement the stack pointer.
         This simply decrements the value in the @SP register by 1 and does not store the result anywhere else.
@@ -387,7 +604,8 @@ class CodeWriter:
             "M=M-1\n"
         ]
     
-    def increment_stack_pointer(self):
+    @staticmethod
+    def increment_stack_pointer():
         """
         Helper function that returns the instructions to increment the stack pointer.
         This simply increments the value in the @SP register by 1 and does not store the result anywhere else.
@@ -401,7 +619,8 @@ class CodeWriter:
             "M=M+1\n"
         ]
 
-    def point_to_top_of_stack(self):
+    @staticmethod
+    def point_to_top_of_stack():
         """
         Helper function that returns the instructions to point to the value stored at the top of the stack.
         This will decrement the value of the stack pointer and store it in the address register, since in this implementation,
@@ -416,7 +635,8 @@ class CodeWriter:
             "AM=M-1\n",
         ]
     
-    def pop_from_stack(self):
+    @staticmethod
+    def pop_from_stack(clear: bool = True):
         """
         Helper function that returns the instructions to pop the value at the top of the stack and store
         the result in the D register.
@@ -425,16 +645,17 @@ class CodeWriter:
             - `@SP`
             - `AM=M-1`
             - `D=M`
-            - `M=0`
+            - `M=0`, if `clear` is set
         """
         return [
             f"@{STACK_POINTER}\n",
             "AM=M-1\n",
             "D=M\n",
-            "M=0\n",
+            *(["M=0\n"] if clear else []),
         ]
     
-    def push_to_stack(self, value: str):
+    @staticmethod
+    def push_to_stack(value: int):
         """
         Helper function that returns the instructions to push a value to the stack.
 
@@ -446,17 +667,452 @@ class CodeWriter:
             - `M=D`
 
         Args:
-            value (str): The value to push to the stack.
+            value (int): The value to push to the stack. See `load_constant` for how negative values are handled.
         """
         return [
-            f"@{value}\n",
-            "D=A\n",
+            *CodeWriter.load_constant(value),
             f"@{STACK_POINTER}\n",
             "A=M\n",
             "M=D\n",
         ]
-    
+
+    @staticmethod
+    def load_constant(value: int):
+        """
+        Helper function that returns the instructions to store a constant in the D register.
+        A-instructions can only hold values from 0 to 32767, so negative constants produced by
+        the optimizer are loaded by negating their absolute value. -1, 0 and 1 are computed by the ALU directly.
+
+        This will do the following:
+            - `@value`
+            - `D=A`
+
+        Args:
+            value (int): The constant to load, from -32768 to 32767.
+        """
+        if value in ALU_CONSTANTS:
+            return [f"D={value}\n"]
+
+        if value >= 0:
+            return [f"@{value}\n", "D=A\n"]
+
+        if value == -32768:
+            return ["@32767\n", "D=-A\n", "D=D-1\n"]
+
+        return [f"@{-value}\n", "D=-A\n"]
+
+    def direct_address(self, segment: str, index: int):
+        """
+        Helper function that returns the symbol holding `segment[index]` for segments that map to a
+        fixed register (static, temp and pointer), or None for segments that are addressed through a base pointer.
+        """
+        if segment not in MEMORY_SEGMENT_MAP:
+            raise ValueError(f"Invalid memory segment: {segment}")
+
+        if segment == "static":
+            return f"{self.filename}.{index}"
+
+        if segment == "temp":
+            if index > 7:
+                raise ValueError(f"Temp register address out of bounds: {index}")
+            return f"R{TEMP_BASE_ADDRESS + index}"
+
+        if segment == "pointer":
+            if index not in (0, 1):
+                raise ValueError(f"Pointer values can only be 0 or 1")
+            return "THIS" if index == 0 else "THAT"
+
+        return None
+
+    def load_segment_value(self, segment: str, index: int):
+        """
+        Helper function that returns the instructions to store the value of `segment[index]` in the D register.
+        """
+        if segment == "constant":
+            return self.load_constant(index)
+
+        address = self.direct_address(segment, index)
+        if address is not None:
+            return [f"@{address}\n", "D=M\n"]
+
+        if index <= MAX_STEPPED_LOAD_OFFSET:
+            return [*self.point_to_segment_offset(segment, index), "D=M\n"]
+
+        return [
+            f"@{MEMORY_SEGMENT_MAP[segment]}\n",
+            "D=M\n",
+            f"@{index}\n",
+            "A=D+A\n",
+            "D=M\n",
+        ]
+
+    @staticmethod
+    def point_to_segment_offset(segment: str, index: int):
+        """
+        Helper function that returns the instructions to point A at `segment[index]` for segments that are addressed
+        through a base pointer, by stepping up from the base address. This does not change D, but takes one
+        instruction per offset, so it is only used for small offsets.
+
+        For `local 2` this will do the following:
+            - `@LCL`
+            - `A=M+1`
+            - `A=A+1`
+        """
+        base = MEMORY_SEGMENT_MAP[segment]
+
+        if index == 0:
+            return [f"@{base}\n", "A=M\n"]
+
+        return [f"@{base}\n", "A=M+1\n", *["A=A+1\n"] * (index - 1)]
+
+    def finish(self):
+        """
+        Writes out any state the writer still holds in registers, leaving the stack in memory as the VM expects it.
+        This must be called after the last command, and before writing code that is not a VM command,
+        such as the shared routines. The stack-based writer never holds any such state.
+        """
+
+    def flush(self):
+        """
+        Writes the buffered assembly to the output.
+        """
+        if self.sink is None:
+            return
+
+        self.sink.write(self.output_file.getvalue())
+        self.sink.flush()
+
+        self.output_file.seek(0)
+        self.output_file.truncate()
 
     def close(self):
-        self.output_file.close()
+        """
+        Writes out the buffered assembly, and moves the output file into place if the writer created it.
+        """
+        self.finish()
+        self.flush()
+
+        if self.owns_output_file:
+            self.sink.close()
+
+    def discard(self):
+        """
+        Drops the buffered assembly, and deletes the temporary output file if the writer created it, leaving
+        `output` untouched. Call this instead of `close()` when the translation fails.
+        """
+        self.output_file.seek(0)
+        self.output_file.truncate()
+
+        if self.owns_output_file:
+            self.sink.discard()
+
+    def __enter__(self) -> "CodeWriter":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.discard()
+
+def build_templates(clear_popped_slots: bool = True):
+    """
+    Builds the assembly templates for every arithmetic and memory access command. If `clear_popped_slots` is set,
+    every popped value is cleared to 0 in RAM.
+
+    Templates are keyed by `(CommandType, ArithmeticCommand)` for arithmetic commands and by `(CommandType, segment)`
+    for push and pop commands, and are joined into a single string ahead of time, so translating a command
+    is a single dictionary lookup and `str.format` call. The slots that vary between commands are:
+        - `{index}`: the index of a push or pop command.
+        - `{address}`: the register holding a static, temp or pointer value, e.g. `Foo.3`, `R5` or `THIS`.
+        - `{prefix}` and `{id}`: the label prefix and counter used to make comparison labels unique.
+    """
+    templates = {}
+
+    def add(key, lines):
+        templates[key] = "".join(lines)
+
+    def binary_operation(name: str, operation: str):
+        return [
+            f"// {name}\n",
+            *CodeWriter.pop_from_stack(clear_popped_slots),
+            *CodeWriter.point_to_top_of_stack(),
+            f"{operation}\n",
+            *CodeWriter.increment_stack_pointer(),
+        ]
+
+    def unary_operation(name: str, operation: str):
+        return [
+            f"// {name}\n",
+            *CodeWriter.point_to_top_of_stack(),
+            f"{operation}\n",
+            *CodeWriter.increment_stack_pointer(),
+        ]
+
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.ADD), binary_operation("add", "M=D+M"))
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.SUB), binary_operation("sub", "M=M-D"))
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.AND), binary_operation("and", "M=D&M"))
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.OR), binary_operation("or", "M=D|M"))
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.NEG), unary_operation("neg", "M=-M"))
+    add((CommandType.C_ARITHMETIC, ArithmeticCommand.NOT), unary_operation("not", "M=!M"))
+
+    for operation, jump in COMPARISON_JUMPS.items():
+        name = operation.name
+
+        add((CommandType.C_ARITHMETIC, operation), [
+            f"// {operation.value}\n",
+            # Get the value at the top of the stack and clear it
+            *CodeWriter.pop_from_stack(clear_popped_slots),
+            # Decrement the stack pointer and subtract the stored value with the current value
+            *CodeWriter.point_to_top_of_stack(),
+            "D=M-D\n",
+            # Jump logic to set the value at the top of the stack to -1 if the comparison holds
+            f"@{{prefix}}IS_{name}_{{id}}\n",
+            f"D;{jump}\n",
+            f"({{prefix}}NOT_{name}_{{id}})\n",
+            f"   @{STACK_POINTER}\n",
+            "   A=M\n",
+            "   M=0\n",
+            f"   @{{prefix}}END_{name}_{{id}}\n",
+            "   0;JMP\n",
+            f"({{prefix}}IS_{name}_{{id}})\n",
+            f"   @{STACK_POINTER}\n",
+            "   A=M\n",
+            # -1 is the largest value in a 16-bit register so we use it to indicate true
+            "   M=-1\n",
+            f"({{prefix}}END_{name}_{{id}})\n",
+            *CodeWriter.increment_stack_pointer(),
+        ])
+
+    add((CommandType.C_PUSH, "constant"), [
+        "// push constant {index}\n",
+        "@{index}\n",
+        "D=A\n",
+        f"@{STACK_POINTER}\n",
+        "A=M\n",
+        "M=D\n",
+        *CodeWriter.increment_stack_pointer(),
+    ])
+
+    for segment in DIRECT_SEGMENTS:
+        add((CommandType.C_PUSH, segment), [
+            f"// push {segment} {{index}}\n",
+            "@{address}\n",
+            "D=M\n",
+            f"@{STACK_POINTER}\n",
+            "A=M\n",
+            "M=D\n",
+            *CodeWriter.increment_stack_pointer(),
+        ])
+
+        add((CommandType.C_POP, segment), [
+            f"// pop {segment} {{index}}\n",
+            *CodeWriter.pop_from_stack(clear_popped_slots),
+            "@{address}\n",
+            "M=D\n",
+        ])
+
+    for segment in INDIRECT_SEGMENTS:
+        base = MEMORY_SEGMENT_MAP[segment]
+
+        add((CommandType.C_PUSH, segment), [
+            f"// push {segment} {{index}}\n",
+            # Take the address of the segment
+            f"@{base}\n",
+            "D=M\n",
+            # Increment the address by the offset
+            "@{index}\n",
+            "A=D+A\n",
+            # Take the value at the selected address and push it to the stack
+            "D=M\n",
+            f"@{STACK_POINTER}\n",
+            "A=M\n",
+            "M=D\n",
+            *CodeWriter.increment_stack_pointer(),
+        ])
+
+        add((CommandType.C_POP, segment), [
+            f"// pop {segment} {{index}}\n",
+            *CodeWriter.decrement_stack_pointer(),
+            # Calculate the selected address
+            f"@{base}\n",
+            "D=M\n",
+            "@{index}\n",
+            "D=D+A\n",
+            # Store the address in a temporary register
+            "@R15\n",
+            "M=D\n",
+            # Take the value addressed by the stack pointer
+            f"@{STACK_POINTER}\n",
+            "A=M\n",
+            "D=M\n",
+            # Clear the value from the stack
+            *(["M=0\n"] if clear_popped_slots else []),
+            # Store this value in the selected address
+            "@R15\n",
+            "A=M\n",
+            "M=D\n",
+        ])
+
+    return templates
+
+TEMPLATES = build_templates()
+TEMPLATES_WITHOUT_CLEARING = build_templates(clear_popped_slots=False)
+
+def build_fast_path_templates(clear_popped_slots: bool = True):
+    """
+    Builds the templates of push and pop commands whose operand allows a shorter sequence than the general template:
+        - Constants the ALU can produce are stored to the stack directly, e.g. `M=-1`, instead of going through D.
+        - Small offsets into indirect segments step A up from the base address, e.g. `A=M+1` for offset 1,
+          instead of adding the offset in D. Pops then store the value directly instead of keeping the address in R15.
+
+    Templates are keyed by `(CommandType, segment, index)` and have no slots, since the operand is part of the key.
+    See `build_templates` for `clear_popped_slots`.
+    """
+    templates = {}
+
+    def add(key, lines):
+        templates[key] = "".join(lines)
+
+    for value in ALU_CONSTANTS:
+        add((CommandType.C_PUSH, "constant", value), [
+            f"// push constant {value}\n",
+            # Increment the stack pointer and step back to the slot it pointed to
+            f"@{STACK_POINTER}\n",
+            "AM=M+1\n",
+            "A=A-1\n",
+            f"M={value}\n",
+        ])
+
+    for segment in INDIRECT_SEGMENTS:
+        for index in range(MAX_STEPPED_LOAD_OFFSET + 1):
+            add((CommandType.C_PUSH, segment, index), [
+                f"// push {segment} {index}\n",
+                *CodeWriter.point_to_segment_offset(segment, index),
+                "D=M\n",
+                f"@{STACK_POINTER}\n",
+                "A=M\n",
+                "M=D\n",
+                *CodeWriter.increment_stack_pointer(),
+            ])
+
+        for index in range(MAX_STEPPED_STORE_OFFSET + 1):
+            add((CommandType.C_POP, segment, index), [
+                f"// pop {segment} {index}\n",
+                *CodeWriter.pop_from_stack(clear_popped_slots),
+                *CodeWriter.point_to_segment_offset(segment, index),
+                "M=D\n",
+            ])
+
+    return templates
+
+FAST_PATH_TEMPLATES = build_fast_path_templates()
+FAST_PATH_TEMPLATES_WITHOUT_CLEARING = build_fast_path_templates(clear_popped_slots=False)
+
+def comparison_routine_label(operation: ArithmeticCommand) -> str:
+    return f"COMPARE_{operation.name}"
+
+def is_instruction(line: str) -> bool:
+    """
+    Helper function that returns True if a stripped line of assembly takes up a ROM word, i.e. is neither
+    blank, a comment nor a label.
+    """
+    return bool(line) and not line.startswith("//") and not line.startswith("(")
+
+def count_instructions(assembly: str) -> int:
+    """
+    Helper function that returns the number of ROM words taken by a piece of assembly, i.e. the number of lines
+    that are neither comments nor labels.
+    """
+    return sum(1 for line in assembly.splitlines() if is_instruction(line.strip()))
+
+def fast_path_instruction_counts() -> Dict[str, Dict[str, int]]:
+    """
+    Returns the number of instructions taken by every command in `FAST_PATH_TEMPLATES`, keyed by the command,
+    e.g. `push local 1`, along with the number it would take with the general template.
+    """
+    counts = {}
+
+    for (command_type, segment, index), template in FAST_PATH_TEMPLATES.items():
+        if segment == "constant" and index < 0:
+            general = "".join([*CodeWriter.push_to_stack(index), *CodeWriter.increment_stack_pointer()])
+        else:
+            general = TEMPLATES[(command_type, segment)].format(index=index, address=None)
+
+        name = "push" if command_type == CommandType.C_PUSH else "pop"
+        counts[f"{name} {segment} {index}"] = {
+            "instructions": count_instructions(template),
+            "general_instructions": count_instructions(general),
+        }
+
+    return counts
+
+# Name under which `function_sizes` reports the code that does not belong to any function
+TOP_LEVEL_CODE = "(top level)"
+
+# Comments that start code written once per program rather than for a function, and the names `function_sizes` reports it under
+SECTION_COMMENTS = {
+    "// bootstrap": "(bootstrap)",
+    "// shared comparison routines": "(comparison routines)",
+    "// shared call and return routines": "(call routines)",
+}
+
+def function_sizes(assembly: str) -> Dict[str, int]:
+    """
+    Helper function that returns the number of ROM words taken by every function in a piece of assembly,
+    in the order they appear. Code written once per program, such as the bootstrap code and the shared routines,
+    is reported under its own name, and code outside of any function under `TOP_LEVEL_CODE`.
+    Functions are found through the comments written by `write_function`, which the peephole optimizer keeps.
+    """
+    sizes: Dict[str, int] = {}
+    section = TOP_LEVEL_CODE
+
+    for line in assembly.splitlines():
+        line = line.strip()
+
+        if line.startswith("//"):
+            if line.startswith("// function "):
+                section = line.split()[2]
+            elif line in SECTION_COMMENTS:
+                section = SECTION_COMMENTS[line]
+            continue
+
+        if line and not line.startswith("("):
+            sizes[section] = sizes.get(section, 0) + 1
+
+    return sizes
+
+def uses_call_routines(assembly: str) -> bool:
+    """
+    Helper function that returns True if a piece of assembly jumps to the shared call and return routines.
+    """
+    return any(
+        f"@{label}\n" in assembly
+        for label in (CALL_ROUTINE_LABEL, RETURN_ROUTINE_LABEL, RETURN_RESTORING_POINTERS_ROUTINE_LABEL)
+    )
+
+def count_comparison_calls(assembly: str) -> int:
+    """
+    Helper function that returns the number of calls to the shared comparison routines in a piece of assembly.
+    """
+    return sum(assembly.count(f"@{comparison_routine_label(operation)}\n") for operation in COMPARISON_JUMPS)
+
+def comparison_rom_words_saved(call_count: int) -> int:
+    """
+    Returns the number of ROM words saved by translating `call_count` comparisons into calls to the shared
+    comparison routines rather than inlining them. This is negative for programs with very few comparisons,
+    since the routines themselves take up space.
+    """
+    def size_of(shared_comparisons: bool, write) -> int:
+        output = io.StringIO()
+        write(CodeWriter(output, shared_comparisons=shared_comparisons))
+        return count_instructions(output.getvalue())
+
+    comparison = Command(ArithmeticCommand.EQ.value)
+
+    inline_size = size_of(False, lambda writer: writer.write_arithmetic(comparison))
+    call_size = size_of(True, lambda writer: writer.write_arithmetic(comparison))
+    routines_size = size_of(True, CodeWriter.write_comparison_routines)
+
+    return call_count * (inline_size - call_size) - routines_size
 
@@ -0,0 +1,227 @@
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional
+from .assembler import COMP_CODES, DEST_A, DEST_D, DEST_M, assemble
+
+RAM_SIZE = 32768
+
+WORD_MASK = 0xFFFF
+SIGN_BIT = 0x8000
+
+# Blocks are cut after this many instructions even if they do not end in a jump, to bound compilation time
+MAX_BLOCK_LENGTH = 256
+
+# Python expressions computing every ALU operation on unsigned 16-bit values.
+# `M` stands for the RAM word addressed by A and is substituted when generating code.
+COMP_EXPRESSIONS = {
+    "0": "0",
+    "1": "1",
+    "-1": f"{WORD_MASK}",
+    "D": "D",
+    "A": "A",
+    "!D": f"D ^ {WORD_MASK}",
+    "!A": f"A ^ {WORD_MASK}",
+    "-D": f"-D & {WORD_MASK}",
+    "-A": f"-A & {WORD_MASK}",
+    "D+1": f"(D + 1) & {WORD_MASK}",
+    "A+1": f"(A + 1) & {WORD_MASK}",
+    "D-1": f"(D - 1) & {WORD_MASK}",
+    "A-1": f"(A - 1) & {WORD_MASK}",
+    "D+A": f"(D + A) & {WORD_MASK}",
+    "D-A": f"(D - A) & {WORD_MASK}",
+    "A-D": f"(A - D) & {WORD_MASK}",
+    "D&A": "D & A",
+    "D|A": "D | A",
+}
+COMP_EXPRESSIONS.update({
+    comp.replace("A", "M"): expression.replace("A", "M")
+    for comp, expression in COMP_EXPRESSIONS.items()
+    if "A" in comp
+})
+
+# Maps the `a` and `c` bits of a C-instruction to the expression computing it
+COMP_EXPRESSIONS_BY_CODE = {COMP_CODES[comp]: expression for comp, expression in COMP_EXPRESSIONS.items()}
+
+# Python conditions deciding if a jump is taken, given the unsigned result `value` of the computation
+JUMP_CONDITIONS = {
+    0b001: f"0 < value < {SIGN_BIT}",
+    0b010: "value == 0",
+    0b011: f"value < {SIGN_BIT}",
+    0b100: f"value >= {SIGN_BIT}",
+    0b101: "value != 0",
+    0b110: f"value == 0 or value >= {SIGN_BIT}",
+    0b111: "True",
+}
+
+def to_signed(value: int) -> int:
+    return value - 0x10000 if value & SIGN_BIT else value
+
+def dump_ram(read: Callable[[int], int], addresses: Iterable[int]) -> str:
+    """
+    Returns the values at the given RAM addresses, as returned by `read`, as a table in the format of the
+    nand2tetris `.cmp` files.
+    """
+    addresses = list(addresses)
+
+    header = "|" + "|".join(f"{f'RAM[{address}]':^8}" for address in addresses) + "|"
+    values = "|" + "|".join(f"{read(address):^8}" for address in addresses) + "|"
+
+    return f"{header}\n{values}\n"
+
+class HackCPU:
+    """
+    An emulator for the Hack CPU.
+
+    Rather than decoding every instruction each time it runs, the emulator translates each straight-line run
+    of instructions ending in a jump (a basic block) into a Python function the first time it is reached, and
+    from then on runs the whole block with a single call. Programs that loop over the same code therefore
+    run at millions of instructions per second.
+
+    RAM and ROM are exposed as `array("H")` buffers of unsigned 16-bit words. Use `read` or `dump` to get
+    signed values as shown by the nand2tetris tools.
+    """
+    def __init__(self, rom: Iterable[int]):
+        self.rom = array("H", rom)
+        self.ram = array("H", bytes(2 * RAM_SIZE))
+
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+        # Compiled blocks and their lengths, indexed by the ROM address they start at
+        self.blocks: List[Optional[Callable]] = [None] * len(self.rom)
+        self.block_lengths: List[int] = [0] * len(self.rom)
+
+    @classmethod
+    def from_assembly(cls, assembly: str) -> "HackCPU":
+        return cls(assemble(assembly))
+
+    def reset(self):
+        self.a = 0
+        self.d = 0
+        self.pc = 0
+        self.cycles = 0
+
+    def read(self, address: int) -> int:
+        """
+        Returns the value at `address` in RAM as a signed integer.
+        """
+        return to_signed(self.ram[address])
+
+    def write(self, address: int, value: int):
+        """
+        Stores a signed or unsigned value at `address` in RAM.
+        """
+        self.ram[address] = value & WORD_MASK
+
+    def is_halted(self) -> bool:
+        """
+        Returns True once the program counter has run past the end of the program.
+        """
+        return self.pc >= len(self.rom)
+
+    def run(self, cycles: int) -> int:
+        """
+        Runs the program for at most `cycles` instructions, or until it runs past the end of the ROM.
+        Returns the number of instructions that were executed.
+        """
+        rom_length = len(self.rom)
+        blocks = self.blocks
+        block_lengths = self.block_lengths
+        ram = self.ram
+
+        pc = self.pc
+        a = self.a
+        d = self.d
+        executed = 0
+
+        try:
+            while executed < cycles and pc < rom_length:
+                block = blocks[pc]
+
+                if block is None:
+                    block, length = self.compile_block(pc, MAX_BLOCK_LENGTH)
+                    blocks[pc] = block
+                    block_lengths[pc] = length
+
+                length = block_lengths[pc]
+
+                # Run the last few instructions one at a time so exactly `cycles` instructions are executed
+                if executed + length > cycles:
+                    block, length = self.compile_block(pc, cycles - executed)
+
+                pc, a, d = block(ram, a, d)
+                executed += length
+        except IndexError:
+            raise RuntimeError(f"Invalid RAM access near ROM address {pc}: A={a}")
+        finally:
+            self.pc = pc
+            self.a = a
+            self.d = d
+            self.cycles += executed
+
+        return executed
+
+    def compile_block(self, start: int, max_length: int):
+        """
+        Translates the instructions starting at `start` into a Python function, stopping after the first jump
+        or after `max_length` instructions. The function takes RAM and the A and D registers, and returns
+        the next value of the program counter along with the new A and D registers.
+
+        Returns:
+            A tuple of the compiled function and the number of instructions it executes.
+        """
+        lines = ["def block(ram, A, D):"]
+        pc = start
+
+        while pc < len(self.rom) and pc - start < max_length:
+            word = self.rom[pc]
+            pc += 1
+
+            if not word & SIGN_BIT:
+                lines.append(f"    A = {word}")
+                continue
+
+            comp_code = (word >> 6) & 0b1111111
+            dest = (word >> 3) & 0b111
+            jump = word & 0b111
+
+            expression = COMP_EXPRESSIONS_BY_CODE.get(comp_code)
+            if expression is None:
+                raise ValueError(f"Invalid instruction at ROM address {pc - 1}: {word:016b}")
+
+            expression = expression.replace("M", "ram[A]")
+
+            # Jumps go to the value A had before this instruction, since A is only updated at the end of the cycle
+            if jump and dest & DEST_A:
+                lines.append("    target = A")
+                target = "target"
+            else:
+                target = "A"
+
+            lines.append(f"    value = {expression}")
+
+            if dest & DEST_M:
+                lines.append("    ram[A] = value")
+            if dest & DEST_A:
+                lines.append("    A = value")
+            if dest & DEST_D:
+                lines.append("    D = value")
+
+            if jump:
+                lines.append(f"    if {JUMP_CONDITIONS[jump]}:")
+                lines.append(f"        return {target}, A, D")
+                break
+
+        lines.append(f"    return {pc}, A, D")
+
+        namespace: Dict[str, Callable] = {}
+        exec(compile("\n".join(lines), f"<hack block {start}>", "exec"), namespace)
+
+        return namespace["block"], pc - start
+
+    def dump(self, addresses: Iterable[int]) -> str:
+        """
+        Returns the values at the given RAM addresses as a table in the format of the nand2tetris `.cmp` files.
+        """
+        return dump_ram(self.read, addresses)
@@ -0,0 +1,78 @@
+import os
+import tempfile
+from typing import Union
+
+def current_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# Permissions `open` gives new files. Reading the umask briefly changes it, so this is only done once, on import,
+# rather than every time a file is created from one of several threads.
+DEFAULT_FILE_MODE = 0o666 & ~current_umask()
+
+class AtomicFile:
+    """
+    A file that is written under a temporary name in the same directory and renamed into place when it is closed,
+    so other processes, such as parallel builds, either see the previous file or the complete new one, never a
+    partial file. If an exception is raised inside a `with` block, or `discard` is called, the file is left untouched.
+    """
+    def __init__(self, path: str, mode: str = "w"):
+        directory = os.path.dirname(os.path.abspath(path))
+        file_descriptor, self.temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+
+        # Temporary files are only readable by their owner, so give the file the permissions `open` would have
+        os.chmod(self.temp_path, DEFAULT_FILE_MODE)
+
+        self.path = path
+        self.file = os.fdopen(file_descriptor, mode)
+
+    def write(self, data: Union[str, bytes]) -> int:
+        return self.file.write(data)
+
+    def writelines(self, lines):
+        self.file.writelines(lines)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """
+        Closes the file and moves it into place, replacing any existing file.
+        """
+        if self.file.closed:
+            return
+
+        try:
+            self.file.close()
+            os.replace(self.temp_path, self.path)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self):
+        """
+        Closes and deletes the temporary file without touching the destination.
+        """
+        self.file.close()
+
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "AtomicFile":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.discard()
+
+def write_atomically(path: str, data: Union[str, bytes]):
+    """
+    Writes `data` to `path` through an `AtomicFile`, in binary mode if `data` is bytes.
+    """
+    with AtomicFile(path, "wb" if isinstance(data, bytes) else "w") as file:
+        file.write(data)
@@ -0,0 +1,572 @@
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from typing import Dict, Iterator, List, Optional, Tuple
+from .code_writer import HEAP_BASE_ADDRESS, MEMORY_SEGMENT_MAP, is_instruction
+from .emulator import HackCPU, RAM_SIZE
+from .interpreter import VMInterpreter
+from .parser import ArithmeticCommand, Parser
+from .translator import BACKENDS, translate
+
+# Name of the module every fuzzed program is translated as
+MODULE_NAME = "Fuzz"
+
+# Segment pointers set before every run, far enough apart that generated indices never make segments overlap
+# each other or the stack
+INITIAL_RAM = {
+    0: 256,
+    1: 1000,
+    2: 1100,
+    3: 3000,
+    4: 3100,
+}
+
+# Addresses `pop pointer` may point THIS and THAT at, which are clear of the stack and the other segments
+POINTER_TARGETS = range(4000, 16000, 16)
+
+# Largest index generated for the segments that are addressed through a base pointer, or for static
+MAX_SEGMENT_INDEX = 15
+
+# Temp register that counts down the iterations of loops. Other commands never pop into it, so loops always end.
+LOOP_COUNTER_INDEX = 7
+
+# Most iterations of a generated loop
+MAX_LOOP_COUNT = 4
+
+# Most functions generated besides the recursive one, and the most arguments and locals each of them takes
+MAX_FUNCTIONS = 3
+MAX_ARGUMENTS = 2
+MAX_LOCALS = 3
+
+# Function that calls itself, with its argument counting down the calls left. Callers pass it a constant
+# of at most `MAX_RECURSION_DEPTH`, so the recursion is bounded.
+RECURSIVE_FUNCTION = f"{MODULE_NAME}.recurse"
+MAX_RECURSION_DEPTH = 4
+
+# Deepest the stack is allowed to grow, which keeps it below the local segment. Functions get less stack,
+# since their frames are stacked on top of each other.
+MAX_STACK_DEPTH = 64
+MAX_FUNCTION_STACK_DEPTH = 16
+
+# Label of the loop every program ends in, like `Sys.init` does, since the functions come after the code outside of them
+END_LABEL = "FUZZ_END"
+
+# Instructions a program may run before it is considered stuck, and how often it is checked for having reached
+# its end. Loops and recursion are bounded, so this is never reached.
+MAX_CYCLES = 1_000_000
+END_CHECK_CYCLES = 10_000
+
+# Scratch registers used by the generated code, whose final values are not part of a program's behavior
+SCRATCH_ADDRESSES = (13, 14, 15)
+
+# Name of the mode every other mode is compared with
+BASELINE_MODE = "stack"
+
+BINARY_OPERATIONS = [
+    operation for operation in ArithmeticCommand if operation not in (ArithmeticCommand.NEG, ArithmeticCommand.NOT)
+]
+UNARY_OPERATIONS = [ArithmeticCommand.NEG, ArithmeticCommand.NOT]
+
+def translation_modes() -> Dict[str, dict]:
+    """
+    Returns every combination of code generation options, keyed by a name such as `register+optimize`,
+    as keyword arguments to `translator.translate`.
+    """
+    modes = {}
+
+    for backend, optimize, shared_comparisons in product(BACKENDS, (False, True), (False, True)):
+        name = "+".join([backend] + ["optimize"] * optimize + ["shared-comparisons"] * shared_comparisons)
+        modes[name] = {"backend": backend, "optimize": optimize, "shared_comparisons": shared_comparisons}
+
+    return modes
+
+# Modes every program is run in. `vm` runs the program on the VM interpreter instead of translating it.
+MODES = [*translation_modes(), "vm"]
+
+class Statement:
+    """
+    A command of a generated program, or a group of commands that only work together, such as a loop or
+    a branch. Programs are shrunk by removing whole statements, so their control flow always stays valid.
+    """
+    __slots__ = ("lines", "needs", "effect", "function", "calls", "returns")
+
+    def __init__(
+        self,
+        lines: List[str],
+        needs: int = 0,
+        effect: int = 0,
+        function: Optional[str] = None,
+        calls: Tuple[str, ...] = (),
+        returns: bool = False,
+    ):
+        self.lines = lines
+
+        # Values the statement takes from the stack, and how much it changes the depth of the stack by
+        self.needs = needs
+        self.effect = effect
+
+        # Function the statement belongs to, or starts if it is a `function` command. None outside of functions.
+        self.function = function
+
+        # Functions called by the statement, other than a recursive function calling itself
+        self.calls = calls
+
+        # Set if the statement ends with `return`
+        self.returns = returns
+
+    @property
+    def starts_function(self) -> bool:
+        return self.lines[0].startswith("function ")
+
+class ProgramGenerator:
+    """
+    Generates the statements of a random program, see `generate_program`.
+    """
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+        # Number of the next branch or loop, which makes their labels unique
+        self.label_counter = 0
+
+    def statements(
+        self,
+        size: int,
+        function: Optional[str] = None,
+        segment_sizes: Dict[str, int] = None,
+        callees: Dict[str, int] = None,
+        max_depth: int = MAX_STACK_DEPTH,
+        nested: bool = False,
+    ) -> Tuple[List[Statement], int]:
+        """
+        Generates about `size` statements of the body of `function`, and returns them along with the depth of
+        the stack they leave behind.
+
+        Args:
+            segment_sizes (Dict[str, int]): The number of `local` and `argument` values of `function`, which are not
+                accessed at all if it has none. If it is None, their indices go up to `MAX_SEGMENT_INDEX`.
+            callees (Dict[str, int]): The functions that may be called, mapped to their number of arguments.
+            nested (bool): Set for the body of a loop or branch, which only uses the values it pushes itself
+                and contains no further branches or loops, so loops never share the loop counter.
+        """
+        rng = self.rng
+        callees = callees or {}
+        segments = [
+            segment for segment in MEMORY_SEGMENT_MAP
+            if segment_sizes is None or segment not in ("local", "argument") or segment_sizes.get(segment)
+        ]
+        pop_segments = [segment for segment in segments if not (segment == "argument" and function == RECURSIVE_FUNCTION)]
+        statements = []
+        depth = 0
+
+        def add(lines: List[str], needs: int = 0, effect: int = 0, calls: Tuple[str, ...] = ()):
+            nonlocal depth
+            statements.append(Statement(lines, needs, effect, function, calls))
+            depth += effect
+
+        while len(statements) < size:
+            choice = rng.random()
+
+            if depth < 2 or (choice < 0.4 and depth < max_depth):
+                segment = rng.choice(["constant", *segments])
+                add([f"push {segment} {random_index(rng, segment, segment_sizes)}"], effect=1)
+            elif choice < 0.55:
+                segment = rng.choice(pop_segments)
+
+                if segment == "pointer":
+                    # THIS and THAT only ever point at addresses clear of everything else
+                    lines = [f"push constant {rng.choice(POINTER_TARGETS)}", f"pop pointer {rng.randint(0, 1)}"]
+                    add(lines)
+                else:
+                    add([f"pop {segment} {random_index(rng, segment, segment_sizes)}"], needs=1, effect=-1)
+            elif choice < 0.62:
+                add([rng.choice(UNARY_OPERATIONS).value], needs=1)
+            elif choice < 0.8:
+                add([rng.choice(BINARY_OPERATIONS).value], needs=2, effect=-1)
+            elif choice < 0.87 and not nested:
+                lines, calls = self.branch(function, segment_sizes, callees, max_depth)
+                add(lines, needs=1, effect=-1, calls=calls)
+            elif choice < 0.92 and not nested and function is None:
+                # Functions may be called from a loop, so only the code outside of them loops
+                lines, calls = self.loop(segment_sizes, callees, max_depth)
+                add(lines, calls=calls)
+            elif callees:
+                callee = rng.choice(sorted(callees))
+
+                if callee == RECURSIVE_FUNCTION:
+                    add([f"push constant {rng.randint(0, MAX_RECURSION_DEPTH)}", f"call {callee} 1"], effect=1, calls=(callee,))
+                elif depth >= callees[callee]:
+                    add([f"call {callee} {callees[callee]}"], callees[callee], 1 - callees[callee], (callee,))
+
+        return statements, depth
+
+    def block(
+        self,
+        function: Optional[str],
+        segment_sizes: Optional[Dict[str, int]],
+        callees: Dict[str, int],
+        max_depth: int,
+    ) -> Tuple[List[str], Tuple[str, ...]]:
+        """
+        Helper function that returns the commands of the body of a loop or branch, which leaves the stack
+        as it found it, along with the functions they call.
+        """
+        statements, depth = self.statements(self.rng.randint(0, 6), function, segment_sizes, callees, max_depth, nested=True)
+        lines = [line for statement in statements for line in statement.lines]
+        calls = tuple(callee for statement in statements for callee in statement.calls)
+
+        for _ in range(depth):
+            segment = self.rng.choice(["static", "temp", "this", "that"])
+            lines.append(f"pop {segment} {random_index(self.rng, segment)}")
+
+        return lines, calls
+
+    def branch(
+        self,
+        function: Optional[str],
+        segment_sizes: Optional[Dict[str, int]],
+        callees: Dict[str, int],
+        max_depth: int,
+    ) -> Tuple[List[str], Tuple[str, ...]]:
+        """
+        Helper function that returns an if-else on the value at the top of the stack, along with the functions
+        it calls.
+        """
+        self.label_counter += 1
+        true_label = f"FUZZ_TRUE{self.label_counter}"
+        join_label = f"FUZZ_JOIN{self.label_counter}"
+        false_lines, false_calls = self.block(function, segment_sizes, callees, max_depth)
+        true_lines, true_calls = self.block(function, segment_sizes, callees, max_depth)
+
+        lines = [
+            f"if-goto {true_label}",
+            *false_lines,
+            f"goto {join_label}",
+            f"label {true_label}",
+            *true_lines,
+            f"label {join_label}",
+        ]
+        return lines, false_calls + true_calls
+
+    def loop(
+        self,
+        segment_sizes: Optional[Dict[str, int]],
+        callees: Dict[str, int],
+        max_depth: int,
+    ) -> Tuple[List[str], Tuple[str, ...]]:
+        """
+        Helper function that returns a loop running its body a random number of times, counted down in
+        the loop counter, along with the functions it calls.
+        """
+        self.label_counter += 1
+        label = f"FUZZ_LOOP{self.label_counter}"
+        body_lines, calls = self.block(None, segment_sizes, callees, max_depth)
+
+        lines = [
+            f"push constant {self.rng.randint(1, MAX_LOOP_COUNT)}",
+            f"pop temp {LOOP_COUNTER_INDEX}",
+            f"label {label}",
+            *body_lines,
+            f"push temp {LOOP_COUNTER_INDEX}",
+            "push constant 1",
+            "sub",
+            f"pop temp {LOOP_COUNTER_INDEX}",
+            f"push temp {LOOP_COUNTER_INDEX}",
+            f"if-goto {label}",
+        ]
+        return lines, calls
+
+    def function(self, name: str, arguments: int, locals: int, size: int, callees: Dict[str, int]) -> List[Statement]:
+        """
+        Helper function that returns the statements of a function, which may call `callees`.
+        """
+        segment_sizes = {"local": locals, "argument": arguments}
+        statements, depth = self.statements(size, name, segment_sizes, callees, MAX_FUNCTION_STACK_DEPTH)
+        statements.insert(0, Statement([f"function {name} {locals}"], function=name))
+
+        if depth == 0:
+            statements.append(Statement(["push constant 1"], effect=1, function=name))
+
+        statements.append(Statement(["return"], needs=1, effect=-1, function=name, returns=True))
+        return statements
+
+    def recursive_function(self, size: int) -> List[Statement]:
+        """
+        Helper function that returns the statements of `RECURSIVE_FUNCTION`, which calls itself until its argument
+        reaches 0 and returns the sum of its local at every level.
+        """
+        statements, _ = self.statements(size, RECURSIVE_FUNCTION, {"local": 1, "argument": 1}, {}, MAX_FUNCTION_STACK_DEPTH)
+        statements.insert(0, Statement([f"function {RECURSIVE_FUNCTION} 1"], function=RECURSIVE_FUNCTION))
+
+        # The values left on the stack by the body are dropped by the return
+        statements.append(Statement(
+            [
+                "push argument 0",
+                "if-goto FUZZ_RECURSE",
+                "push local 0",
+                "return",
+                "label FUZZ_RECURSE",
+                "push argument 0",
+                "push constant 1",
+                "sub",
+                f"call {RECURSIVE_FUNCTION} 1",
+                "push local 0",
+                "add",
+                "return",
+            ],
+            function=RECURSIVE_FUNCTION,
+            returns=True,
+        ))
+        return statements
+
+def generate_program(rng: random.Random, size: int) -> List[Statement]:
+    """
+    Generates a random program of about `size` statements outside of any function, where a loop or branch
+    counts as one, followed by the functions they call.
+
+    Statements are arithmetic, pushes and pops over every segment, if-else branches on the top of the stack,
+    loops running up to `MAX_LOOP_COUNT` times and calls. Functions only call the functions generated after them,
+    besides `RECURSIVE_FUNCTION`, which calls itself at most `MAX_RECURSION_DEPTH` times, so every program ends.
+    The stack never underflows or grows past `MAX_STACK_DEPTH`, and `pop pointer` is always directly preceded by
+    a `push constant` of an address in `POINTER_TARGETS`, so every access stays within the segments.
+    """
+    generator = ProgramGenerator(rng)
+    signatures = {
+        f"{MODULE_NAME}.f{index}": (rng.randint(0, MAX_ARGUMENTS), rng.randint(0, MAX_LOCALS))
+        for index in range(rng.randint(0, MAX_FUNCTIONS))
+    }
+    names = list(signatures)
+
+    if rng.random() < 0.5:
+        names.append(RECURSIVE_FUNCTION)
+
+    def callees(index: int) -> Dict[str, int]:
+        return {name: signatures.get(name, (1, 1))[0] for name in names[index:]}
+
+    statements, _ = generator.statements(size, callees=callees(0))
+
+    for index, name in enumerate(names):
+        function_size = rng.randint(1, max(size // 4, 1))
+
+        if name == RECURSIVE_FUNCTION:
+            statements += generator.recursive_function(function_size)
+        else:
+            statements += generator.function(name, *signatures[name], function_size, callees(index + 1))
+
+    return statements
+
+def random_index(rng: random.Random, segment: str, segment_sizes: Dict[str, int] = None) -> int:
+    """
+    Helper function that returns a random index that is valid for `segment`. Constants favour the edges of
+    their range, where overflows happen. `segment_sizes` gives the size of `local` and `argument` inside a function.
+    """
+    if segment == "pointer":
+        return rng.randint(0, 1)
+    if segment == "temp":
+        # The last temp register is the loop counter
+        return rng.randint(0, LOOP_COUNTER_INDEX - 1)
+    if segment == "constant":
+        return rng.choice([0, 1, 2, 32767, 32766, 16384, rng.randint(0, 32767)])
+    if segment_sizes is not None and segment in segment_sizes:
+        return rng.randint(0, segment_sizes[segment] - 1)
+
+    return rng.randint(0, MAX_SEGMENT_INDEX)
+
+def is_valid_program(statements: List[Statement]) -> bool:
+    """
+    Returns True if a program follows the rules of `generate_program`. Used to only keep valid programs while shrinking.
+    """
+    # Functions may only call the functions after them, which also rules out calls to functions that were removed
+    positions = {statement.function: index for index, statement in enumerate(statements) if statement.starts_function}
+    function = None
+    depth = 0
+    returned = False
+
+    for statement in statements:
+        if statement.starts_function:
+            if function is not None and not returned:
+                return False
+
+            function = statement.function
+            depth = 0
+            returned = False
+            continue
+
+        if statement.function != function or returned or depth < statement.needs:
+            return False
+
+        if any(positions.get(callee, -1) <= positions.get(function, -1) for callee in statement.calls):
+            return False
+
+        depth += statement.effect
+        returned = statement.returns
+
+        if depth > (MAX_STACK_DEPTH if function is None else MAX_FUNCTION_STACK_DEPTH) + 1:
+            return False
+
+    return function is None or returned
+
+def program_lines(statements: List[Statement]) -> List[str]:
+    """
+    Returns the commands of a generated program. The code outside of functions ends in a loop at `END_LABEL`,
+    so it does not run into the functions after it.
+    """
+    lines = []
+    ended = False
+
+    for statement in statements:
+        if statement.starts_function and not ended:
+            lines += [f"label {END_LABEL}", f"goto {END_LABEL}"]
+            ended = True
+
+        lines += statement.lines
+
+    if not ended:
+        lines += [f"label {END_LABEL}", f"goto {END_LABEL}"]
+
+    return lines
+
+def end_loop_addresses(assembly: str) -> range:
+    """
+    Helper function that returns the ROM addresses of the loop at `END_LABEL` in the translation of a program.
+    """
+    address = 0
+    start = None
+
+    for line in assembly.splitlines():
+        line = line.strip()
+
+        if line == f"({MODULE_NAME}${END_LABEL})":
+            start = address
+        elif start is not None and line.startswith("("):
+            break
+
+        if is_instruction(line):
+            address += 1
+
+    return range(start, address)
+
+def run_mode(lines: List[str], mode: str) -> Tuple[Optional[array], Optional[str]]:
+    """
+    Runs a program in one mode and returns its final RAM, leaving out the scratch registers and the values
+    above the stack pointer, up to the heap, which only some modes clear. If the program fails, None is returned along
+    with the error.
+    """
+    try:
+        if mode == "vm":
+            machine = VMInterpreter([(MODULE_NAME, Parser(lines).iter_commands())])
+            end = lines.index(f"label {END_LABEL}")
+            end_loop = range(end, end + 2)
+        else:
+            assembly = translate(lines, MODULE_NAME, **translation_modes()[mode])
+            machine = HackCPU.from_assembly(assembly)
+            end_loop = end_loop_addresses(assembly)
+
+        for address, value in INITIAL_RAM.items():
+            machine.write(address, value)
+
+        cycles = 0
+
+        while machine.pc not in end_loop and cycles < MAX_CYCLES and not machine.is_halted():
+            cycles += machine.run(END_CHECK_CYCLES)
+    except (ValueError, RuntimeError) as error:
+        return None, f"{type(error).__name__}: {error}"
+
+    ram = array("H", machine.ram)
+    stack_pointer = min(ram[0], HEAP_BASE_ADDRESS)
+
+    for start, end in ((SCRATCH_ADDRESSES[0], SCRATCH_ADDRESSES[-1] + 1), (stack_pointer, HEAP_BASE_ADDRESS)):
+        if start < end:
+            ram[start:end] = array("H", bytes(2 * (end - start)))
+
+    return ram, None
+
+def find_mismatches(lines: List[str]) -> Dict[str, str]:
+    """
+    Runs a program in every mode and returns a description of how each mode that disagrees with `BASELINE_MODE`
+    differs from it, keyed by mode.
+    """
+    baseline, baseline_error = run_mode(lines, BASELINE_MODE)
+    mismatches = {}
+
+    for mode in MODES:
+        if mode == BASELINE_MODE:
+            continue
+
+        ram, error = run_mode(lines, mode)
+
+        if error != baseline_error:
+            mismatches[mode] = f"{error or 'no error'} instead of {baseline_error or 'no error'}"
+        elif ram != baseline:
+            differences = [address for address in range(RAM_SIZE) if ram[address] != baseline[address]]
+            mismatches[mode] = ", ".join(
+                f"RAM[{address}] is {ram[address]} instead of {baseline[address]}" for address in differences[:4]
+            ) + (f" and {len(differences) - 4} more" if len(differences) > 4 else "")
+
+    return mismatches
+
+def shrink(statements: List[Statement], mode: str) -> List[Statement]:
+    """
+    Shrinks a program that makes `mode` disagree with the baseline to a minimal program that still does, by
+    removing runs of statements, from half the program down to single statements, for as long as any can be removed.
+    Only programs that are valid according to `is_valid_program` are kept.
+    """
+    chunk_size = max(len(statements) // 2, 1)
+
+    while True:
+        start = 0
+        removed = False
+
+        while start < len(statements):
+            candidate = statements[:start] + statements[start + chunk_size:]
+
+            if candidate and is_valid_program(candidate) and mode in find_mismatches(program_lines(candidate)):
+                statements = candidate
+                removed = True
+            else:
+                start += chunk_size
+
+        if chunk_size == 1 and not removed:
+            return statements
+
+        if not removed:
+            chunk_size = max(chunk_size // 2, 1)
+
+def fuzz_case(seed: int, size: int) -> Optional[dict]:
+    """
+    Generates and runs the program for `seed`. Returns None if every mode agrees, and otherwise the
+    mismatches along with the program shrunk for the first mismatching mode.
+
+    This is a module level function so it can be pickled and run in a worker process.
+    """
+    statements = generate_program(random.Random(seed), size)
+    mismatches = find_mismatches(program_lines(statements))
+
+    if not mismatches:
+        return None
+
+    mode = sorted(mismatches)[0]
+    reduced = program_lines(shrink(statements, mode))
+
+    return {
+        "seed": seed,
+        "mismatches": mismatches,
+        "mode": mode,
+        "program": reduced,
+        "reduced_mismatch": find_mismatches(reduced)[mode],
+    }
+
+def fuzz(cases: int, size: int = 40, seed: int = 0, jobs: int = None) -> Iterator[Optional[dict]]:
+    """
+    Generator that runs `cases` random programs, from seed `seed` onwards, across a pool of `jobs` worker processes,
+    and yields the result of `fuzz_case` for every case in order.
+    """
+    seeds = range(seed, seed + cases)
+
+    if jobs == 1:
+        for case_seed in seeds:
+            yield fuzz_case(case_seed, size)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(fuzz_case, seeds, [size] * cases, chunksize=16)
@@ -0,0 +1,413 @@
+import os
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .analysis import (
+    ENTRY_POINT,
+    analyze_stack,
+    build_call_graph,
+    functions_modifying_pointers,
+    kept_functions_by_module,
+    remove_functions,
+    safe_functions,
+)
+from .assembler import VARIABLE_BASE_ADDRESS
+from .code_writer import CALLER_FRAME_SIZE, STACK_BASE_ADDRESS, TEMP_BASE_ADDRESS
+from .emulator import RAM_SIZE, WORD_MASK, SIGN_BIT, dump_ram, to_signed
+from .parser import ArithmeticCommand, Command, CommandType, Parser
+from .translator import SYSTEM_MODULE
+
+# Blocks are cut after this many commands even if they do not end in a jump, to bound compilation time
+MAX_BLOCK_LENGTH = 256
+
+# Opcodes of the decoded program. Segments are resolved while decoding, so every push and pop is one of
+# a few kinds depending on how its address is found.
+OP_NOP = 0
+OP_PUSH_CONSTANT = 1
+OP_PUSH_DIRECT = 2
+OP_PUSH_INDIRECT = 3
+OP_POP_DIRECT = 4
+OP_POP_INDIRECT = 5
+OP_ARITHMETIC = 6
+OP_GOTO = 7
+OP_IF_GOTO = 8
+OP_FUNCTION = 9
+OP_CALL = 10
+OP_RETURN = 11
+
+# Address of the base pointer of every segment that is addressed through one
+BASE_POINTER_ADDRESSES = {
+    "local": 1,
+    "argument": 2,
+    "this": 3,
+    "that": 4,
+}
+
+POINTER_BASE_ADDRESS = 3
+
+# Python statements computing every arithmetic command on the stack of unsigned 16-bit values, given the stack
+# pointer in `sp`. Comparisons subtract with wraparound and test the sign of the result like the generated code,
+# so they agree with it even when the subtraction overflows.
+# The top value of binary operations is popped into `top`, and cleared where the generated code clears it.
+ARITHMETIC_STATEMENTS = {
+    ArithmeticCommand.ADD: [f"ram[sp - 1] = (ram[sp - 1] + top) & {WORD_MASK}"],
+    ArithmeticCommand.SUB: [f"ram[sp - 1] = (ram[sp - 1] - top) & {WORD_MASK}"],
+    ArithmeticCommand.AND: ["ram[sp - 1] &= top"],
+    ArithmeticCommand.OR: ["ram[sp - 1] |= top"],
+    ArithmeticCommand.NEG: [f"ram[sp - 1] = -ram[sp - 1] & {WORD_MASK}"],
+    ArithmeticCommand.NOT: [f"ram[sp - 1] ^= {WORD_MASK}"],
+    ArithmeticCommand.EQ: [f"ram[sp - 1] = {WORD_MASK} if ram[sp - 1] == top else 0"],
+    ArithmeticCommand.GT: [
+        f"value = (ram[sp - 1] - top) & {WORD_MASK}",
+        f"ram[sp - 1] = {WORD_MASK} if 0 < value < {SIGN_BIT} else 0",
+    ],
+    ArithmeticCommand.LT: [
+        f"value = (ram[sp - 1] - top) & {WORD_MASK}",
+        f"ram[sp - 1] = {WORD_MASK} if value >= {SIGN_BIT} else 0",
+    ],
+}
+
+# Statements popping the top of the stack into `top`, clearing its slot
+POP_STATEMENTS = ["sp -= 1", "top = ram[sp]", "ram[sp] = 0"]
+
+# Statements popping the top of the stack into `top` in functions whose translation does not clear popped slots
+POP_STATEMENTS_WITHOUT_CLEARING = ["sp -= 1", "top = ram[sp]"]
+
+UNARY_OPERATIONS = (ArithmeticCommand.NEG, ArithmeticCommand.NOT)
+
+# Operations in the order of their operand in `OP_ARITHMETIC` commands
+ARITHMETIC_OPERATIONS = list(ArithmeticCommand)
+
+class VMInterpreter:
+    """
+    An interpreter that runs VM programs directly, without translating them to Hack assembly.
+
+    The program is decoded once into arrays of opcodes and operands, with segments, labels, functions and static
+    variables resolved to addresses ahead of time. Like `emulator.HackCPU`, each straight-line run of commands
+    ending in a jump, call or return is then compiled into a Python function the first time it is reached.
+
+    RAM is laid out exactly as in the translated program: the stack, the segment pointers, the frames pushed
+    by calls, and static variables, which are allocated in the order the assembler would allocate them.
+    Running a program therefore leaves the same RAM as running its translation with the default options,
+    except for the following:
+        - Return addresses on the stack are indices into the decoded program rather than ROM addresses.
+        - The registers R13 to R15, which the generated code uses as scratch space, are never written.
+
+    Popped values are cleared like the stack-based `CodeWriter` clears them, i.e. everywhere except in the functions
+    that `analysis.safe_functions` finds safe in their module. The register backend and the optimizer never clear
+    them, so RAM above the stack pointer only matches the default translation.
+
+    RAM is exposed as an `array("H")` buffer of unsigned 16-bit words. Use `read` or `dump` to get signed values.
+    """
+    def __init__(self, modules: List[Tuple[str, Iterable[Command]]], remove_unused_functions: bool = True):
+        """
+        Args:
+            modules (List[Tuple[str, Iterable[Command]]]): The name and commands of every module of the program,
+                in the order they would be linked. If one of them is `Sys`, the program starts by calling `Sys.init`
+                like the bootstrap code, and otherwise it starts at the first command.
+            remove_unused_functions (bool): If set and the program defines `Sys.init`, functions that cannot be
+                reached from it are left out, as they are by the translator. This changes where static variables live.
+        """
+        modules = [(name, list(commands)) for name, commands in modules]
+
+        if remove_unused_functions:
+            kept_functions = kept_functions_by_module([build_call_graph(commands) for _, commands in modules])
+            modules = [
+                (name, commands if kept is None else list(remove_functions(commands, kept)))
+                for (name, commands), kept in zip(modules, kept_functions)
+            ]
+
+        self.opcodes = array("B")
+        self.first_operands = array("i")
+        self.second_operands = array("i")
+
+        # Whether the values popped by every command are cleared, see `CodeWriter.select_templates`
+        self.clears_popped_slots = array("B")
+
+        # Programs with a Sys module start by calling Sys.init, like the bootstrap code
+        if SYSTEM_MODULE in [name for name, _ in modules]:
+            bootstrap = [("Bootstrap", [Command.from_parts(CommandType.C_CALL, ENTRY_POINT, 0)])]
+            self.sets_stack_pointer = True
+        else:
+            bootstrap = []
+            self.sets_stack_pointer = False
+
+        self.decode(bootstrap + modules)
+
+        self.ram = array("H", bytes(2 * RAM_SIZE))
+        self.pc = 0
+        self.steps = 0
+        self.started = False
+
+        # Compiled blocks and their lengths, indexed by the command they start at
+        self.blocks: List[Optional[Callable]] = [None] * len(self.opcodes)
+        self.block_lengths: List[int] = [0] * len(self.opcodes)
+
+    @classmethod
+    def from_files(cls, input_files: List[str], **kwargs) -> "VMInterpreter":
+        modules = [
+            (os.path.basename(input_file).removesuffix(".vm"), Parser(input_file).parse_all())
+            for input_file in input_files
+        ]
+
+        return cls(modules, **kwargs)
+
+    def decode(self, modules: List[Tuple[str, List[Command]]]):
+        """
+        Decodes the commands of every module into `opcodes` and its two operand arrays.
+
+        Labels and functions become the index of the command they name, and every static variable gets the
+        address the assembler would give it, the next free one from 16 in the order they first appear.
+        """
+        pointer_saving_functions = functions_modifying_pointers(
+            command for _, commands in modules for command in commands
+        )
+
+        labels: Dict[str, int] = {}
+        functions: Dict[str, int] = {}
+        static_addresses: Dict[str, int] = {}
+
+        # Jumps and calls whose target is only known once every command has been seen
+        pending_targets: List[Tuple[int, str, bool]] = []
+
+        for module_name, commands in modules:
+            current_function = None
+            saves_pointers = False
+
+            # The translator analyzes every module on its own, so the same functions are found safe here
+            module_safe_functions = safe_functions(analyze_stack(commands))
+            clears_popped_slots = None not in module_safe_functions
+
+            for command in commands:
+                index = len(self.opcodes)
+                opcode, first, second = OP_NOP, 0, 0
+
+                if command.type in (CommandType.C_PUSH, CommandType.C_POP):
+                    segment = command.arg1
+                    is_push = command.type == CommandType.C_PUSH
+
+                    if segment == "constant":
+                        if not is_push:
+                            raise ValueError("Cannot pop constant")
+                        opcode, first = OP_PUSH_CONSTANT, command.arg2 & WORD_MASK
+                    elif segment in BASE_POINTER_ADDRESSES:
+                        opcode = OP_PUSH_INDIRECT if is_push else OP_POP_INDIRECT
+                        first, second = BASE_POINTER_ADDRESSES[segment], command.arg2
+                    else:
+                        opcode = OP_PUSH_DIRECT if is_push else OP_POP_DIRECT
+                        first = self.direct_address(segment, command.arg2, module_name, static_addresses)
+
+                elif command.type == CommandType.C_ARITHMETIC:
+                    opcode, first = OP_ARITHMETIC, ARITHMETIC_OPERATIONS.index(command.arg1)
+
+                elif command.type == CommandType.C_LABEL:
+                    labels[f"{current_function or module_name}${command.arg1}"] = index
+
+                elif command.type in (CommandType.C_GOTO, CommandType.C_IF):
+                    opcode = OP_GOTO if command.type == CommandType.C_GOTO else OP_IF_GOTO
+                    pending_targets.append((index, f"{current_function or module_name}${command.arg1}", False))
+
+                elif command.type == CommandType.C_FUNCTION:
+                    current_function = command.arg1
+                    saves_pointers = current_function in pointer_saving_functions
+                    clears_popped_slots = current_function not in module_safe_functions
+                    functions[current_function] = index
+                    opcode, first, second = OP_FUNCTION, command.arg2, saves_pointers
+
+                elif command.type == CommandType.C_CALL:
+                    opcode, second = OP_CALL, command.arg2
+                    pending_targets.append((index, command.arg1, True))
+
+                elif command.type == CommandType.C_RETURN:
+                    opcode, first = OP_RETURN, saves_pointers
+
+                else:
+                    raise ValueError(f"Unsupported command: {command}")
+
+                self.opcodes.append(opcode)
+                self.first_operands.append(first)
+                self.second_operands.append(second)
+                self.clears_popped_slots.append(clears_popped_slots)
+
+        for index, target, is_call in pending_targets:
+            targets = functions if is_call else labels
+
+            if target not in targets:
+                raise ValueError(f"Undefined {'function' if is_call else 'label'}: {target}")
+
+            self.first_operands[index] = targets[target]
+
+    @staticmethod
+    def direct_address(segment: str, index: int, module_name: str, static_addresses: Dict[str, int]) -> int:
+        """
+        Helper function that returns the RAM address of `segment[index]` for segments that map to a fixed register.
+        """
+        if segment == "static":
+            symbol = f"{module_name}.{index}"
+            if symbol not in static_addresses:
+                static_addresses[symbol] = VARIABLE_BASE_ADDRESS + len(static_addresses)
+            return static_addresses[symbol]
+
+        if segment == "temp":
+            if not 0 <= index <= 7:
+                raise ValueError(f"Temp register address out of bounds: {index}")
+            return TEMP_BASE_ADDRESS + index
+
+        if segment == "pointer":
+            if index not in (0, 1):
+                raise ValueError(f"Pointer values can only be 0 or 1")
+            return POINTER_BASE_ADDRESS + index
+
+        raise ValueError(f"Invalid memory segment: {segment}")
+
+    def read(self, address: int) -> int:
+        """
+        Returns the value at `address` in RAM as a signed integer.
+        """
+        return to_signed(self.ram[address])
+
+    def write(self, address: int, value: int):
+        """
+        Stores a signed or unsigned value at `address` in RAM.
+        """
+        self.ram[address] = value & WORD_MASK
+
+    def is_halted(self) -> bool:
+        """
+        Returns True once the program has run past its last command.
+        """
+        return self.pc >= len(self.opcodes)
+
+    def run(self, steps: int) -> int:
+        """
+        Runs the program for at most `steps` commands, or until it runs past the last command.
+        Returns the number of commands that were executed.
+        """
+        if not self.started:
+            # The bootstrap code sets the stack pointer before anything else runs
+            if self.sets_stack_pointer:
+                self.ram[0] = STACK_BASE_ADDRESS
+            self.started = True
+
+        length = len(self.opcodes)
+        blocks = self.blocks
+        block_lengths = self.block_lengths
+        ram = self.ram
+
+        pc = self.pc
+        executed = 0
+
+        try:
+            while executed < steps and pc < length:
+                block = blocks[pc]
+
+                if block is None:
+                    block, block_length = self.compile_block(pc, MAX_BLOCK_LENGTH)
+                    blocks[pc] = block
+                    block_lengths[pc] = block_length
+
+                block_length = block_lengths[pc]
+
+                # Run the last few commands one block at a time so exactly `steps` commands are executed
+                if executed + block_length > steps:
+                    block, block_length = self.compile_block(pc, steps - executed)
+
+                pc = block(ram)
+                executed += block_length
+        except (IndexError, OverflowError):
+            raise RuntimeError(f"Invalid RAM access near VM command {pc}")
+        finally:
+            self.pc = pc
+            self.steps += executed
+
+        return executed
+
+    def compile_block(self, start: int, max_length: int):
+        """
+        Translates the commands starting at `start` into a Python function, stopping after the first jump, call
+        or return, or after `max_length` commands. The function takes RAM and returns the index of the next command.
+
+        Returns:
+            A tuple of the compiled function and the number of commands it executes.
+        """
+        lines = ["def block(ram):", "    sp = ram[0]"]
+        pc = start
+        next_pc = None
+
+        def add(*statements: str):
+            lines.extend(f"    {statement}" for statement in statements)
+
+        while pc < len(self.opcodes) and pc - start < max_length:
+            opcode = self.opcodes[pc]
+            first = self.first_operands[pc]
+            second = self.second_operands[pc]
+            pop_statements = POP_STATEMENTS if self.clears_popped_slots[pc] else POP_STATEMENTS_WITHOUT_CLEARING
+            pc += 1
+
+            if opcode == OP_PUSH_CONSTANT:
+                add(f"ram[sp] = {first}", "sp += 1")
+            elif opcode == OP_PUSH_DIRECT:
+                add(f"ram[sp] = ram[{first}]", "sp += 1")
+            elif opcode == OP_PUSH_INDIRECT:
+                add(f"ram[sp] = ram[ram[{first}] + {second}]", "sp += 1")
+            elif opcode == OP_POP_DIRECT:
+                add(*pop_statements, f"ram[{first}] = top")
+            elif opcode == OP_POP_INDIRECT:
+                add(*pop_statements, f"ram[ram[{first}] + {second}] = top")
+            elif opcode == OP_ARITHMETIC:
+                operation = ARITHMETIC_OPERATIONS[first]
+                if operation not in UNARY_OPERATIONS:
+                    add(*pop_statements)
+                add(*ARITHMETIC_STATEMENTS[operation])
+            elif opcode == OP_FUNCTION:
+                if second:
+                    add("ram[sp] = ram[3]", "ram[sp + 1] = ram[4]", "sp += 2")
+                add("ram[1] = sp")
+                if first:
+                    add(*[f"ram[sp + {offset}] = 0" for offset in range(first)], f"sp += {first}")
+            elif opcode == OP_GOTO:
+                next_pc = f"{first}"
+                break
+            elif opcode == OP_IF_GOTO:
+                add("sp -= 1", "if ram[sp]:", "    ram[0] = sp", f"    return {first}")
+                next_pc = f"{pc}"
+                break
+            elif opcode == OP_CALL:
+                # Push the return address and the caller's LCL and ARG, and point ARG at the arguments
+                add(
+                    f"ram[sp] = {pc}",
+                    "ram[sp + 1] = ram[1]",
+                    "ram[sp + 2] = ram[2]",
+                    f"sp += {CALLER_FRAME_SIZE}",
+                    f"ram[2] = sp - {second + CALLER_FRAME_SIZE}",
+                )
+                next_pc = f"{first}"
+                break
+            elif opcode == OP_RETURN:
+                add("frame = ram[1]")
+                if first:
+                    # Restore THAT and THIS, which the shared return routine pops off the end of the frame
+                    add("ram[4] = ram[frame - 1]", "ram[3] = ram[frame - 2]", "frame -= 2")
+                add(
+                    f"return_address = ram[frame - {CALLER_FRAME_SIZE}]",
+                    # Move the return value to the first argument and drop everything above it
+                    "ram[ram[2]] = ram[sp - 1]",
+                    "sp = ram[2] + 1",
+                    # Restore the caller's ARG and LCL, leaving LCL where the return routine leaves it
+                    "ram[2] = ram[frame - 1]",
+                    "ram[1] = ram[frame - 2]",
+                )
+                next_pc = "return_address"
+                break
+
+        add("ram[0] = sp", f"return {next_pc if next_pc is not None else pc}")
+
+        namespace: Dict[str, Callable] = {}
+        exec(compile("\n".join(lines), f"<vm block {start}>", "exec"), namespace)
+
+        return namespace["block"], pc - start
+
+    def dump(self, addresses: Iterable[int]) -> str:
+        """
+        Returns the values at the given RAM addresses as a table in the format of the nand2tetris `.cmp` files.
+        """
+        return dump_ram(self.read, addresses)
@@ -1,23 +1,841 @@
+import argparse
+import asyncio
+import json
+import io
+import os
+import shutil
 import sys
-from .parser import Parser
-from .code_writer import CodeWriter
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from contextlib import nullcontext, redirect_stdout
+from typing import Collection, Dict, List, Optional, TextIO, Union
+from .parser import CommandArray, Parser
+from .code_writer import (
+    HEAP_BASE_ADDRESS,
+    STACK_BASE_ADDRESS,
+    TOP_LEVEL_CODE,
+    count_comparison_calls,
+    comparison_rom_words_saved,
+    function_sizes,
+    uses_call_routines,
+)
+from .cache import DEFAULT_MAX_CACHE_SIZE, TranslationCache, file_digest
+from .client import DEFAULT_HOST, DEFAULT_PORT, TranslationClient
+from .assembler import ROM_SIZE, assemble, format_hack, pack_words
+from .emulator import HackCPU
+from .interpreter import VMInterpreter
+from .files import AtomicFile, write_atomically
+from .server import EMIT_FORMATS, TranslationServer
+from .benchmark import WORKLOAD_MIXES, run_benchmarks
+from .analysis import (
+    ENTRY_POINT,
+    analyze_stack,
+    build_call_graph,
+    functions_modifying_pointers,
+    kept_functions_by_module,
+    remove_functions,
+    stack_requirements,
+)
+from .translator import (
+    BACKENDS,
+    SYSTEM_MODULE,
+    call_routines,
+    create_writer,
+    link,
+    prologue,
+    translate_commands,
+    write_commands,
+)
+from .profiler import profile_files
+from .fuzz import MODES, fuzz
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: hack-vm-translate <file>")
+def module_name(input_file: str) -> str:
+    return os.path.basename(input_file).removesuffix(".vm")
+
+def translate_file(
+    input_file: str,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    kept_functions: Collection[str] = None,
+    backend: str = "stack",
+) -> str:
+    """
+    Translates a single .vm file and returns the generated assembly.
+    Static variables and labels are namespaced by the file name, so the result can be
+    concatenated with the output of other files from the same program.
+
+    When `shared_comparisons` is set, the routines are not included and have to be written once for the
+    whole program with `CodeWriter.write_comparison_routines`.
+
+    The same goes for the routines used by calls and returns, see `CodeWriter.write_call_routines`.
+
+    If `kept_functions` is given, every function defined in the file that is not in it is left out.
+    See `translator.translate_commands`.
+
+    This is a module level function so it can be pickled and run in a worker process.
+    """
+    # The whole file is parsed up front so only the functions that change THIS and THAT have to save them
+    commands = Parser(input_file).parse_all()
+
+    return translate_commands(commands, module_name(input_file), optimize, shared_comparisons, kept_functions, backend)
+
+def translate_file_into_cache(
+    input_file: str,
+    cache: TranslationCache,
+    key: str,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    kept_functions: Collection[str] = None,
+    backend: str = "stack",
+    commands: CommandArray = None,
+):
+    """
+    Translates a single .vm file like `translate_file`, and stores the assembly in `cache` under `key` along with
+    its `chunk_metadata`. Without the optimizer, the assembly is written straight to the cache entry rather than
+    held in memory. If `commands` is given, they are translated instead of parsing the file again.
+
+    This is a module level function so it can be pickled and run in a worker process.
+    """
+    if commands is None:
+        commands = Parser(input_file).parse_all()
+
+    name = module_name(input_file)
+
+    if optimize:
+        assembly = translate_commands(commands, name, optimize, shared_comparisons, kept_functions, backend)
+        cache.put(key, assembly, chunk_metadata(assembly))
+        return
+
+    writer = write_commands(commands, name, cache.path(key), optimize, shared_comparisons, kept_functions, backend)
+    cache.put_metadata(key, {
+        "uses_call_routines": writer.uses_call_routines,
+        "comparison_calls": writer.comparison_call_count,
+    })
+
+def chunk_metadata(assembly: str) -> dict:
+    """
+    Returns what `write_files` needs to know about the translation of a file: whether it uses the shared call and
+    return routines, and the number of calls to the shared comparison routines.
+    """
+    return {"uses_call_routines": uses_call_routines(assembly), "comparison_calls": count_comparison_calls(assembly)}
+
+def write_files(
+    output: TextIO,
+    input_files: List[str],
+    jobs: int = None,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    cache: TranslationCache = None,
+    remove_unused_functions: bool = True,
+    backend: str = "stack",
+) -> int:
+    """
+    Translates several .vm files of the same program and writes the merged assembly to `output`, one file at a time.
+    Returns the number of comparisons translated into calls to the shared routines.
+
+    Files are translated in parallel across `jobs` processes and merged in the given order,
+    so the output is the same regardless of which worker finishes first.
+
+    If a cache is given, files whose translation is already cached are not translated again,
+    and the translation of every other file is added to the cache. The translations are then copied
+    from the cache entries to `output`, so they are never held in memory as a whole.
+
+    If `remove_unused_functions` is set and the program defines `Sys.init`, functions that cannot be reached
+    from it are left out of the output. See `kept_functions_by_file`.
+
+    `backend` is the name of the code generation backend to use, see `translator.BACKENDS`.
+    """
+    options = {"optimize": optimize, "shared_comparisons": shared_comparisons, "backend": backend}
+    module_names = [module_name(input_file) for input_file in input_files]
+    chunks: List[Optional[str]] = [None] * len(input_files)
+
+    # Every file is read once to hash it, and is only parsed if its call graph or translation is not cached
+    digests = [file_digest(input_file) for input_file in input_files] if cache is not None else None
+
+    # Files parsed to build their call graph, by index, which are translated from these commands
+    # rather than parsed again when they are translated in this process
+    parsed: Dict[int, CommandArray] = {}
+
+    if remove_unused_functions:
+        kept_functions = kept_functions_by_file(input_files, cache, digests, parsed)
+    else:
+        kept_functions = [None] * len(input_files)
+
+    def translate_in_process(index: int) -> str:
+        commands = parsed.pop(index, None) or Parser(input_files[index]).parse_all()
+        return translate_commands(commands, module_names[index], optimize, shared_comparisons, kept_functions[index], backend)
+
+    if cache is None:
+        misses = list(range(len(input_files)))
+
+        if jobs == 1 or len(misses) <= 1:
+            translated = [translate_in_process(index) for index in misses]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                translated = list(executor.map(
+                    translate_file,
+                    input_files,
+                    repeat(optimize),
+                    repeat(shared_comparisons),
+                    kept_functions,
+                    repeat(backend),
+                ))
+
+        chunks = translated
+    else:
+        keys = [
+            cache.key(input_file, {**options, "kept_functions": kept_functions[index]}, digests[index])
+            for index, input_file in enumerate(input_files)
+        ]
+        misses = [index for index, key in enumerate(keys) if key not in cache]
+
+        if jobs == 1 or len(misses) <= 1:
+            for index in misses:
+                translate_file_into_cache(
+                    input_files[index],
+                    cache,
+                    keys[index],
+                    optimize,
+                    shared_comparisons,
+                    kept_functions[index],
+                    backend,
+                    parsed.pop(index, None),
+                )
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(
+                    translate_file_into_cache,
+                    [input_files[index] for index in misses],
+                    repeat(cache),
+                    [keys[index] for index in misses],
+                    repeat(optimize),
+                    repeat(shared_comparisons),
+                    [kept_functions[index] for index in misses],
+                    repeat(backend),
+                ))
+
+    output.write(prologue(module_names, shared_comparisons))
+    uses_routines = False
+    comparison_calls = 0
+
+    for index in range(len(input_files)):
+        entry = cache.open(keys[index]) if chunks[index] is None else None
+
+        if entry is not None:
+            file, metadata = entry
+
+            with file:
+                shutil.copyfileobj(file, output)
+        else:
+            # Entries evicted by a concurrent build since they were added are translated again
+            if chunks[index] is None:
+                chunks[index] = translate_in_process(index)
+
+            output.write(chunks[index])
+            metadata = chunk_metadata(chunks[index])
+            chunks[index] = None
+
+        uses_routines = uses_routines or metadata["uses_call_routines"]
+        comparison_calls += metadata["comparison_calls"]
+
+    if uses_routines:
+        output.write(call_routines())
+
+    if cache is not None and misses:
+        cache.evict()
+
+    return comparison_calls
+
+def translate_files(input_files: List[str], **kwargs) -> str:
+    """
+    Translates several .vm files of the same program and returns the merged assembly.
+    See `write_files` for the supported options.
+    """
+    output = io.StringIO()
+    write_files(output, input_files, **kwargs)
+    return output.getvalue()
+
+def kept_functions_by_file(
+    input_files: List[str],
+    cache: TranslationCache = None,
+    digests: List[str] = None,
+    parsed: Dict[int, CommandArray] = None,
+) -> List[Optional[List[str]]]:
+    """
+    Returns, for every file, the functions to pass to `translate_file` as `kept_functions`.
+    See `analysis.kept_functions_by_module`.
+
+    `Sys.init` is defined in Sys.vm, so programs without that file keep every function and are not parsed.
+    If a cache is given, the call graphs of files are taken from it by their `digests`, and added to it.
+    If `parsed` is given, the commands of every file that had to be parsed are stored in it by index.
+    """
+    if SYSTEM_MODULE not in [module_name(input_file) for input_file in input_files]:
+        return [None] * len(input_files)
+
+    call_graphs = []
+
+    for index, input_file in enumerate(input_files):
+        call_graph = cache.get_call_graph(digests[index]) if cache is not None else None
+
+        if call_graph is None:
+            commands = Parser(input_file).parse_all()
+            call_graph = build_call_graph(commands)
+
+            if parsed is not None:
+                parsed[index] = commands
+
+            if cache is not None:
+                cache.put_call_graph(digests[index], call_graph)
+
+        call_graphs.append(call_graph)
+
+    return kept_functions_by_module(call_graphs)
+
+def directory_files(input_dir: str) -> List[str]:
+    """
+    Returns the paths of every .vm file in a directory, in file name order.
+    """
+    input_files = sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.endswith(".vm")
+    )
+
+    if not input_files:
+        raise FileNotFoundError(f"No .vm files found in directory: {input_dir}")
+
+    return input_files
+
+def translate_directory(input_dir: str, **kwargs) -> str:
+    """
+    Translates every .vm file in a directory and returns the merged assembly.
+    Files are merged in file name order. See `translate_files` for the supported options.
+    """
+    return translate_files(directory_files(input_dir), **kwargs)
+
+# File extension of the output for every `--emit` format
+EMIT_EXTENSIONS = {
+    "asm": ".asm",
+    "hack": ".hack",
+    "bin": ".bin",
+}
+
+def write_output(output: Union[str, TextIO], assembly: str, emit: str = "asm"):
+    """
+    Writes a translated program in the `emit` format: `asm` writes the assembly itself, `hack` assembles it into the
+    textual `.hack` format, and `bin` assembles it into packed big-endian 16-bit words.
+
+    Args:
+        output (str | TextIO): The path of the file to create, which is written atomically, or an open text stream
+            such as `sys.stdout`. Binary output goes to the underlying binary buffer of the stream.
+    """
+    if emit == "asm":
+        data = assembly
+    elif emit == "hack":
+        data = format_hack(assemble(assembly))
+    else:
+        data = pack_words(assemble(assembly))
+
+    if isinstance(output, str):
+        write_atomically(output, data)
+    elif isinstance(data, bytes):
+        output.flush()
+        output.buffer.write(data)
+        output.buffer.flush()
+    else:
+        output.write(data)
+        output.flush()
+
+def report_comparison_rom_words_saved(call_count: int):
+    print(f"Shared comparison routines saved {comparison_rom_words_saved(call_count)} ROM words across {call_count} comparisons")
+
+def report_function_sizes(assembly: str):
+    """
+    Prints the number of ROM words taken by every function, largest first, and how much of the ROM the program fills.
+    """
+    sizes = function_sizes(assembly)
+    total = sum(sizes.values())
+    width = max([len(name) for name in sizes] + [len("Total")])
+
+    for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True):
+        print(f"{name:<{width}}  {size:>6}  {size / total:>6.1%}")
+
+    print(f"{'Total':<{width}}  {total:>6}  {total / ROM_SIZE:>6.1%} of {ROM_SIZE} ROM words")
+
+    if total > ROM_SIZE:
+        print(f"Warning: The program does not fit in ROM by {total - ROM_SIZE} words")
+
+def report_stack_usage(input_files: List[str], remove_unused_functions: bool = True):
+    """
+    Prints the stack depth reached by every function and the stack it needs along with the functions it calls,
+    how much stack the whole program needs, and every problem found. See `analysis.analyze_stack`.
+    """
+    commands = [command for input_file in input_files for command in Parser(input_file).iter_commands()]
+
+    if remove_unused_functions:
+        kept_functions = kept_functions_by_module([build_call_graph(commands)])[0]
+        if kept_functions is not None:
+            commands = list(remove_functions(commands, kept_functions))
+
+    usages = analyze_stack(commands)
+    requirements = stack_requirements(usages, functions_modifying_pointers(commands))
+
+    def format_depth(depth: Optional[int]) -> str:
+        return "no bound" if depth is None else f"{depth}"
+
+    names = {name: TOP_LEVEL_CODE if name is None else name for name in usages}
+    width = max([len(name) for name in names.values()] + [len("Function")])
+
+    print(f"{'Function':<{width}}  {'Locals':>6}  {'Depth':>9}  {'Needed':>9}")
+
+    for name, usage in usages.items():
+        print(f"{names[name]:<{width}}  {usage.local_count:>6}  {format_depth(usage.max_depth):>9}  {format_depth(requirements.get(name)):>9}")
+
+    # The bootstrap code calls Sys.init with an empty stack, and programs without it start with the code outside of functions
+    entry_point = ENTRY_POINT if ENTRY_POINT in usages else None
+    stack_size = HEAP_BASE_ADDRESS - STACK_BASE_ADDRESS
+    needed = requirements.get(entry_point)
+
+    if needed is None:
+        print("The stack the program needs has no bound, because of recursion, a loop that keeps pushing, or calls to functions outside the program")
+    else:
+        print(f"The program needs {needed} words of stack, up to RAM[{STACK_BASE_ADDRESS + needed - 1}], {needed / stack_size:.1%} of the {stack_size} words before the heap")
+
+        if needed > stack_size:
+            print(f"Warning: The stack overflows into the heap by {needed - stack_size} words")
+
+    for name, usage in usages.items():
+        for issue in usage.issues:
+            print(f"Warning: {names[name]}: {issue}")
+
+def parse_addresses(value: str) -> List[int]:
+    """
+    Parses a comma separated list of RAM addresses and ranges, e.g. `0,256-265`.
+    """
+    addresses = []
+
+    for part in value.split(","):
+        if "-" in part:
+            start, end = part.split("-", 1)
+            addresses.extend(range(int(start), int(end) + 1))
+        else:
+            addresses.append(int(part))
+
+    return addresses
+
+def parse_cmp_file(cmp_file: str):
+    """
+    Parses a nand2tetris `.cmp` file with a single row of values and returns the RAM addresses it checks
+    along with their expected values.
+    """
+    with open(cmp_file, "r") as file:
+        rows = [
+            [cell.strip() for cell in line.strip().strip("|").split("|")]
+            for line in file
+            if line.strip()
+        ]
+
+    if len(rows) < 2:
+        raise ValueError(f"Invalid compare file: {cmp_file}: Expected a header and a row of values")
+
+    header, values = rows[0], rows[-1]
+    addresses = []
+
+    for name in header:
+        if not name.startswith("RAM[") or not name.endswith("]"):
+            raise ValueError(f"Invalid compare file: {cmp_file}: Unsupported column {name}")
+        addresses.append(int(name[4:-1]))
+
+    return addresses, [int(value) for value in values]
+
+def run_main(argv: List[str]):
+    """
+    Entry point of `hack-vm-translate run`, which translates a program and runs it on the built-in Hack emulator.
+    """
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate run", description="Translate a program and run it on the built-in Hack CPU emulator")
+    arg_parser.add_argument("input", help="A .vm file, a directory of .vm files, or an already translated .asm file")
+    arg_parser.add_argument("--cycles", type=int, default=1_000_000, help="Maximum number of instructions, or VM commands with --vm, to run (default: 1000000)")
+    arg_parser.add_argument("--vm", action="store_true", help="Run the VM commands directly on the built-in VM interpreter instead of translating them")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDRESS=VALUE", help="Set a RAM address before running, e.g. --set 0=256. Can be repeated")
+    arg_parser.add_argument("--ram", type=parse_addresses, default=[0], help="RAM addresses to print after running, e.g. 0,256-265 (default: 0)")
+    arg_parser.add_argument("--compare", metavar="CMP_FILE", help="Compare the final RAM with a nand2tetris .cmp file and exit with an error if it differs")
+    arg_parser.add_argument("-O", "--optimize", action="store_true", help="Optimize the program before running it")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="Translate eq, gt and lt into calls to shared routines")
+    arg_parser.add_argument("--backend", choices=list(BACKENDS), default="stack", help="Code generation backend: stack keeps every value on the stack in RAM, register keeps the top of the stack in the D register (default: stack)")
+    args = arg_parser.parse_args(argv)
+
+    input_path = args.input
+
+    if args.vm:
+        if input_path.endswith(".asm"):
+            arg_parser.error("--vm needs .vm files rather than an .asm file")
+        if args.optimize:
+            arg_parser.error("--vm cannot be combined with --optimize")
+
+        input_files = directory_files(input_path) if os.path.isdir(input_path) else [input_path]
+        cpu = VMInterpreter.from_files(input_files)
+    elif input_path.endswith(".asm"):
+        with open(input_path, "r") as file:
+            assembly = file.read()
+    elif os.path.isdir(input_path):
+        assembly = translate_directory(input_path, optimize=args.optimize, shared_comparisons=args.shared_comparisons, backend=args.backend)
+    else:
+        assembly = translate_files([input_path], optimize=args.optimize, shared_comparisons=args.shared_comparisons, backend=args.backend)
+
+    if not args.vm:
+        cpu = HackCPU.from_assembly(assembly)
+
+    for assignment in args.set:
+        address, value = assignment.split("=", 1)
+        cpu.write(int(address), int(value))
+
+    cycles = cpu.run(args.cycles)
+    print(f"Ran {cycles} {'VM commands' if args.vm else 'instructions'}{'' if cpu.is_halted() else ' without reaching the end of the program'}")
+
+    if args.compare:
+        addresses, expected = parse_cmp_file(args.compare)
+        print(cpu.dump(addresses), end="")
+
+        actual = [cpu.read(address) for address in addresses]
+        if actual != expected:
+            print(f"Comparison failure: expected {expected}")
+            sys.exit(1)
+        return
+
+    print(cpu.dump(args.ram), end="")
+
+def bench_main(argv: List[str]):
+    """
+    Entry point of `hack-vm-translate bench`, which measures translation speed and the size of the generated code.
+    """
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate bench", description="Benchmark the translator and print the results as JSON")
+    arg_parser.add_argument("inputs", nargs="*", help="Extra .vm files or directories of .vm files to benchmark (default: tests, if it exists)")
+    arg_parser.add_argument("--size", type=int, default=100_000, help="Number of commands in each synthetic workload (default: 100000)")
+    arg_parser.add_argument("--mix", action="append", choices=list(WORKLOAD_MIXES), help="Synthetic workload mix to run. Can be repeated (default: all)")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Number of runs per workload, of which the fastest is reported (default: 3)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic workloads")
+    arg_parser.add_argument("-O", "--optimize", action="store_true", help="Benchmark with the optimizer enabled")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="Benchmark with shared comparison routines")
+    arg_parser.add_argument("--backend", choices=list(BACKENDS), default="stack", help="Code generation backend: stack keeps every value on the stack in RAM, register keeps the top of the stack in the D register (default: stack)")
+    arg_parser.add_argument("-o", "--output", help="Write the JSON report to this file instead of stdout")
+    args = arg_parser.parse_args(argv)
+
+    inputs = args.inputs or (["tests"] if os.path.isdir("tests") else [])
+    input_files = []
+
+    for input_path in inputs:
+        if os.path.isdir(input_path):
+            input_files += directory_files(input_path)
+        else:
+            input_files.append(input_path)
+
+    report = run_benchmarks(
+        size=args.size,
+        mixes=args.mix or list(WORKLOAD_MIXES),
+        input_files=input_files,
+        repeat=args.repeat,
+        optimize=args.optimize,
+        shared_comparisons=args.shared_comparisons,
+        seed=args.seed,
+        backend=args.backend,
+    )
+
+    report_json = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report_json + "\n")
+    else:
+        print(report_json)
+
+def fuzz_main(argv: List[str]):
+    """
+    Entry point of `hack-vm-translate fuzz`, which runs random programs in every translation mode and reports
+    the programs whose final RAM differs from the default translation.
+    """
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate fuzz", description=f"Run random VM programs with branches, loops and calls in every mode ({', '.join(MODES)}) and compare the final RAM with the default translation")
+    arg_parser.add_argument("--cases", type=int, default=1000, help="Number of programs to run (default: 1000)")
+    arg_parser.add_argument("--size", type=int, default=40, help="Number of statements outside of functions in each program, where a branch or loop counts as one (default: 40)")
+    arg_parser.add_argument("--seed", type=int, default=0, help="Seed of the first program. Every program has its own seed, so failures can be reproduced on their own")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--save-dir", default=None, help="Directory to write every shrunk failing program to, as Fuzz<seed>.vm")
+    args = arg_parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        arg_parser.error("--jobs must be at least 1")
+
+    start = time.perf_counter()
+    failures = 0
+
+    for result in fuzz(args.cases, args.size, args.seed, args.jobs):
+        if result is None:
+            continue
+
+        failures += 1
+        print(f"Seed {result['seed']} differs in {', '.join(sorted(result['mismatches']))}")
+        print(f"Shrunk to {len(result['program'])} commands, where {result['mode']} has {result['reduced_mismatch']}:")
+        print("".join(f"    {line}\n" for line in result["program"]), end="")
+
+        if args.save_dir is not None:
+            os.makedirs(args.save_dir, exist_ok=True)
+            write_atomically(os.path.join(args.save_dir, f"Fuzz{result['seed']}.vm"), "".join(f"{line}\n" for line in result["program"]))
+
+    elapsed = time.perf_counter() - start
+    print(f"Ran {args.cases} programs in {elapsed:.1f}s ({args.cases / elapsed * 60:.0f} per minute), {failures} differed")
+
+    if failures:
         sys.exit(1)
 
-    input_file = sys.argv[1]
-    print(f"Processing file: {input_file}")
+def add_address_arguments(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument("--socket", default=None, help="Path of the Unix socket to use instead of TCP")
+    arg_parser.add_argument("--host", default=DEFAULT_HOST, help=f"Host to use for TCP (default: {DEFAULT_HOST})")
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to use for TCP (default: {DEFAULT_PORT})")
+
+def serve_main(argv: List[str]):
+    """
+    Entry point of `hack-vm-translate serve`, which starts a translation server for `hack-vm-translate client`.
+    """
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate serve", description="Run a translation server that keeps the translator loaded between requests")
+    add_address_arguments(arg_parser)
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    args = arg_parser.parse_args(argv)
+
+    server = TranslationServer(args.jobs)
+    print(f"Listening on {args.socket or f'{args.host}:{args.port}'} with {server.jobs} workers")
+
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+def client_main(argv: List[str]):
+    """
+    Entry point of `hack-vm-translate client`, which translates a program on a server started by `hack-vm-translate serve`.
+    """
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate client", description="Translate a program on a running translation server")
+    arg_parser.add_argument("input", help="A .vm file, or a directory of .vm files to translate into a single program")
+    add_address_arguments(arg_parser)
+    arg_parser.add_argument("-O", "--optimize", action="store_true", help="Optimize the program")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="Translate eq, gt and lt into calls to shared routines")
+    arg_parser.add_argument("--keep-unused-functions", action="store_true", help="Translate every function, even those that cannot be reached from Sys.init")
+    arg_parser.add_argument("--emit", choices=EMIT_FORMATS, default="asm", help="Output format (default: asm)")
+    arg_parser.add_argument("--backend", choices=list(BACKENDS), default="stack", help="Code generation backend: stack keeps every value on the stack in RAM, register keeps the top of the stack in the D register (default: stack)")
+    arg_parser.add_argument("-o", "--output", default=None, help="File to write the program to, or - for stdout (default: the input name with the extension of the --emit format)")
+    args = arg_parser.parse_args(argv)
+
+    input_path = os.path.normpath(args.input)
+
+    if os.path.isdir(input_path):
+        input_files = directory_files(input_path)
+        output_file = os.path.join(input_path, os.path.basename(os.path.abspath(input_path)) + EMIT_EXTENSIONS[args.emit])
+    else:
+        input_files = [input_path]
+        output_file = input_path.removesuffix(".vm") + EMIT_EXTENSIONS[args.emit]
+
+    modules = []
+    for input_file in input_files:
+        with open(input_file, "r") as file:
+            modules.append((module_name(input_file), file.read()))
+
+    with TranslationClient(args.socket, args.host, args.port) as client:
+        output = client.translate(
+            modules,
+            emit=args.emit,
+            optimize=args.optimize,
+            shared_comparisons=args.shared_comparisons,
+            remove_unused_functions=not args.keep_unused_functions,
+            backend=args.backend,
+        )
+
+    if args.output == "-":
+        sys.stdout.write(output)
+    else:
+        write_atomically(args.output or output_file, output)
+
+# Subcommands are dispatched on the first argument, so `hack-vm-translate <file>` keeps working
+SUBCOMMANDS = {
+    "run": run_main,
+    "bench": bench_main,
+    "serve": serve_main,
+    "client": client_main,
+    "fuzz": fuzz_main,
+}
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    arg_parser = argparse.ArgumentParser(prog="hack-vm-translate")
+    arg_parser.add_argument("input", help="A .vm file, or a directory of .vm files to translate into a single program")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes used to translate a directory (default: number of CPUs)")
+    arg_parser.add_argument("-O", "--optimize", action="store_true", help="Optimize the VM commands before translation and run the peephole optimizer over the generated assembly")
+    arg_parser.add_argument("--shared-comparisons", action="store_true", help="Translate eq, gt and lt into calls to shared routines to save ROM space")
+    arg_parser.add_argument("--backend", choices=list(BACKENDS), default="stack", help="Code generation backend: stack keeps every value on the stack in RAM, register keeps the top of the stack in the D register (default: stack)")
+    arg_parser.add_argument("--cache-dir", default=None, help="Directory of the translation cache (default: $HACK_VM_TRANSLATE_CACHE_DIR or ~/.cache/hack-vm-translator)")
+    arg_parser.add_argument("--no-cache", action="store_true", help="Always translate every file instead of reusing cached translations")
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_CACHE_SIZE // (1024 * 1024), help="Maximum size of the translation cache in MiB, after which the least recently used entries are evicted")
+    arg_parser.add_argument("--keep-unused-functions", action="store_true", help="Translate every function, even those that cannot be reached from Sys.init")
+    arg_parser.add_argument("--size-report", action="store_true", help="Print the number of ROM words taken by every function")
+    arg_parser.add_argument("--stack-report", action="store_true", help="Print the stack every function needs, how much the program needs, and any stack underflows or out of range segment accesses")
+    arg_parser.add_argument("--emit", choices=list(EMIT_EXTENSIONS), default="asm", help="Output format: asm for assembly, hack for the textual machine code read by the CPU emulator, or bin for packed 16-bit big-endian words (default: asm)")
+    arg_parser.add_argument("-o", "--output", default=None, help="File to write the program to, or - for stdout (default: the input name with the extension of the --emit format)")
+    arg_parser.add_argument("--profile", action="store_true", help="Print the count, parse and code generation time and instructions generated for every kind of command")
+    arg_parser.add_argument("--profile-json", metavar="FILE", default=None, help="Write the profile as JSON to this file. Implies --profile")
+    arg_parser.add_argument("--source-map", metavar="FILE", default=None, help="Write a JSON map from every generated instruction to the .vm line it came from. Implies --profile")
+    args = arg_parser.parse_args()
+
+    if args.jobs is not None and args.jobs < 1:
+        arg_parser.error("--jobs must be at least 1")
+
+    args.profile = args.profile or args.profile_json is not None or args.source_map is not None
+
+    if args.profile and args.optimize:
+        arg_parser.error("--profile cannot be combined with --optimize")
+
+    if args.output == "-":
+        # Progress messages and reports go to stderr so stdout only holds the program
+        stdout = sys.stdout
+        with redirect_stdout(sys.stderr):
+            translate_main(args, stdout)
+    else:
+        translate_main(args, args.output)
+
+def translate_main(args: argparse.Namespace, output: Union[str, TextIO, None]):
+    """
+    Translates the program given on the command line.
+
+    Args:
+        args (argparse.Namespace): The parsed command line arguments.
+        output (str | TextIO | None): Where to write the program, see `write_output`. If None, it is written next
+            to the input.
+    """
+    if args.stack_report:
+        input_files = directory_files(args.input) if os.path.isdir(args.input) else [args.input]
+        report_stack_usage(input_files, not args.keep_unused_functions)
+
+    if args.profile:
+        profile_main(args, output)
+        return
+
+    cache = None if args.no_cache else TranslationCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+    input_path = args.input
+
+    if os.path.isdir(input_path):
+        input_dir = os.path.normpath(input_path)
+        output_base = os.path.join(input_dir, os.path.basename(os.path.abspath(input_dir)))
+        output = output or output_base + EMIT_EXTENSIONS[args.emit]
+        print(f"Processing directory: {input_dir}")
+        input_files = directory_files(input_dir)
+    else:
+        print(f"Processing file: {input_path}")
+        output = output or input_path.removesuffix(".vm") + EMIT_EXTENSIONS[args.emit]
+        input_files = [input_path]
+
+    options = {
+        "optimize": args.optimize,
+        "shared_comparisons": args.shared_comparisons,
+        "cache": cache,
+        "remove_unused_functions": not args.keep_unused_functions,
+        "backend": args.backend,
+    }
+
+    if args.size_report or args.emit != "asm":
+        # The size report and assembler read the generated assembly, so the program is translated in memory first
+        assembly = translate_files(input_files, jobs=args.jobs, **options)
+
+        write_output(output, assembly, args.emit)
+
+        if args.shared_comparisons:
+            report_comparison_rom_words_saved(count_comparison_calls(assembly))
+        if args.size_report:
+            report_function_sizes(assembly)
+        return
+
+    if len(input_files) > 1 or args.optimize or cache is not None:
+        # The optimizer needs to see the whole instruction stream of a file and the cache stores whole files,
+        # so files are translated one at a time and copied to the output, which is only moved into place
+        # once the whole program has been written
+        with AtomicFile(output) if isinstance(output, str) else nullcontext(output) as sink:
+            comparison_calls = write_files(sink, input_files, jobs=args.jobs, **options)
+            sink.flush()
+
+        if args.shared_comparisons:
+            report_comparison_rom_words_saved(comparison_calls)
+        return
+
+    # The commands are held in a compact `CommandArray` so unused functions are left out and the writer is set up
+    # exactly as for the other paths, while the generated assembly is still streamed to the output
+    commands = Parser(input_path).parse_all()
+
+    if not args.keep_unused_functions:
+        kept_functions = kept_functions_by_module([build_call_graph(commands)])[0]
+        if kept_functions is not None:
+            commands = CommandArray(remove_functions(commands, kept_functions))
+
+    name = module_name(input_path)
+
+    # Output files are only moved into place once the whole program has been written
+    with AtomicFile(output) if isinstance(output, str) else nullcontext(output) as sink:
+        # The code before the module is the same as `link` puts there, so the output matches the other paths
+        sink.write(prologue([name], args.shared_comparisons))
+
+        writer = create_writer(commands, sink, args.shared_comparisons, args.backend)
+        writer.set_filename(name)
+
+        for command in commands:
+            writer.write_command(command)
+
+        writer.finish()
+
+        if writer.uses_call_routines:
+            writer.write_call_routines()
+
+        writer.flush()
+
+    if args.shared_comparisons:
+        report_comparison_rom_words_saved(writer.comparison_call_count)
+
+def profile_main(args: argparse.Namespace, output: Union[str, TextIO, None]):
+    """
+    Translates the program given on the command line with `--profile`, one command at a time without the cache,
+    and reports where the translation time and generated instructions go.
+    """
+    input_path = args.input
+
+    if os.path.isdir(input_path):
+        input_dir = os.path.normpath(input_path)
+        input_files = directory_files(input_dir)
+        output = output or os.path.join(input_dir, os.path.basename(os.path.abspath(input_dir))) + EMIT_EXTENSIONS[args.emit]
+        print(f"Profiling directory: {input_dir}")
+    else:
+        input_files = [input_path]
+        output = output or input_path.removesuffix(".vm") + EMIT_EXTENSIONS[args.emit]
+        print(f"Profiling file: {input_path}")
+
+    assembly, profile = profile_files(
+        input_files,
+        shared_comparisons=args.shared_comparisons,
+        remove_unused_functions=not args.keep_unused_functions,
+        backend=args.backend,
+    )
+
+    write_output(output, assembly, args.emit)
 
-    parser = Parser(input_file)
-    writer = CodeWriter(input_file.removesuffix(".vm") + ".asm")
-    
-    while parser.has_more_commands():
-        writer.write_command(parser.current_command)
-        parser.advance()
+    print(profile.format_table(), end="")
 
-    writer.close()
+    if args.profile_json is not None:
+        write_atomically(args.profile_json, json.dumps(profile.to_json(), indent=2) + "\n")
+    if args.source_map is not None:
+        write_atomically(args.source_map, json.dumps(profile.source_map()) + "\n")
+    if args.shared_comparisons:
+        report_comparison_rom_words_saved(count_comparison_calls(assembly))
+    if args.size_report:
+        report_function_sizes(assembly)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+from typing import Iterable, Iterator, List
+from .parser import Command, CommandType, ArithmeticCommand
+
+# Number of trailing pushes kept back while looking for something to fold them into.
+# Anything older is passed through, which keeps memory bounded for long runs of pushes.
+MAX_PENDING_PUSHES = 64
+
+WORD_MASK = 0xFFFF
+
+def to_signed(value: int) -> int:
+    """
+    Helper function that wraps a value to a signed 16-bit integer, the way the Hack ALU does.
+    """
+    return ((value + 0x8000) & WORD_MASK) - 0x8000
+
+UNARY_OPERATIONS = {
+    ArithmeticCommand.NEG: lambda x: to_signed(-x),
+    ArithmeticCommand.NOT: lambda x: to_signed(~x),
+}
+
+# Comparisons push -1 for true and 0 for false. The generated code compares by subtracting and testing the sign
+# of the 16-bit result, so `gt` and `lt` are folded the same way, including when the subtraction overflows.
+BINARY_OPERATIONS = {
+    ArithmeticCommand.ADD: lambda x, y: to_signed(x + y),
+    ArithmeticCommand.SUB: lambda x, y: to_signed(x - y),
+    ArithmeticCommand.EQ: lambda x, y: -1 if x == y else 0,
+    ArithmeticCommand.GT: lambda x, y: -1 if to_signed(x - y) > 0 else 0,
+    ArithmeticCommand.LT: lambda x, y: -1 if to_signed(x - y) < 0 else 0,
+    ArithmeticCommand.AND: lambda x, y: to_signed(x & y),
+    ArithmeticCommand.OR: lambda x, y: to_signed(x | y),
+}
+
+def is_constant_push(command: Command) -> bool:
+    return command.type == CommandType.C_PUSH and command.arg1 == "constant"
+
+def push_constant(value: int) -> Command:
+    return Command.from_parts(CommandType.C_PUSH, "constant", value)
+
+def optimize(commands: Iterable[Command]) -> Iterator[Command]:
+    """
+    Optimizes a stream of VM commands before they are handed to `CodeWriter`.
+
+    The following rewrites are done:
+        - Arithmetic on constants is computed at translation time, e.g. `push constant 69 / push constant 420 / lt`
+          becomes `push constant -1`. This also covers `push constant 0 / not`.
+        - A push immediately followed by a pop becomes a single `C_MOVE` command, which copies the value
+          between segments without touching the stack pointer.
+
+    Commands are consumed lazily, so this can be chained directly onto `Parser.iter_commands`.
+
+    Args:
+        commands (Iterable[Command]): The commands to optimize, in program order.
+    """
+    # Trailing pushes that have not been emitted yet because they may still be folded
+    pending: List[Command] = []
+
+    for command in commands:
+        if command.type == CommandType.C_PUSH:
+            pending.append(command)
+
+            if len(pending) > MAX_PENDING_PUSHES:
+                yield pending.pop(0)
+
+        elif command.type == CommandType.C_POP and pending:
+            source = pending.pop()
+            yield from pending
+            pending.clear()
+            yield Command.from_parts(CommandType.C_MOVE, command.arg1, command.arg2, source=source)
+
+        elif command.type == CommandType.C_ARITHMETIC and fold_arithmetic(pending, command):
+            continue
+
+        else:
+            yield from pending
+            pending.clear()
+            yield command
+
+    yield from pending
+
+def fold_arithmetic(pending: List[Command], command: Command) -> bool:
+    """
+    Helper function that folds an arithmetic command into the constant pushes at the end of `pending`.
+    Returns False, leaving `pending` untouched, if the operands are not all constants.
+    """
+    if command.arg1 in UNARY_OPERATIONS:
+        if not pending or not is_constant_push(pending[-1]):
+            return False
+
+        value = UNARY_OPERATIONS[command.arg1](pending[-1].arg2)
+        pending[-1] = push_constant(value)
+        return True
+
+    if len(pending) < 2 or not is_constant_push(pending[-1]) or not is_constant_push(pending[-2]):
+        return False
+
+    y = pending.pop().arg2
+    x = pending.pop().arg2
+    pending.append(push_constant(BINARY_OPERATIONS[command.arg1](x, y)))
+    return True
@@ -1,4 +1,7 @@
+import sys
+from array import array
 from enum import Enum
+from typing import Iterable, Iterator, TextIO, Union
 
 class CommandType(Enum):
     C_ARITHMETIC = 0
@@ -10,6 +13,9 @@ class CommandType(Enum):
     C_FUNCTION = 6
     C_RETURN = 7
     C_CALL = 8
+    # Not part of the VM language. Produced by the optimizer when a push is immediately followed by a pop,
+    # so the value can be copied between segments without going through the stack.
+    C_MOVE = 9
 
 class ArithmeticCommand(Enum):
     ADD = "add"
@@ -26,89 +32,255 @@ class MemoryAccessCommand(Enum):
     PUSH = "push"
     POP = "pop"
 
+class ProgramFlowCommand(Enum):
+    LABEL = "label"
+    GOTO = "goto"
+    IF_GOTO = "if-goto"
+
+class FunctionCommand(Enum):
+    FUNCTION = "function"
+    CALL = "call"
+    RETURN = "return"
+
+# Maps the first word of a command to its type, and to its operation for arithmetic commands
+OPCODES = {
+    **{operation.value: (CommandType.C_ARITHMETIC, operation) for operation in ArithmeticCommand},
+    MemoryAccessCommand.PUSH.value: (CommandType.C_PUSH, None),
+    MemoryAccessCommand.POP.value: (CommandType.C_POP, None),
+    ProgramFlowCommand.LABEL.value: (CommandType.C_LABEL, None),
+    ProgramFlowCommand.GOTO.value: (CommandType.C_GOTO, None),
+    ProgramFlowCommand.IF_GOTO.value: (CommandType.C_IF, None),
+    FunctionCommand.FUNCTION.value: (CommandType.C_FUNCTION, None),
+    FunctionCommand.CALL.value: (CommandType.C_CALL, None),
+    FunctionCommand.RETURN.value: (CommandType.C_RETURN, None),
+}
+
+# Commands whose second argument is an integer: the index of a push or pop, the number of locals
+# of a function, or the number of arguments of a call
+COMMANDS_WITH_INDEX = (CommandType.C_PUSH, CommandType.C_POP, CommandType.C_FUNCTION, CommandType.C_CALL)
+
+# Commands whose only argument is a label
+COMMANDS_WITH_LABEL = (CommandType.C_LABEL, CommandType.C_GOTO, CommandType.C_IF)
+
 class Command:
+    # Commands are created for every line of a program, so they use slots rather than an instance dictionary.
+    # Commands are never modified once created, which lets the parser share one instance between identical lines.
+    __slots__ = ("type", "arg1", "arg2", "source")
+
     def __init__(self, unparsed_command: str):
         self.arg1 = None
         self.arg2 = None
+        # Only set for C_MOVE commands, where it holds the push command the value is copied from
+        self.source = None
+
+        lexemes = unparsed_command.split()
 
-        lexemes = unparsed_command.split(" ")
+        opcode = OPCODES.get(lexemes[0])
+        if opcode is None:
+            raise ValueError(f"Invalid command: {lexemes[0]}")
 
-        if is_arithmetic_command(lexemes[0]):
-            self.type = CommandType.C_ARITHMETIC
-            self.arg1 = ArithmeticCommand(lexemes[0])
+        self.type, operation = opcode
+
+        if self.type == CommandType.C_ARITHMETIC:
+            self.arg1 = operation
 
             if len(lexemes) > 1:
                 raise ValueError(f"Invalid command: {unparsed_command}: Arithmetic commands should not have a second argument")
-            
-        elif is_memory_access_command(lexemes[0]):
-            operation = MemoryAccessCommand(lexemes[0])
-            if operation == MemoryAccessCommand.PUSH:
-                self.type = CommandType.C_PUSH
-            elif operation == MemoryAccessCommand.POP:
-                self.type = CommandType.C_POP
+
+        elif self.type == CommandType.C_RETURN:
+            if len(lexemes) > 1:
+                raise ValueError(f"Invalid command: {unparsed_command}: Return commands should not have any arguments")
+
+        elif self.type in COMMANDS_WITH_LABEL:
+            if len(lexemes) != 2:
+                raise ValueError(f"Invalid command: {unparsed_command}: {lexemes[0]} commands should have exactly one argument")
 
             self.arg1 = lexemes[1]
-            self.arg2 = lexemes[2]
 
-            if len(lexemes) > 3:
-                raise ValueError(f"Invalid command: {unparsed_command}: Memory access commands should only have two arguments")
         else:
-            raise ValueError(f"Invalid command: {lexemes[0]}")        
-        
+            if len(lexemes) != 3:
+                raise ValueError(f"Invalid command: {unparsed_command}: {lexemes[0]} commands should have exactly two arguments")
+
+            # Segment and function names are interned so every command refers to the same string object
+            self.arg1 = sys.intern(lexemes[1])
+
+            try:
+                self.arg2 = int(lexemes[2])
+            except ValueError:
+                raise ValueError(f"Invalid command: {unparsed_command}: The second argument must be an integer")
+
+    @classmethod
+    def from_parts(cls, type: CommandType, arg1=None, arg2=None, source: "Command" = None) -> "Command":
+        """
+        Creates a command directly from its parts rather than by parsing a line of VM code.
+        This is used by passes that rewrite the command stream.
+        """
+        command = cls.__new__(cls)
+        command.type = type
+        command.arg1 = arg1
+        command.arg2 = arg2
+        command.source = source
+        return command
+
     def __str__(self):
         return f"Command(type={self.type}, arg1={self.arg1}, arg2={self.arg2 if self.arg2 is not None else 'None'})"
 
-class Parser:
-    def __init__(self, file_path: str):
-        if not file_path.endswith(".vm"):
-            raise ValueError(f"Invalid file extension: {file_path}")
+class CommandArray:
+    """
+    A compact, array-backed list of commands, used to hold whole programs in memory for passes over the entire program.
+
+    Each distinct `(type, arg1)` pair is stored once in a table, and every command only takes up an index into
+    that table plus its integer `arg2`, both kept in `array` buffers rather than as separate objects.
+    Indexing or iterating creates `Command` objects on demand.
+    """
+    def __init__(self, commands: Iterable[Command] = ()):
+        self.opcodes = array("I")
+        self.args = array("i")
+        self.opcode_table = []
+        self.opcode_ids = {}
+
+        for command in commands:
+            self.append(command)
+
+    def append(self, command: Command):
+        if command.source is not None:
+            raise ValueError(f"Cannot store {command} in a CommandArray: Only parsed commands are supported")
+
+        key = (command.type, command.arg1)
+        opcode = self.opcode_ids.get(key)
+
+        if opcode is None:
+            opcode = len(self.opcode_table)
+            self.opcode_table.append(key)
+            self.opcode_ids[key] = opcode
+
+        self.opcodes.append(opcode)
+        self.args.append(command.arg2 if command.arg2 is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self.opcodes)
+
+    def __getitem__(self, index: int) -> Command:
+        type, arg1 = self.opcode_table[self.opcodes[index]]
+        arg2 = self.args[index] if type in COMMANDS_WITH_INDEX else None
+        return Command.from_parts(type, arg1, arg2)
+
+    def __iter__(self) -> Iterator[Command]:
+        # Commands are never modified, so like the parser, every distinct command is only created once
+        commands = {}
+
+        for opcode, arg in zip(self.opcodes, self.args):
+            command = commands.get((opcode, arg))
+
+            if command is None:
+                type, arg1 = self.opcode_table[opcode]
+                command = commands[(opcode, arg)] = Command.from_parts(type, arg1, arg if type in COMMANDS_WITH_INDEX else None)
 
-        self.file_path = file_path
+            yield command
+
+# Number of characters requested from the file per read. Lines are pulled in
+# batches of roughly this size so large files are never held in memory at once.
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Maximum number of distinct lines whose parsed command is remembered and reused.
+# Programs repeat the same few commands over and over, so this saves most of the parsing work.
+COMMAND_CACHE_SIZE = 4096
+
+class Parser:
+    def __init__(self, source: Union[str, TextIO, Iterable[str]], buffer_size: int = DEFAULT_BUFFER_SIZE):
+        """
+        Args:
+            source (str | TextIO | Iterable[str]): Either the path of the .vm file to parse, or VM code held in memory,
+                as an open text stream or an iterable of lines. Streams and iterables are read lazily and are not closed.
+            buffer_size (int): Number of characters read from the file or stream at a time.
+        """
+        self.buffer_size = buffer_size
         self.current_command = None
 
-        try:
-            self.file = open(file_path, "r")
-        except FileNotFoundError:
-            raise FileNotFoundError(f"File not found: {file_path}")
-        
+        if isinstance(source, str):
+            if not source.endswith(".vm"):
+                raise ValueError(f"Invalid file extension: {source}")
+
+            self.file_path = source
+
+            try:
+                self.file = open(source, "r", buffering=buffer_size)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"File not found: {source}")
+
+            batches = iter(lambda: self.file.readlines(buffer_size), [])
+        else:
+            self.file_path = None
+            self.file = None
+
+            if hasattr(source, "readlines"):
+                batches = iter(lambda: source.readlines(buffer_size), [])
+            else:
+                batches = (source,)
+
+        self.commands = self._read_commands(batches)
         self.advance()
-        
-    def advance(self):
-        line = self.file.readline()
 
-        if line == "\n":
-            self.advance()
-            return
-        
-        line = line.strip()
-        
-        if line.startswith("//"):
+    def iter_commands(self):
+        """
+        Generator that yields every remaining command in the file, starting with the current one.
+        This is equivalent to the `has_more_commands`/`advance` loop, but can be used directly in a `for` loop.
+        """
+        while self.has_more_commands():
+            yield self.current_command
             self.advance()
-            return
-        
-        if line == "":
-            self.current_command = None
-            return
-                
-        # Handle inline comments
-        line = line.split("//")[0].strip()
-        
-        self.current_command = Command(line)
-        
-    
+
+    def _read_commands(self, batches: Iterable[Iterable[str]]):
+        """
+        Generator that reads the source and yields every command in order.
+
+        Lines are read in batches of roughly `buffer_size` characters, and blank lines and
+        comments are skipped in a loop, so the stack depth and memory use stay constant
+        no matter how large the file is. The file is closed once the generator is exhausted.
+        """
+        cache = {}
+
+        try:
+            for lines in batches:
+                for line in lines:
+                    command = cache.get(line)
+
+                    if command is None:
+                        # Handle full line and inline comments
+                        stripped_line = line.split("//", 1)[0].strip()
+
+                        if stripped_line == "":
+                            continue
+
+                        command = Command(stripped_line)
+
+                        if len(cache) < COMMAND_CACHE_SIZE:
+                            cache[line] = command
+
+                    yield command
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+    def advance(self):
+        self.current_command = next(self.commands, None)
+
+    def parse_all(self) -> CommandArray:
+        """
+        Parses every remaining command and returns them as a `CommandArray`.
+        """
+        return CommandArray(self.iter_commands())
+
     def has_more_commands(self):
         return self.current_command is not None
 
+    def close(self):
+        self.commands.close()
+
 def is_arithmetic_command(command: str) -> bool:
-    try:
-        ArithmeticCommand(command)
-    except ValueError:
-        return False
-    return True
+    opcode = OPCODES.get(command)
+    return opcode is not None and opcode[0] == CommandType.C_ARITHMETIC
 
 def is_memory_access_command(command: str) -> bool:
-    try:
-        MemoryAccessCommand(command)
-    except ValueError:
-        return False
-    return True
+    opcode = OPCODES.get(command)
+    return opcode is not None and opcode[0] in (CommandType.C_PUSH, CommandType.C_POP)
@@ -0,0 +1,183 @@
+from typing import Dict, List, Optional, Tuple
+from .code_writer import STACK_POINTER
+
+# Matches any A-instruction, e.g. `@R15` or `@Foo.3`
+ANY_ADDRESS = object()
+
+# Each rule is (pattern, replacement, requires_address_next).
+# The pattern is matched against consecutive instructions, ignoring comments. Labels never match, so a rule
+# can never span a jump target. A replacement entry is either a new instruction, or the index of a matched
+# instruction to keep as is. When `requires_address_next` is set, the rule only fires if the instruction following
+# the match is an A-instruction, meaning the value left in the A register by the pattern is never read.
+#
+# Rules are tried in order, so longer rules come first.
+PEEPHOLE_RULES: List[Tuple[tuple, tuple, bool]] = [
+    # A push immediately followed by a pop into D. D already holds the pushed value, and the slot it was written
+    # to is above the stack once the pop is done, so the whole round trip through memory can be dropped.
+    (
+        (f"@{STACK_POINTER}", "A=M", "M=D", f"@{STACK_POINTER}", "M=M+1", f"@{STACK_POINTER}", "AM=M-1", "D=M", "M=0"),
+        (),
+        True,
+    ),
+    (
+        (f"@{STACK_POINTER}", "A=M", "M=D", f"@{STACK_POINTER}", "M=M+1", f"@{STACK_POINTER}", "AM=M-1", "D=M"),
+        (),
+        True,
+    ),
+    # Incrementing the stack pointer and then pointing to the top of the stack leaves SP where it was
+    (
+        (f"@{STACK_POINTER}", "M=M+1", f"@{STACK_POINTER}", "AM=M-1"),
+        (f"@{STACK_POINTER}", "A=M"),
+        False,
+    ),
+    # Incrementing and then decrementing the stack pointer is a no-op
+    (
+        (f"@{STACK_POINTER}", "M=M+1", f"@{STACK_POINTER}", "M=M-1"),
+        (f"@{STACK_POINTER}",),
+        False,
+    ),
+    # Values above the stack pointer are never read, so there is no need to clear them after a pop
+    (
+        (f"@{STACK_POINTER}", "AM=M-1", "D=M", "M=0"),
+        (0, 1, 2),
+        False,
+    ),
+    (
+        (f"@{STACK_POINTER}", "A=M", "D=M", "M=0"),
+        (0, 1, 2),
+        False,
+    ),
+    # Storing to a register does not change A, so there is no need to reload the stack pointer
+    (
+        (f"@{STACK_POINTER}", "A=M", "M=D", f"@{STACK_POINTER}", "A=M"),
+        (0, 1, 2),
+        False,
+    ),
+    # Loading an address that is immediately replaced by another has no effect
+    (
+        (ANY_ADDRESS, ANY_ADDRESS),
+        (1,),
+        False,
+    ),
+]
+
+# The longest pattern, used to decide how far to step back after a rewrite
+WINDOW_SIZE = max(len(pattern) for pattern, _, _ in PEEPHOLE_RULES) + 1
+
+# A line of assembly together with its stripped text, which is what the rules are matched against
+Line = Tuple[str, str]
+
+def is_comment(line: str) -> bool:
+    return line == "" or line.startswith("//")
+
+def is_address(line: str) -> bool:
+    return line.startswith("@")
+
+def rules_starting_with(instruction: str) -> List[Tuple[tuple, tuple, bool]]:
+    """
+    Helper function that returns the rules, in order, whose pattern can start with `instruction`.
+    """
+    return [
+        rule for rule in PEEPHOLE_RULES
+        if rule[0][0] == instruction or (rule[0][0] is ANY_ADDRESS and is_address(instruction))
+    ]
+
+def step_back(optimized: List[Line], pending: List[Line], count: int):
+    """
+    Helper function that moves the last `count` instructions of `optimized`, along with the comments between them,
+    back onto `pending` so that they are looked at again.
+    """
+    while optimized and count > 0:
+        line = optimized.pop()
+        pending.append(line)
+        if not is_comment(line[0]):
+            count -= 1
+
+def match_rule(pending: List[Line], pattern: tuple, requires_address_next: bool) -> Optional[List[int]]:
+    """
+    Helper function that checks if a rule matches the upcoming instructions, skipping comments. `pending` holds the
+    lines still to be optimized in reverse order. Returns the (decreasing) indices in `pending` of the matched lines,
+    or None if the rule does not match.
+    """
+    indices = []
+    index = len(pending) - 1
+
+    for expected in pattern:
+        while index >= 0 and is_comment(pending[index][0]):
+            index -= 1
+        if index < 0:
+            return None
+
+        instruction = pending[index][0]
+        if expected is ANY_ADDRESS:
+            if not is_address(instruction):
+                return None
+        elif instruction != expected:
+            return None
+
+        indices.append(index)
+        index -= 1
+
+    if requires_address_next:
+        while index >= 0 and is_comment(pending[index][0]):
+            index -= 1
+        if index < 0 or not is_address(pending[index][0]):
+            return None
+
+    return indices
+
+def optimize(assembly: str) -> str:
+    """
+    Runs a peephole optimization pass over Hack assembly and returns the optimized assembly.
+
+    A window slides over the instruction stream and every rule in `PEEPHOLE_RULES` is tried at each position.
+    When a rule fires, its instructions are replaced and the window steps back so that the rewritten code
+    can take part in further matches. Comments are left in place and the indentation of the first matched
+    line is kept for any new instructions.
+
+    Lines move from a stack of pending lines to the optimized output, and stepping back moves at most
+    `WINDOW_SIZE` instructions the other way, so a rewrite only touches the lines around it and the pass
+    takes time linear in the size of the assembly.
+
+    Args:
+        assembly (str): The assembly to optimize, as generated by `CodeWriter`.
+    """
+    pending = [(line.strip(), line) for line in reversed(assembly.splitlines())]
+    optimized: List[Line] = []
+    # Most instructions cannot start any rule, so the rules are looked up by the instruction they start with
+    rules_by_instruction: Dict[str, List[Tuple[tuple, tuple, bool]]] = {}
+
+    while pending:
+        instruction = pending[-1][0]
+        if is_comment(instruction):
+            optimized.append(pending.pop())
+            continue
+
+        rules = rules_by_instruction.get(instruction)
+        if rules is None:
+            rules = rules_by_instruction[instruction] = rules_starting_with(instruction)
+
+        for pattern, replacement, requires_address_next in rules:
+            matched = match_rule(pending, pattern, requires_address_next)
+            if matched is None:
+                continue
+
+            first_line = pending[matched[0]][1]
+            indentation = first_line[:len(first_line) - len(first_line.lstrip())]
+
+            new_lines = [
+                pending[matched[entry]] if isinstance(entry, int) else (entry, f"{indentation}{entry}")
+                for entry in replacement
+            ]
+
+            # Comments inside the matched range are moved after the replacement
+            comments = [pending[index] for index in range(matched[0], matched[-1] - 1, -1) if index not in matched]
+            del pending[matched[-1]:]
+            pending.extend(reversed(new_lines + comments))
+
+            step_back(optimized, pending, WINDOW_SIZE)
+            break
+        else:
+            optimized.append(pending.pop())
+
+    return "".join(f"{line}\n" for _, line in optimized)
@@ -0,0 +1,273 @@
+import io
+import os
+import time
+from operator import itemgetter
+from typing import Dict, Iterable, Iterator, List, Tuple
+from .analysis import build_call_graph, kept_functions_by_module, remove_functions
+from .code_writer import is_instruction
+from .parser import Command, CommandArray, CommandType, Parser
+from .translator import create_writer, link, prologue
+
+# Method of `CodeWriter` that writes each type of command, shown next to the commands in the profile
+WRITE_METHODS = {
+    CommandType.C_ARITHMETIC: "write_arithmetic",
+    CommandType.C_PUSH: "write_push_pop",
+    CommandType.C_POP: "write_push_pop",
+    CommandType.C_LABEL: "write_label",
+    CommandType.C_GOTO: "write_goto",
+    CommandType.C_IF: "write_if",
+    CommandType.C_FUNCTION: "write_function",
+    CommandType.C_CALL: "write_call",
+    CommandType.C_RETURN: "write_return",
+}
+
+def profile_key(command: Command) -> Tuple[CommandType, str]:
+    """
+    Helper function that returns the key commands are grouped by in a profile: their type, along with the
+    operation of arithmetic commands or the segment of push and pop commands.
+    """
+    if command.type == CommandType.C_ARITHMETIC:
+        return command.type, command.arg1.value
+
+    if command.type in (CommandType.C_PUSH, CommandType.C_POP):
+        return command.type, command.arg1
+
+    return command.type, ""
+
+class CommandProfile:
+    """
+    Totals for every command of the same kind, see `profile_key`.
+    """
+    __slots__ = ("count", "parse_seconds", "write_seconds", "instructions")
+
+    def __init__(self):
+        self.count = 0
+        self.parse_seconds = 0.0
+        self.write_seconds = 0.0
+        self.instructions = 0
+
+class TranslationProfile:
+    """
+    The cost of every kind of command in a translation: how many there are, the time spent parsing them and
+    writing their assembly, and the number of instructions they were translated into.
+
+    It also records which line of which .vm file every instruction of the program was generated from,
+    see `source_map`.
+    """
+    def __init__(self):
+        self.commands: Dict[Tuple[CommandType, str], CommandProfile] = {}
+
+        # Paths of the .vm files, which the mappings refer to by index
+        self.sources: List[str] = []
+
+        # (ROM address, .asm line, source index, .vm line) of every instruction generated from a command
+        self.mappings: List[Tuple[int, int, int, int]] = []
+
+    def record(self, command: Command, parse_seconds: float, write_seconds: float, instructions: int):
+        key = profile_key(command)
+        profile = self.commands.get(key)
+
+        if profile is None:
+            profile = self.commands[key] = CommandProfile()
+
+        profile.count += 1
+        profile.parse_seconds += parse_seconds
+        profile.write_seconds += write_seconds
+        profile.instructions += instructions
+
+    def rows(self) -> List[dict]:
+        """
+        Returns one row per kind of command, most expensive to write first.
+        """
+        rows = [
+            {
+                "type": command_type.name,
+                "detail": detail,
+                "method": WRITE_METHODS[command_type],
+                "count": profile.count,
+                "parse_seconds": profile.parse_seconds,
+                "write_seconds": profile.write_seconds,
+                "instructions": profile.instructions,
+            }
+            for (command_type, detail), profile in self.commands.items()
+        ]
+
+        return sorted(rows, key=lambda row: row["write_seconds"], reverse=True)
+
+    def to_json(self) -> dict:
+        rows = self.rows()
+
+        return {
+            "commands": rows,
+            "total": {
+                "count": sum(row["count"] for row in rows),
+                "parse_seconds": sum(row["parse_seconds"] for row in rows),
+                "write_seconds": sum(row["write_seconds"] for row in rows),
+                "instructions": sum(row["instructions"] for row in rows),
+            },
+        }
+
+    def format_table(self) -> str:
+        """
+        Returns the profile as a table, with times in milliseconds.
+        """
+        rows = self.rows()
+        header = ("Command", "Method", "Count", "Parse ms", "Write ms", "Instructions", "Per command")
+        lines = []
+
+        table = [
+            (
+                f"{row['type']} {row['detail']}".strip(),
+                row["method"],
+                f"{row['count']}",
+                f"{row['parse_seconds'] * 1000:.2f}",
+                f"{row['write_seconds'] * 1000:.2f}",
+                f"{row['instructions']}",
+                f"{row['instructions'] / row['count']:.1f}",
+            )
+            for row in rows
+        ]
+
+        total = self.to_json()["total"]
+        table.append((
+            "Total",
+            "",
+            f"{total['count']}",
+            f"{total['parse_seconds'] * 1000:.2f}",
+            f"{total['write_seconds'] * 1000:.2f}",
+            f"{total['instructions']}",
+            f"{total['instructions'] / max(total['count'], 1):.1f}",
+        ))
+
+        widths = [max(len(cells[column]) for cells in [header, *table]) for column in range(len(header))]
+
+        for cells in [header, *table]:
+            # The first two columns hold names and are aligned left, the others hold numbers
+            lines.append("  ".join(
+                cell.ljust(width) if column < 2 else cell.rjust(width)
+                for column, (cell, width) in enumerate(zip(cells, widths))
+            ).rstrip())
+
+        return "\n".join(lines) + "\n"
+
+    def source_map(self) -> dict:
+        """
+        Returns the mapping from every instruction of the program to the .vm line it was generated from.
+        Instructions are identified both by their ROM address, as reported by the emulator, and by their line
+        in the .asm file. Lines are numbered from 1, and instructions of the bootstrap code and shared routines
+        are left out.
+        """
+        return {
+            "sources": self.sources,
+            "columns": ["rom_address", "asm_line", "source", "line"],
+            "mappings": [list(mapping) for mapping in self.mappings],
+        }
+
+class LineCounter:
+    """
+    Wraps the lines of a .vm file and remembers the number of the last one read. The parser stops reading as soon
+    as it finds a command, so after `Parser.advance` this is the line of the current command.
+    """
+    def __init__(self, lines: Iterable[str]):
+        self.lines = lines
+        self.line_number = 0
+
+    def __iter__(self) -> Iterator[str]:
+        for self.line_number, line in enumerate(self.lines, 1):
+            yield line
+
+def parse_file(input_file: str) -> List[Tuple[Command, int, float]]:
+    """
+    Parses a .vm file and returns every command along with its line number and the time it took to parse.
+    """
+    commands = []
+
+    with open(input_file, "r") as file:
+        lines = LineCounter(file)
+
+        start = time.perf_counter()
+        parser = Parser(lines)
+        parse_seconds = time.perf_counter() - start
+
+        while parser.has_more_commands():
+            commands.append((parser.current_command, lines.line_number, parse_seconds))
+
+            start = time.perf_counter()
+            parser.advance()
+            parse_seconds = time.perf_counter() - start
+
+    return commands
+
+def profile_files(
+    input_files: List[str],
+    shared_comparisons: bool = False,
+    remove_unused_functions: bool = True,
+    backend: str = "stack",
+) -> Tuple[str, TranslationProfile]:
+    """
+    Translates several .vm files of the same program one command at a time, timing every step, and returns
+    the merged assembly along with the profile. The assembly is the same as `main.translate_files` returns
+    without the optimizer, which is not supported since it rewrites the commands and instructions being measured.
+    """
+    profile = TranslationProfile()
+    module_names = [os.path.basename(input_file).removesuffix(".vm") for input_file in input_files]
+    parsed_files = [parse_file(input_file) for input_file in input_files]
+
+    if remove_unused_functions:
+        call_graphs = [build_call_graph(command for command, _, _ in parsed) for parsed in parsed_files]
+        kept_functions = kept_functions_by_module(call_graphs)
+        parsed_files = [
+            parsed if kept is None else list(remove_functions(parsed, kept, key=itemgetter(0)))
+            for parsed, kept in zip(parsed_files, kept_functions)
+        ]
+
+    # Instructions are numbered from the start of the program, after the code `link` puts before the modules
+    start_code = prologue(module_names, shared_comparisons)
+    asm_line = len(start_code.splitlines())
+    rom_address = sum(1 for line in start_code.splitlines() if is_instruction(line.strip()))
+
+    chunks = []
+
+    for source_index, (input_file, name, parsed) in enumerate(zip(input_files, module_names, parsed_files)):
+        profile.sources.append(input_file)
+
+        # The writer is set up from the same compact array of commands as in the other paths,
+        # so the functions it analyzes and the code it generates are the same
+        output = io.StringIO()
+        writer = create_writer(CommandArray(command for command, _, _ in parsed), output, shared_comparisons, backend)
+        writer.set_filename(name)
+
+        for command, line_number, parse_seconds in parsed:
+            position = output.tell()
+
+            start = time.perf_counter()
+            writer.write_command(command)
+            write_seconds = time.perf_counter() - start
+
+            output.seek(position)
+            instructions = 0
+
+            for line in output.read().splitlines():
+                asm_line += 1
+
+                if is_instruction(line.strip()):
+                    profile.mappings.append((rom_address, asm_line, source_index, line_number))
+                    rom_address += 1
+                    instructions += 1
+
+            profile.record(command, parse_seconds, write_seconds, instructions)
+
+        position = output.tell()
+        writer.finish()
+        output.seek(position)
+
+        # State still held in registers is written back at the end of the module, after the last command
+        for line in output.read().splitlines():
+            asm_line += 1
+
+            if is_instruction(line.strip()):
+                rom_address += 1
+
+        chunks.append(output.getvalue())
+
+    return link(chunks, module_names, shared_comparisons), profile
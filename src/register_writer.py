@@ -0,0 +1,274 @@
+from .code_writer import (
+    COMPARISON_JUMPS,
+    MAX_STEPPED_STORE_OFFSET,
+    MEMORY_SEGMENT_MAP,
+    STACK_POINTER,
+    TEMPLATES,
+    CodeWriter,
+)
+from .parser import ArithmeticCommand, Command, CommandType
+
+# Once the stack pointer in RAM is this far from the real one, the difference is written back
+# so the instructions that address the top of the stack stay short
+MAX_STACK_OFFSET = 2
+
+# Computation combining the second value on the stack, in M, with the top value, in D
+BINARY_COMPUTATIONS = {
+    ArithmeticCommand.ADD: "D=D+M",
+    ArithmeticCommand.SUB: "D=M-D",
+    ArithmeticCommand.AND: "D=D&M",
+    ArithmeticCommand.OR: "D=D|M",
+}
+
+# Computations of unary operations on the top value, depending on whether it is held in D or in memory
+UNARY_COMPUTATIONS = {
+    ArithmeticCommand.NEG: ("D=-D", "D=-M"),
+    ArithmeticCommand.NOT: ("D=!D", "D=!M"),
+}
+
+class RegisterCodeWriter(CodeWriter):
+    """
+    A code generation backend that keeps the value at the top of the stack in the D register between commands.
+
+    The stack-based `CodeWriter` stores every result in RAM and increments SP, only for the next command to
+    decrement SP and load it again. This writer instead leaves results in D and only stores them to the stack when
+    D is needed for something else. It also tracks how far SP in RAM is behind the real stack pointer and addresses
+    the stack relative to SP, so a run of pushes and pops only updates SP once.
+
+    Labels, jumps, calls and returns expect the stack to be in memory, so the value in D and the stack pointer are
+    written back before them. `finish` must be called after the last command for the same reason.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Whether the value at the top of the stack is held in D rather than in RAM
+        self.top_in_d = False
+
+        # Number of words the real stack pointer is above the value of SP in RAM
+        self.stack_offset = 0
+
+    def translate_command(self, command: Command):
+        if abs(self.stack_offset) > MAX_STACK_OFFSET:
+            self.output_file.writelines(self.commit_stack_offset())
+
+        if command.type == CommandType.C_PUSH:
+            self.write_cached_push(command)
+        elif command.type == CommandType.C_POP:
+            self.write_cached_pop(command)
+        elif command.type == CommandType.C_ARITHMETIC and not (self.shared_comparisons and command.arg1 in COMPARISON_JUMPS):
+            self.write_cached_arithmetic(command)
+        elif command.type == CommandType.C_IF and self.top_in_d:
+            self.write_cached_if(command.arg1)
+        elif command.type == CommandType.C_MOVE:
+            # Moves do not touch the stack, but do overwrite D
+            self.output_file.writelines(self.spill())
+            super().translate_command(command)
+        else:
+            self.finish()
+            super().translate_command(command)
+
+    def finish(self):
+        self.output_file.writelines([*self.spill(), *self.commit_stack_offset()])
+
+    def stack_slot(self, position: int):
+        """
+        Helper function that returns the instructions to point A at the stack slot `position` words above the real
+        stack pointer, e.g. -1 for the top of the stack. This does not change D.
+        """
+        offset = self.stack_offset + position
+
+        if offset == 0:
+            return [f"@{STACK_POINTER}\n", "A=M\n"]
+
+        first_step, step = ("A=M+1\n", "A=A+1\n") if offset > 0 else ("A=M-1\n", "A=A-1\n")
+
+        return [f"@{STACK_POINTER}\n", first_step, *[step] * (abs(offset) - 1)]
+
+    def spill(self):
+        """
+        Helper function that returns the instructions to store the value held in D at the top of the stack,
+        after which D is free to be overwritten.
+        """
+        if not self.top_in_d:
+            return []
+
+        self.top_in_d = False
+
+        return [*self.stack_slot(-1), "M=D\n"]
+
+    def commit_stack_offset(self):
+        """
+        Helper function that returns the instructions to update SP in RAM to the real stack pointer.
+        This only changes D if the top of the stack is not held in it.
+        """
+        offset = self.stack_offset
+        self.stack_offset = 0
+
+        if offset == 0:
+            return []
+
+        if self.top_in_d or abs(offset) <= 2:
+            return [f"@{STACK_POINTER}\n", *["M=M+1\n" if offset > 0 else "M=M-1\n"] * abs(offset)]
+
+        return [
+            f"@{abs(offset)}\n",
+            "D=A\n",
+            f"@{STACK_POINTER}\n",
+            "M=D+M\n" if offset > 0 else "M=M-D\n",
+        ]
+
+    def load_top(self):
+        """
+        Helper function that returns the instructions to load the value at the top of the stack into D,
+        leaving A pointing at its slot if it was in memory.
+        """
+        if self.top_in_d:
+            return []
+
+        return [*self.stack_slot(-1), "D=M\n"]
+
+    def write_cached_push(self, command: Command):
+        segment = command.arg1
+        index = command.arg2
+
+        self.validate_push_pop(command)
+
+        lines = [f"// push {segment} {index}\n", *self.spill()]
+
+        if segment == "constant":
+            lines += self.load_constant(index)
+        else:
+            lines += self.load_segment_value(segment, index)
+
+        self.stack_offset += 1
+        self.top_in_d = True
+
+        self.output_file.writelines(lines)
+
+    def write_cached_pop(self, command: Command):
+        segment = command.arg1
+        index = command.arg2
+
+        self.validate_push_pop(command)
+
+        lines = [f"// pop {segment} {index}\n"]
+        address = self.direct_address(segment, index)
+
+        if address is not None:
+            lines += [*self.load_top(), f"@{address}\n", "M=D\n"]
+        elif index <= MAX_STEPPED_STORE_OFFSET:
+            lines += [*self.load_top(), *self.point_to_segment_offset(segment, index), "M=D\n"]
+        elif self.top_in_d:
+            lines += [
+                # Keep the value in a temporary register while the address is calculated
+                "@R14\n",
+                "M=D\n",
+                f"@{MEMORY_SEGMENT_MAP[segment]}\n",
+                "D=M\n",
+                f"@{index}\n",
+                "D=D+A\n",
+                "@R15\n",
+                "M=D\n",
+                "@R14\n",
+                "D=M\n",
+                "@R15\n",
+                "A=M\n",
+                "M=D\n",
+            ]
+        else:
+            lines += [
+                # Calculate the address first, since the value can be loaded from the stack at any time
+                f"@{MEMORY_SEGMENT_MAP[segment]}\n",
+                "D=M\n",
+                f"@{index}\n",
+                "D=D+A\n",
+                "@R15\n",
+                "M=D\n",
+                *self.load_top(),
+                "@R15\n",
+                "A=M\n",
+                "M=D\n",
+            ]
+
+        self.stack_offset -= 1
+        self.top_in_d = False
+
+        self.output_file.writelines(lines)
+
+    def write_cached_arithmetic(self, command: Command):
+        operation = command.arg1
+        lines = [f"// {operation.value}\n"]
+
+        if operation in UNARY_COMPUTATIONS:
+            in_register, in_memory = UNARY_COMPUTATIONS[operation]
+
+            if self.top_in_d:
+                lines.append(f"{in_register}\n")
+            else:
+                lines += [*self.stack_slot(-1), f"{in_memory}\n"]
+
+            self.top_in_d = True
+            self.output_file.writelines(lines)
+            return
+
+        # Point A at the second value on the stack, with the top value in D
+        if self.top_in_d:
+            lines += self.stack_slot(-2)
+        else:
+            lines += [*self.stack_slot(-1), "D=M\n", "A=A-1\n"]
+
+        if operation in BINARY_COMPUTATIONS:
+            lines.append(f"{BINARY_COMPUTATIONS[operation]}\n")
+        else:
+            name = operation.name
+            true_label = f"{self.label_prefix}IS_{name}_{self.label_counter}"
+            end_label = f"{self.label_prefix}END_{name}_{self.label_counter}"
+
+            lines += [
+                "D=M-D\n",
+                f"@{true_label}\n",
+                f"D;{COMPARISON_JUMPS[operation]}\n",
+                "D=0\n",
+                f"@{end_label}\n",
+                "0;JMP\n",
+                f"({true_label})\n",
+                # -1 is the largest value in a 16-bit register so we use it to indicate true
+                "D=-1\n",
+                f"({end_label})\n",
+            ]
+
+            self.label_counter += 1
+
+        self.stack_offset -= 1
+        self.top_in_d = True
+
+        self.output_file.writelines(lines)
+
+    def write_cached_if(self, label: str):
+        """
+        Writes an `if-goto` whose condition is held in D, so it does not have to be stored to the stack and loaded again.
+        """
+        # The condition is popped, and the stack pointer is written back without touching D
+        self.stack_offset -= 1
+        commit_stack_offset = self.commit_stack_offset()
+        self.top_in_d = False
+
+        self.output_file.writelines([
+            f"// if-goto {label}\n",
+            *commit_stack_offset,
+            f"@{self.scoped_label(label)}\n",
+            "D;JNE\n",
+        ])
+
+    @staticmethod
+    def validate_push_pop(command: Command):
+        """
+        Raises the same errors as `CodeWriter.write_push_pop` for commands that cannot be translated.
+        """
+        if not command.arg1 or command.arg2 is None:
+            raise ValueError("Invalid command")
+
+        if (command.type, command.arg1) not in TEMPLATES:
+            if command.arg1 == "constant":
+                raise ValueError("Cannot pop constant")
+            raise ValueError(f"Invalid memory segment: {command.arg1}")
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from .assembler import assemble, format_hack
+from .client import DEFAULT_HOST, DEFAULT_PORT
+from .translator import BACKENDS, translate_program
+
+# Longest request line accepted, which bounds the memory used by a single connection
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+# Output formats a request can ask for. Binary output is not offered since responses are JSON.
+EMIT_FORMATS = ("asm", "hack")
+
+def handle_request(request: dict) -> dict:
+    """
+    Translates the program described by a request and returns the response. This runs in a worker process.
+
+    Requests have the following fields:
+        - `modules`: a list of `{"name": ..., "source": ...}` objects holding the VM code of every module.
+        - `emit`: either `asm` or `hack` (default: `asm`).
+        - `optimize`, `shared_comparisons`, `remove_unused_functions` and `backend`: see `translator.translate_program`.
+    """
+    emit = request.get("emit", "asm")
+    if emit not in EMIT_FORMATS:
+        raise ValueError(f"Invalid output format: {emit}")
+
+    backend = request.get("backend", "stack")
+    if backend not in BACKENDS:
+        raise ValueError(f"Invalid backend: {backend}")
+
+    assembly = translate_program(
+        [(module["name"], module["source"]) for module in request["modules"]],
+        optimize=request.get("optimize", False),
+        shared_comparisons=request.get("shared_comparisons", False),
+        remove_unused_functions=request.get("remove_unused_functions", True),
+        backend=backend,
+    )
+
+    return {"output": format_hack(assemble(assembly)) if emit == "hack" else assembly}
+
+def warm_up():
+    """
+    Does nothing. Submitted once per worker on start-up so the worker processes exist before the first request.
+    """
+
+class TranslationServer:
+    """
+    A long-running server that translates programs sent by `TranslationClient`, so clients do not pay for
+    starting Python and importing the translator on every translation.
+
+    Every request is a single line of JSON and gets a single line of JSON back, holding either the `output` or an
+    `error`, along with the `id` of the request if it had one. Requests are translated concurrently on a pool
+    of worker processes, including several requests sent over the same connection, in which case responses
+    are sent in the order they complete.
+    """
+    def __init__(self, jobs: int = None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.jobs)
+
+        for _ in range(self.jobs):
+            self.executor.submit(warm_up)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self.send(writer, write_lock, {"error": f"Request is larger than {MAX_REQUEST_SIZE} bytes"})
+                    break
+
+                if not line:
+                    break
+
+                task = asyncio.create_task(self.respond(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, line: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        request = {}
+
+        try:
+            request = json.loads(line)
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, handle_request, request)
+        except Exception as error:
+            response = {"error": str(error) or type(error).__name__}
+
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+
+        await self.send(writer, write_lock, response)
+
+    @staticmethod
+    async def send(writer: asyncio.StreamWriter, write_lock: asyncio.Lock, response: dict):
+        async with write_lock:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+    async def serve(self, socket_path: str = None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+        """
+        Listens on the Unix socket `socket_path`, or on `host` and `port` over TCP if it is not given, until cancelled.
+        """
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path, limit=MAX_REQUEST_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_SIZE)
+
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
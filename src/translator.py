@@ -0,0 +1,254 @@
+import io
+from typing import Collection, Iterable, Iterator, List, TextIO, Tuple, Union
+from .analysis import (
+    analyze_stack,
+    build_call_graph,
+    functions_modifying_pointers,
+    kept_functions_by_module,
+    remove_functions,
+    safe_functions,
+)
+from .code_writer import CodeWriter, uses_call_routines
+from .parser import CommandArray, Parser
+from .register_writer import RegisterCodeWriter
+from . import optimizer, peephole
+
+# Code generation backends, by the name used to select them
+BACKENDS = {
+    "stack": CodeWriter,
+    "register": RegisterCodeWriter,
+}
+
+# Name of the module whose translation is preceded by the bootstrap code in a complete program
+SYSTEM_MODULE = "Sys"
+
+def source_lines(source: Union[str, Iterable[str]]) -> Iterable[str]:
+    """
+    Helper function that returns the lines of VM code given either as a single string or as an iterable of lines.
+    """
+    return source.splitlines() if isinstance(source, str) else source
+
+def create_writer(
+    commands: CommandArray,
+    output: Union[str, TextIO],
+    shared_comparisons: bool = False,
+    backend: str = "stack",
+) -> CodeWriter:
+    """
+    Creates a writer of the `backend` for translating `commands`, which only saves THIS and THAT in the functions
+    that change them, and leaves popped values in place in the functions whose stack use `analysis.analyze_stack`
+    can check. See `CodeWriter` for `output`.
+    """
+    return BACKENDS[backend](
+        output,
+        shared_comparisons=shared_comparisons,
+        pointer_saving_functions=functions_modifying_pointers(commands),
+        safe_functions=safe_functions(analyze_stack(commands)),
+    )
+
+def write_commands(
+    commands: CommandArray,
+    module_name: str,
+    output: Union[str, TextIO],
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    kept_functions: Collection[str] = None,
+    backend: str = "stack",
+) -> CodeWriter:
+    """
+    Translates the parsed commands of a single module, writing the assembly to `output` as it is generated,
+    and returns the closed writer, whose `uses_call_routines` and `comparison_call_count` describe the output.
+    See `CodeWriter` for `output`, which is left untouched if the translation fails.
+
+    `optimize` only optimizes the commands. The peephole pass needs the whole assembly, so it is left to
+    `translate_commands`. See `translate_commands` for the other arguments.
+    """
+    if kept_functions is not None:
+        commands = CommandArray(remove_functions(commands, kept_functions))
+
+    with create_writer(commands, output, shared_comparisons, backend) as writer:
+        writer.set_filename(module_name)
+
+        if optimize:
+            commands = optimizer.optimize(commands)
+
+        for command in commands:
+            writer.write_command(command)
+
+    return writer
+
+def translate_commands(
+    commands: CommandArray,
+    module_name: str,
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    kept_functions: Collection[str] = None,
+    backend: str = "stack",
+) -> str:
+    """
+    Translates the parsed commands of a single module and returns the generated assembly.
+    Static variables and labels are namespaced by `module_name`, so the result can be
+    concatenated with the output of other modules from the same program with `link`.
+
+    If `kept_functions` is given, every function defined in the module that is not in it is left out.
+    `backend` is the name of the code generation backend to use, see `BACKENDS`, and the writer is set up by
+    `create_writer`.
+    """
+    output = io.StringIO()
+    write_commands(commands, module_name, output, optimize, shared_comparisons, kept_functions, backend)
+
+    assembly = output.getvalue()
+
+    if optimize:
+        assembly = peephole.optimize(assembly)
+
+    return assembly
+
+def prologue(module_names: Iterable[str], shared_comparisons: bool = False) -> str:
+    """
+    Returns the code that `link` puts before the translation of the first module: the bootstrap code if one of the
+    modules is `Sys`, followed by the shared comparison routines if `shared_comparisons` is set.
+    """
+    output = io.StringIO()
+    writer = CodeWriter(output)
+
+    # Programs with a Sys module start by setting up the stack and calling Sys.init
+    if SYSTEM_MODULE in module_names:
+        writer.set_filename("Bootstrap")
+        writer.write_init()
+
+    if shared_comparisons:
+        writer.write_comparison_routines()
+
+    return output.getvalue()
+
+def link(chunks: List[str], module_names: Iterable[str], shared_comparisons: bool = False) -> str:
+    """
+    Merges the translations of every module of a program, in the given order, into a complete program.
+
+    This will do the following:
+        - Start with the bootstrap code if one of the modules is `Sys`.
+        - Add the shared comparison routines if `shared_comparisons` is set.
+        - Add the shared call and return routines at the end if any module uses them.
+    """
+    chunks = [prologue(module_names, shared_comparisons), *chunks]
+
+    if any(uses_call_routines(chunk) for chunk in chunks):
+        chunks.append(call_routines())
+
+    return "".join(chunks)
+
+def call_routines() -> str:
+    """
+    Returns the shared call and return routines, which are added once at the end of a program that uses them.
+    """
+    routines = io.StringIO()
+    CodeWriter(routines).write_call_routines()
+    return routines.getvalue()
+
+def translate(
+    source: Union[str, Iterable[str]],
+    module_name: str = "Main",
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    standalone: bool = True,
+    backend: str = "stack",
+) -> str:
+    """
+    Translates VM code held in memory and returns the generated assembly, without touching the filesystem.
+
+    Args:
+        source (str | Iterable[str]): The VM code, either as a single string or as an iterable of lines.
+        module_name (str): The name of the module, i.e. of its .vm file without the extension.
+            Static variables and labels are namespaced by it.
+        optimize (bool): If set, the commands and the generated assembly are optimized.
+        shared_comparisons (bool): If set, comparisons are translated into calls to shared routines.
+        standalone (bool): If set, the result is a complete program, including the shared routines it uses and
+            the bootstrap code if the module is `Sys`. Otherwise it is meant to be merged with other modules by `link`.
+        backend (str): The code generation backend to use, see `BACKENDS`.
+    """
+    commands = Parser(source_lines(source)).parse_all()
+    assembly = translate_commands(commands, module_name, optimize, shared_comparisons, backend=backend)
+
+    if not standalone:
+        return assembly
+
+    return link([assembly], [module_name], shared_comparisons)
+
+def translate_program(
+    modules: List[Tuple[str, Union[str, Iterable[str]]]],
+    optimize: bool = False,
+    shared_comparisons: bool = False,
+    remove_unused_functions: bool = True,
+    backend: str = "stack",
+) -> str:
+    """
+    Translates every module of a program held in memory and returns the complete program.
+
+    Args:
+        modules (List[Tuple[str, str | Iterable[str]]]): The name and VM code of every module, in the order they
+            are merged in. See `translate`.
+        remove_unused_functions (bool): If set and the program defines `Sys.init`, functions that cannot be
+            reached from it are left out.
+        backend (str): The code generation backend to use, see `BACKENDS`.
+    """
+    module_names = [module_name for module_name, _ in modules]
+    commands = [Parser(source_lines(source)).parse_all() for _, source in modules]
+
+    if remove_unused_functions:
+        kept_functions = kept_functions_by_module([build_call_graph(module_commands) for module_commands in commands])
+    else:
+        kept_functions = [None] * len(modules)
+
+    chunks = [
+        translate_commands(module_commands, module_name, optimize, shared_comparisons, module_kept_functions, backend)
+        for module_commands, module_name, module_kept_functions in zip(commands, module_names, kept_functions)
+    ]
+
+    return link(chunks, module_names, shared_comparisons)
+
+def iter_translate(
+    source: Union[str, Iterable[str]],
+    module_name: str = "Main",
+    shared_comparisons: bool = False,
+    standalone: bool = True,
+    backend: str = "stack",
+) -> Iterator[str]:
+    """
+    Generator that translates VM code held in memory and yields the generated assembly line by line,
+    each line ending in a newline. Lines of `source` are only read as they are needed, so arbitrarily
+    large programs can be translated in constant memory.
+
+    The optimizer needs the whole program, so it is not supported here, and every function saves THIS and THAT
+    and clears the values it pops, since functions cannot be analyzed ahead of time. See `translate` for the arguments.
+    """
+    output = io.StringIO()
+    writer = BACKENDS[backend](output, shared_comparisons=shared_comparisons)
+
+    def drain() -> List[str]:
+        lines = output.getvalue().splitlines(keepends=True)
+        output.seek(0)
+        output.truncate()
+        return lines
+
+    if standalone and module_name == SYSTEM_MODULE:
+        writer.set_filename("Bootstrap")
+        writer.write_init()
+
+    writer.set_filename(module_name)
+
+    if standalone and shared_comparisons:
+        writer.write_comparison_routines()
+
+    yield from drain()
+
+    for command in Parser(source_lines(source)).iter_commands():
+        writer.write_command(command)
+        yield from drain()
+
+    writer.finish()
+    yield from drain()
+
+    if standalone and writer.uses_call_routines:
+        writer.write_call_routines()
+        yield from drain()
@@ -0,0 +1,161 @@
+import sys
+import pytest
+from src.analysis import (
+    analyze_stack,
+    build_call_graph,
+    functions_modifying_pointers,
+    kept_functions_by_module,
+    remove_functions,
+    safe_functions,
+    stack_requirements,
+)
+from src.code_writer import CALLER_FRAME_SIZE
+from src.main import main
+from src.parser import Parser
+
+PROGRAM = """
+function Sys.init 0
+call Sys.used 0
+call Main.main 0
+return
+function Sys.used 0
+push constant 3000
+pop pointer 0
+return
+function Sys.unused 0
+call Sys.used 0
+return
+"""
+
+MAIN = """
+function Main.main 0
+call Main.helper 0
+return
+function Main.helper 0
+return
+function Main.unused 0
+return
+"""
+
+FUNCTIONS = """
+function Main.leaf 2
+push local 0
+push local 1
+add
+push argument 0
+add
+return
+function Main.caller 0
+push constant 1
+push constant 2
+call Main.leaf 1
+return
+function Main.loop 0
+label LOOP
+push constant 1
+goto LOOP
+function Main.recurse 0
+call Main.recurse 0
+return
+"""
+
+# Only analyzed, since the translator rejects the out of range access
+INVALID_FUNCTION = """
+function Main.bad 0
+pop temp 0
+push temp 9
+return
+"""
+
+def parse(source: str):
+    return Parser(source.splitlines()).parse_all()
+
+@pytest.fixture
+def usages():
+    return analyze_stack(parse(FUNCTIONS + INVALID_FUNCTION))
+
+def test_call_graph():
+    assert build_call_graph(parse(PROGRAM)) == {
+        "Sys.init": {"Sys.used", "Main.main"},
+        "Sys.used": set(),
+        "Sys.unused": {"Sys.used"},
+    }
+
+def test_functions_reachable_across_modules_are_kept():
+    call_graphs = [build_call_graph(parse(PROGRAM)), build_call_graph(parse(MAIN))]
+
+    assert kept_functions_by_module(call_graphs) == [["Sys.init", "Sys.used"], ["Main.helper", "Main.main"]]
+
+def test_every_function_is_kept_without_sys_init():
+    assert kept_functions_by_module([build_call_graph(parse(MAIN))]) == [None]
+
+def test_remove_functions():
+    commands = parse(PROGRAM)
+    kept = list(remove_functions(commands, ["Sys.init", "Sys.used"]))
+
+    assert [command.arg1 for command in kept if command.arg1 == "Sys.unused"] == []
+    assert len(kept) == len(commands) - 3
+
+def test_functions_modifying_pointers():
+    assert functions_modifying_pointers(parse(PROGRAM)) == {"Sys.used"}
+
+def test_remove_functions_with_key():
+    items = [(command, line_number) for line_number, command in enumerate(parse(MAIN))]
+    kept = list(remove_functions(items, ["Main.main", "Main.helper"], key=lambda item: item[0]))
+
+    assert kept == items[:-2]
+
+def test_bounded_depth(usages):
+    assert usages["Main.leaf"].local_count == 2
+    assert usages["Main.leaf"].max_depth == 2
+    assert usages["Main.caller"].call_depths == {"Main.leaf": 2}
+
+def test_loop_that_keeps_pushing_is_unbounded(usages):
+    assert usages["Main.loop"].max_depth is None
+    assert not usages["Main.loop"].is_safe
+
+def test_underflow_and_out_of_range_access_are_reported(usages):
+    issues = usages["Main.bad"].issues
+
+    assert len(issues) == 2
+    assert issues[0].startswith("`pop temp 0`")
+    assert issues[1].startswith("`push temp 9`")
+
+def test_safe_functions(usages):
+    assert safe_functions(usages) == {"Main.leaf", "Main.caller", "Main.recurse"}
+
+def test_stack_requirements(usages):
+    # Neither function changes THIS or THAT, so their frames do not save them
+    requirements = stack_requirements(usages, pointer_saving_functions=[])
+
+    assert requirements["Main.leaf"] == CALLER_FRAME_SIZE + 2 + 2
+    assert requirements["Main.caller"] == CALLER_FRAME_SIZE + 2 + requirements["Main.leaf"]
+
+def test_stack_requirements_of_functions_saving_pointers(usages):
+    requirements = stack_requirements(usages, pointer_saving_functions=["Main.leaf"])
+
+    assert requirements["Main.leaf"] == CALLER_FRAME_SIZE + 2 + 2 + 2
+
+def test_stack_requirements_of_unbounded_and_recursive_functions(usages):
+    requirements = stack_requirements(usages)
+
+    assert requirements["Main.loop"] is None
+    assert requirements["Main.recurse"] is None
+
+def test_stack_requirements_of_calls_outside_the_program():
+    usages = analyze_stack(parse("function Main.main 0\ncall Math.multiply 0\nreturn\n"))
+
+    assert stack_requirements(usages)["Main.main"] is None
+
+def test_stack_report_of_unbounded_and_recursive_functions(tmp_path, monkeypatch, capsys):
+    # Recursive and unbounded functions used to crash the report, since they have no requirement
+    input_file = tmp_path / "Main.vm"
+    input_file.write_text(FUNCTIONS)
+    monkeypatch.setattr(sys, "argv", ["hack-vm-translate", str(input_file), "--stack-report", "--no-cache"])
+
+    main()
+
+    report = capsys.readouterr().out
+    assert "Main.recurse" in report
+    assert "no bound" in report
+    assert (tmp_path / "Main.asm").exists()
@@ -0,0 +1,182 @@
+import io
+import os
+import time
+import pytest
+from src import cache as cache_module
+from src.cache import TranslationCache, code_generation_digest
+from src import main as main_module
+from src.main import translate_files, write_files
+
+SYSTEM_SOURCE = """
+function Sys.init 0
+call Sys.used 0
+label END
+goto END
+function Sys.used 0
+push constant 1
+return
+function Sys.unused 0
+push constant 2
+return
+"""
+
+@pytest.fixture
+def cache(tmp_path):
+    return TranslationCache(str(tmp_path / "cache"))
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / "Main.vm"
+    path.write_text("push constant 1\npush constant 2\nadd\n")
+    return str(path)
+
+def test_miss_then_hit(cache, input_file):
+    key = cache.key(input_file, {"optimize": False})
+
+    assert cache.get(key) is None
+
+    cache.put(key, "@1\n")
+
+    assert cache.get(key) == "@1\n"
+
+def test_key_depends_on_contents_name_and_options(cache, input_file, tmp_path):
+    key = cache.key(input_file, {"optimize": False})
+
+    assert cache.key(input_file, {"optimize": True}) != key
+
+    renamed = tmp_path / "Other.vm"
+    renamed.write_text(open(input_file).read())
+    assert cache.key(str(renamed), {"optimize": False}) != key
+
+    with open(input_file, "a") as file:
+        file.write("neg\n")
+    assert cache.key(input_file, {"optimize": False}) != key
+
+def test_key_depends_on_code_generator(cache, input_file, monkeypatch):
+    key = cache.key(input_file, {})
+
+    monkeypatch.setattr(cache_module, "code_generation_digest", lambda: "changed")
+
+    assert cache.key(input_file, {}) != key
+
+def test_code_generation_digest_covers_the_code_generator():
+    directory = os.path.dirname(cache_module.__file__)
+
+    assert len(code_generation_digest()) == 64
+    for module in ("code_writer", "register_writer", "optimizer", "peephole", "analysis"):
+        assert module in cache_module.CODE_GENERATION_MODULES
+        assert os.path.exists(os.path.join(directory, f"{module}.py"))
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache"), max_size=10)
+
+    for index, key in enumerate(["old", "used", "new"]):
+        cache.put(key, "x" * 4)
+        os.utime(cache.path(key), (index, index))
+
+    # Reading an entry marks it as recently used
+    cache.get("used")
+    cache.evict()
+
+    assert cache.get("old") is None
+    assert cache.get("used") == "x" * 4
+    assert cache.get("new") == "x" * 4
+
+def test_cached_translation_matches_uncached(cache, input_file):
+    uncached = translate_files([input_file])
+
+    assert translate_files([input_file], cache=cache) == uncached
+    assert len([name for name in os.listdir(cache.directory) if name.endswith(cache_module.CACHE_FILE_EXTENSION)]) == 1
+    assert translate_files([input_file], cache=cache) == uncached
+
+@pytest.fixture
+def program(tmp_path):
+    sys_file = tmp_path / "Sys.vm"
+    sys_file.write_text(SYSTEM_SOURCE)
+    return [str(sys_file)]
+
+def test_call_graphs_are_cached(cache, program):
+    assembly = translate_files(program, cache=cache)
+
+    assert "Sys.unused" not in assembly
+    assert cache.get_call_graph(cache_module.file_digest(program[0])) == {
+        "Sys.init": {"Sys.used"},
+        "Sys.used": set(),
+        "Sys.unused": set(),
+    }
+
+def test_unchanged_files_are_not_parsed(cache, program, monkeypatch):
+    assembly = translate_files(program, cache=cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parsed an unchanged file")
+
+    monkeypatch.setattr(main_module, "Parser", fail)
+
+    assert translate_files(program, cache=cache) == assembly
+
+def test_cold_build_parses_each_file_once(cache, program, monkeypatch):
+    parses = []
+    parser = main_module.Parser
+
+    def counting_parser(source):
+        parses.append(source)
+        return parser(source)
+
+    monkeypatch.setattr(main_module, "Parser", counting_parser)
+    translate_files(program, cache=cache)
+
+    assert parses == program
+
+def test_call_graphs_are_only_built_for_programs_with_sys(input_file, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("built a call graph")
+
+    monkeypatch.setattr(main_module, "build_call_graph", fail)
+
+    assert "@SP" in translate_files([input_file])
+
+def test_cached_translations_are_streamed(cache, program, monkeypatch):
+    assembly = translate_files(program, cache=cache, shared_comparisons=True)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("read a whole entry")
+
+    monkeypatch.setattr(cache, "get", fail)
+    output = io.StringIO()
+
+    assert write_files(output, program, cache=cache, shared_comparisons=True) == 0
+    assert output.getvalue() == assembly
+
+def test_evicted_entries_are_translated_again(cache, program):
+    assembly = translate_files(program, cache=cache)
+
+    for name in os.listdir(cache.directory):
+        if name.endswith(cache_module.METADATA_FILE_EXTENSION):
+            os.unlink(os.path.join(cache.directory, name))
+
+    assert translate_files(program, cache=cache) == assembly
+
+def test_warm_build_of_a_large_program(cache, tmp_path, monkeypatch):
+    sys_file = tmp_path / "Sys.vm"
+    body = "push local 0\npush constant 1\nadd\npop local 0\npush local 0\npush constant 10\nlt\npop temp 0\n"
+    sys_file.write_text("function Sys.init 1\n" + body * 10000 + "label END\ngoto END\n")
+    program = [str(sys_file)]
+
+    start = time.perf_counter()
+    assembly = translate_files(program, cache=cache)
+    cold = time.perf_counter() - start
+
+    def fail(*args, **kwargs):
+        raise AssertionError("parsed an unchanged file")
+
+    monkeypatch.setattr(main_module, "Parser", fail)
+
+    start = time.perf_counter()
+    assert translate_files(program, cache=cache) == assembly
+    warm = time.perf_counter() - start
+
+    assert assembly.count("\n") > 500000
+
+    # A warm build only hashes the file and copies the cached assembly
+    assert warm < cold / 5
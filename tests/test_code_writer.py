@@ -0,0 +1,45 @@
+import os
+import pytest
+from src.code_writer import comparison_rom_words_saved, count_comparison_calls
+from src.emulator import HackCPU
+from src.translator import translate
+
+STACK_TEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), "StackTest.vm")
+
+# Pairs of operands, including those whose difference overflows
+COMPARISON_OPERANDS = [(5, 5), (3, -4), (-4, 3), (32767, -1), (-32768, 1), (-32768, 32767), (0, -32768)]
+
+def push(value: int) -> str:
+    if value >= 0:
+        return f"push constant {value}\n"
+
+    # Constants are at most 32767, so -32768 is computed
+    return f"push constant {-value - 1}\nneg\npush constant 1\nsub\n"
+
+def compare(operation: str, x: int, y: int, shared_comparisons: bool) -> int:
+    cpu = HackCPU.from_assembly(translate(push(x) + push(y) + operation + "\n", "Main", shared_comparisons=shared_comparisons))
+    cpu.write(0, 256)
+    cpu.run(1000)
+    return cpu.read(256)
+
+def test_shared_comparisons_call_the_routines():
+    with open(STACK_TEST, "r") as file:
+        source = file.read()
+
+    assembly = translate(source, "StackTest", shared_comparisons=True)
+    comparisons = sum(line.strip() in ("eq", "gt", "lt") for line in source.splitlines())
+
+    assert count_comparison_calls(assembly) == comparisons
+    assert assembly.count("(END_COMPARISON_ROUTINES)") == 1
+    assert count_comparison_calls(translate(source, "StackTest")) == 0
+
+@pytest.mark.parametrize("x, y", COMPARISON_OPERANDS)
+@pytest.mark.parametrize("operation", ["eq", "gt", "lt"])
+def test_shared_comparisons_match_inline_comparisons(operation, x, y):
+    assert compare(operation, x, y, shared_comparisons=True) == compare(operation, x, y, shared_comparisons=False)
+
+def test_rom_words_saved():
+    # The routines only pay for themselves once a program has a few comparisons
+    assert comparison_rom_words_saved(1) < 0
+    assert comparison_rom_words_saved(100) > 0
+    assert comparison_rom_words_saved(101) > comparison_rom_words_saved(100)
@@ -0,0 +1,75 @@
+import pytest
+from src.assembler import assemble, format_hack
+from src.emulator import HackCPU
+from src.main import parse_cmp_file
+
+def run(assembly: str, cycles: int = 1000) -> HackCPU:
+    cpu = HackCPU.from_assembly(assembly)
+    cpu.run(cycles)
+    return cpu
+
+def test_assemble():
+    words = assemble("@2\nD=A\n@3\nD=D+A\n@0\nM=D\n")
+
+    assert format_hack(words).split() == [
+        "0000000000000010",
+        "1110110000010000",
+        "0000000000000011",
+        "1110000010010000",
+        "0000000000000000",
+        "1110001100001000",
+    ]
+
+def test_arithmetic_and_memory():
+    cpu = run("@7\nD=A\n@5\nD=D-A\n@R1\nM=D\nM=M+1\n@R1\nD=!M\n@R2\nM=D\n")
+
+    assert cpu.is_halted()
+    assert cpu.read(1) == 3
+    assert cpu.read(2) == -4
+
+def test_values_wrap_to_16_bits():
+    cpu = run("@32767\nD=A\nD=D+1\n@R0\nM=D\n")
+
+    assert cpu.read(0) == -32768
+
+def test_jumps_and_variables():
+    # Sums 1 to 10 into a variable, which is allocated at 16
+    cpu = run("""
+        @10
+        D=A
+        @i
+        M=D
+    (LOOP)
+        @i
+        D=M
+        @END
+        D;JEQ
+        @sum
+        M=D+M
+        @i
+        M=M-1
+        @LOOP
+        0;JMP
+    (END)
+    """)
+
+    assert cpu.is_halted()
+    assert cpu.read(17) == 55
+
+def test_run_stops_after_cycles():
+    cpu = HackCPU.from_assembly("(LOOP)\n@R0\nM=M+1\n@LOOP\n0;JMP\n")
+
+    assert cpu.run(400) == 400
+    assert not cpu.is_halted()
+    assert cpu.read(0) == 100
+
+def test_dump_matches_cmp_format(tmp_path):
+    cpu = run("@5\nD=-A\n@R3\nM=D\n")
+    cmp_file = tmp_path / "Test.cmp"
+    cmp_file.write_text(cpu.dump([3, 4]))
+
+    assert parse_cmp_file(str(cmp_file)) == ([3, 4], [-5, 0])
+
+def test_invalid_instruction():
+    with pytest.raises(ValueError):
+        assemble("D=Q\n")
@@ -0,0 +1,65 @@
+import os
+import stat
+import sys
+import pytest
+from src.code_writer import CodeWriter
+from src.files import DEFAULT_FILE_MODE, AtomicFile, write_atomically
+from src.main import main
+from src.parser import Command
+
+def test_atomic_file_is_only_visible_once_closed(tmp_path):
+    path = tmp_path / "Main.asm"
+
+    with AtomicFile(str(path)) as file:
+        file.write("@1\n")
+        assert not path.exists()
+
+    assert path.read_text() == "@1\n"
+    assert os.listdir(tmp_path) == ["Main.asm"]
+
+def test_atomic_file_gets_the_default_permissions(tmp_path):
+    path = tmp_path / "Main.asm"
+    write_atomically(str(path), b"\x00\x01")
+
+    assert path.read_bytes() == b"\x00\x01"
+    assert stat.S_IMODE(path.stat().st_mode) == DEFAULT_FILE_MODE
+
+def test_atomic_file_keeps_previous_contents_on_error(tmp_path):
+    path = tmp_path / "Main.asm"
+    path.write_text("previous\n")
+
+    with pytest.raises(RuntimeError):
+        with AtomicFile(str(path)) as file:
+            file.write("partial\n")
+            raise RuntimeError()
+
+    assert path.read_text() == "previous\n"
+    assert os.listdir(tmp_path) == ["Main.asm"]
+
+def test_code_writer_deletes_temporary_file_on_error(tmp_path):
+    path = tmp_path / "Main.asm"
+
+    with pytest.raises(ValueError):
+        with CodeWriter(str(path)) as writer:
+            writer.set_filename("Main")
+            writer.write_command(Command("push constant 1"))
+            writer.write_command(Command("pop constant 0"))
+
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.parametrize("source", ["push constant 1\nbogus 3\n", "push constant 1\npop constant 0\n"], ids=["parse", "translate"])
+@pytest.mark.parametrize("options", [["--no-cache"], []], ids=["streaming", "cached"])
+def test_failed_translation_leaves_no_files(tmp_path, monkeypatch, source, options):
+    # The temporary output file used to be left behind when a file failed to parse
+    input_file = tmp_path / "Bad.vm"
+    input_file.write_text(source)
+    monkeypatch.setattr(sys, "argv", ["hack-vm-translate", str(input_file), "--cache-dir", str(tmp_path / "cache"), *options])
+
+    with pytest.raises(ValueError):
+        main()
+
+    assert [name for name in os.listdir(tmp_path) if name != "cache"] == ["Bad.vm"]
+
+    # Nor is a partial translation left in the cache
+    cache_dir = tmp_path / "cache"
+    assert not cache_dir.exists() or all(name.endswith(".calls.json") for name in os.listdir(cache_dir))
@@ -0,0 +1,48 @@
+import random
+from src.fuzz import (
+    END_LABEL,
+    RECURSIVE_FUNCTION,
+    fuzz_case,
+    generate_program,
+    is_valid_program,
+    program_lines,
+    run_mode,
+)
+
+def test_generated_programs_are_valid():
+    for seed in range(50):
+        statements = generate_program(random.Random(seed), 40)
+
+        assert is_valid_program(statements)
+        assert f"label {END_LABEL}" in program_lines(statements)
+
+def test_generated_programs_use_structured_flow():
+    lines = [line for seed in range(20) for line in program_lines(generate_program(random.Random(seed), 40))]
+
+    for command in ("if-goto", "goto", "function", "call", "return", f"call {RECURSIVE_FUNCTION}"):
+        assert any(line.startswith(command) for line in lines)
+
+def test_programs_run_in_every_backend():
+    lines = program_lines(generate_program(random.Random(3), 40))
+
+    for mode in ("stack", "register", "vm"):
+        ram, error = run_mode(lines, mode)
+
+        assert error is None
+        assert ram is not None
+
+def test_modes_agree():
+    assert all(fuzz_case(seed, 20) is None for seed in range(5))
+
+def test_removing_a_called_function_is_invalid():
+    for seed in range(20):
+        statements = generate_program(random.Random(seed), 40)
+        start = next((index for index, statement in enumerate(statements) if statement.starts_function), None)
+
+        if start is not None and any(statements[start].function in statement.calls for statement in statements):
+            break
+
+    end = next(index for index, statement in enumerate(statements) if statement.returns) + 1
+
+    assert is_valid_program(statements[:start] + statements[start + 1:]) is False
+    assert is_valid_program(statements[:start] + statements[end:]) is False
@@ -0,0 +1,53 @@
+from src import optimizer
+from src.emulator import HackCPU
+from src.parser import ArithmeticCommand, CommandType, Parser
+from src.translator import translate
+
+def optimize(source: str):
+    return list(optimizer.optimize(Parser(source.splitlines()).iter_commands()))
+
+def test_push_followed_by_pop_becomes_move():
+    commands = optimize("push local 1\npop static 3\n")
+
+    assert len(commands) == 1
+    move = commands[0]
+    assert (move.type, move.arg1, move.arg2) == (CommandType.C_MOVE, "static", 3)
+    assert (move.source.type, move.source.arg1, move.source.arg2) == (CommandType.C_PUSH, "local", 1)
+
+def test_only_the_last_push_is_moved():
+    commands = optimize("push constant 1\npush argument 0\npop temp 2\n")
+
+    assert [command.type for command in commands] == [CommandType.C_PUSH, CommandType.C_MOVE]
+    assert commands[1].source.arg1 == "argument"
+
+def test_pop_without_push_is_kept():
+    commands = optimize("add\npop temp 0\n")
+
+    assert [command.type for command in commands] == [CommandType.C_ARITHMETIC, CommandType.C_POP]
+
+def test_constant_folding():
+    commands = optimize("push constant 69\npush constant 420\nlt\npush constant 0\nnot\n")
+
+    assert [(command.arg1, command.arg2) for command in commands] == [("constant", -1), ("constant", -1)]
+
+def test_folded_comparisons_wrap_like_the_alu():
+    # 32767 - (-1) overflows to -32768, so the generated code finds 32767 not greater than -1
+    commands = optimize("push constant 32767\npush constant 1\nneg\ngt\n")
+
+    assert [(command.arg1, command.arg2) for command in commands] == [("constant", 0)]
+
+def test_arithmetic_on_non_constants_is_kept():
+    commands = optimize("push local 0\npush constant 1\nadd\n")
+
+    assert commands[-1].type == CommandType.C_ARITHMETIC
+    assert commands[-1].arg1 == ArithmeticCommand.ADD
+
+def test_moves_copy_between_segments():
+    source = "push constant 3010\npop pointer 1\npush constant 42\npop temp 1\npush temp 1\npop that 2\n"
+    cpu = HackCPU.from_assembly(translate(source, "Main", optimize=True))
+    cpu.write(0, 256)
+    cpu.run(1000)
+
+    assert cpu.read(6) == 42
+    assert cpu.read(3012) == 42
+    assert cpu.read(0) == 256
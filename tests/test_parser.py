@@ -0,0 +1,67 @@
+import pytest
+from src.parser import ArithmeticCommand, Command, CommandArray, CommandType, Parser
+
+SOURCE = """
+// Comments and blank lines are skipped
+push constant 7
+push constant 8
+add
+pop local 0   // so are trailing comments
+label LOOP
+if-goto LOOP
+function Main.main 2
+call Main.main 0
+return
+"""
+
+def describe(command: Command):
+    return command.type, command.arg1, command.arg2
+
+def test_parse_commands():
+    commands = list(Parser(SOURCE.splitlines()).iter_commands())
+
+    assert [describe(command) for command in commands] == [
+        (CommandType.C_PUSH, "constant", 7),
+        (CommandType.C_PUSH, "constant", 8),
+        (CommandType.C_ARITHMETIC, ArithmeticCommand.ADD, None),
+        (CommandType.C_POP, "local", 0),
+        (CommandType.C_LABEL, "LOOP", None),
+        (CommandType.C_IF, "LOOP", None),
+        (CommandType.C_FUNCTION, "Main.main", 2),
+        (CommandType.C_CALL, "Main.main", 0),
+        (CommandType.C_RETURN, None, None),
+    ]
+
+def test_invalid_command():
+    with pytest.raises(ValueError):
+        Parser(["bogus 3"]).parse_all()
+
+def test_command_array_round_trip():
+    commands = list(Parser(SOURCE.splitlines()).iter_commands())
+    array = CommandArray(commands)
+
+    assert len(array) == len(commands)
+    assert [describe(command) for command in array] == [describe(command) for command in commands]
+    assert [describe(array[index]) for index in range(len(array))] == [describe(command) for command in commands]
+
+def test_command_array_stores_each_opcode_once():
+    array = Parser(SOURCE.splitlines()).parse_all()
+
+    assert isinstance(array, CommandArray)
+    assert array.opcodes[0] == array.opcodes[1]
+    assert list(array.args[:2]) == [7, 8]
+    assert len(array.opcode_table) == len(array) - 1
+
+def test_command_array_shares_equal_commands():
+    array = CommandArray(Parser(["push constant 1", "push constant 1", "push constant 2"]).iter_commands())
+    first, second, third = array
+
+    assert first is second
+    assert third is not first
+
+def test_command_array_rejects_moves():
+    source = Command("push constant 1")
+    move = Command.from_parts(CommandType.C_MOVE, "local", 0, source=source)
+
+    with pytest.raises(ValueError):
+        CommandArray([move])
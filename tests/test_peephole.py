@@ -0,0 +1,23 @@
+from src import peephole
+
+def test_peephole_removes_push_pop_round_trip():
+    assembly = "@SP\nA=M\nM=D\n@SP\nM=M+1\n@SP\nAM=M-1\nD=M\nM=0\n@R13\nM=D\n"
+
+    assert peephole.optimize(assembly) == "@R13\nM=D\n"
+
+def test_peephole_keeps_comments_and_labels():
+    assembly = "// push\n@5\n// comment\n@6\n(LOOP)\n@7\n@8\nD=A\n"
+
+    assert peephole.optimize(assembly) == "// push\n@6\n// comment\n(LOOP)\n@8\nD=A\n"
+
+def test_peephole_rewrites_enable_earlier_matches():
+    # Removing the increment and decrement of SP leaves two addresses in a row, the first of which is then dropped
+    assembly = "   @SP\n   M=M+1\n   @SP\n   M=M-1\n   @SP\n   AM=M-1\n   D=M\n   M=0\n   @R13\n"
+
+    assert peephole.optimize(assembly) == "   @SP\n   AM=M-1\n   D=M\n   @R13\n"
+
+def test_peephole_on_repeated_code():
+    # Every rewrite only touches the lines around it, so each copy is optimized the same way
+    block = "@SP\nM=M+1\n@SP\nAM=M-1\nD=M\nM=0\n@R13\nM=D\n"
+
+    assert peephole.optimize(block * 5_000) == "@SP\nA=M\nD=M\n@R13\nM=D\n" * 5_000
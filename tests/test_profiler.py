@@ -0,0 +1,16 @@
+import os
+import pytest
+from src.main import translate_files
+from src.profiler import profile_files
+
+PROGRAMS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.mark.parametrize("backend", ["stack", "register"])
+@pytest.mark.parametrize("shared_comparisons", [False, True])
+def test_profiled_assembly_matches_translation(backend, shared_comparisons):
+    input_files = [os.path.join(PROGRAMS_DIR, "StackTest.vm")]
+    assembly, profile = profile_files(input_files, shared_comparisons, backend=backend)
+
+    assert assembly == translate_files(input_files, shared_comparisons=shared_comparisons, backend=backend)
+    assert profile.sources == input_files
+    assert len(profile.mappings) == sum(command.instructions for command in profile.commands.values())
@@ -0,0 +1,124 @@
+import os
+import pytest
+from src.emulator import HackCPU
+from src.interpreter import VMInterpreter
+from src.main import parse_cmp_file, run_main
+from src.parser import Parser
+from src.translator import BACKENDS, translate, translate_program
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# RAM set by the nand2tetris .tst script of every program before running it
+PROGRAM_SETUP = {
+    "SimpleAdd": {0: 256},
+    "StackTest": {0: 256},
+    "BasicTest": {0: 256, 1: 300, 2: 400, 3: 3000, 4: 3010},
+    "PointerTest": {0: 256, 1: 300, 2: 400, 3: 3000, 4: 3010},
+    "StaticTest": {0: 256, 1: 300, 2: 400, 3: 3000, 4: 3010},
+}
+
+# Every combination of code generation options the translator supports
+TRANSLATION_MODES = [
+    {"optimize": optimize, "shared_comparisons": shared_comparisons, "backend": backend}
+    for optimize in (False, True)
+    for shared_comparisons in (False, True)
+    for backend in BACKENDS
+]
+
+# Computes the 10th Fibonacci number recursively, across two modules, and stores it in temp 0
+FIBONACCI_PROGRAM = [
+    ("Sys", """
+        function Sys.init 0
+        push constant 10
+        call Main.fibonacci 1
+        pop temp 0
+        label END
+        goto END
+    """),
+    ("Main", """
+        function Main.fibonacci 0
+        push argument 0
+        push constant 2
+        lt
+        if-goto BASE
+        push argument 0
+        push constant 2
+        sub
+        call Main.fibonacci 1
+        push argument 0
+        push constant 1
+        sub
+        call Main.fibonacci 1
+        add
+        return
+        label BASE
+        push argument 0
+        return
+    """),
+]
+
+def program_path(name: str, extension: str = ".vm") -> str:
+    return os.path.join(TESTS_DIR, name + extension)
+
+def run(cpu, setup: dict, cycles: int):
+    for address, value in setup.items():
+        cpu.write(address, value)
+
+    cpu.run(cycles)
+    return cpu
+
+@pytest.mark.parametrize("mode", TRANSLATION_MODES, ids=lambda mode: "-".join(f"{key}={value}" for key, value in mode.items()))
+@pytest.mark.parametrize("name", list(PROGRAM_SETUP))
+def test_translated_program_matches_cmp(name, mode):
+    addresses, expected = parse_cmp_file(program_path(name, ".cmp"))
+
+    with open(program_path(name), "r") as file:
+        assembly = translate(file.read(), name, **mode)
+
+    cpu = run(HackCPU.from_assembly(assembly), PROGRAM_SETUP[name], 10_000)
+
+    assert cpu.is_halted()
+    assert [cpu.read(address) for address in addresses] == expected
+
+@pytest.mark.parametrize("name", list(PROGRAM_SETUP))
+def test_interpreted_program_matches_cmp(name):
+    addresses, expected = parse_cmp_file(program_path(name, ".cmp"))
+
+    vm = run(VMInterpreter.from_files([program_path(name)]), PROGRAM_SETUP[name], 10_000)
+
+    assert vm.is_halted()
+    assert [vm.read(address) for address in addresses] == expected
+
+@pytest.mark.parametrize("name", list(PROGRAM_SETUP))
+def test_interpreter_leaves_the_same_ram_as_the_translation(name):
+    with open(program_path(name), "r") as file:
+        cpu = run(HackCPU.from_assembly(translate(file.read(), name)), PROGRAM_SETUP[name], 10_000)
+
+    vm = run(VMInterpreter.from_files([program_path(name)]), PROGRAM_SETUP[name], 10_000)
+
+    # R13 to R15 are scratch registers the interpreter never writes
+    addresses = [0, 1, 2, 3, 4] + list(range(16, 4096))
+    assert [vm.read(address) for address in addresses] == [cpu.read(address) for address in addresses]
+
+@pytest.mark.parametrize("mode", TRANSLATION_MODES, ids=lambda mode: "-".join(f"{key}={value}" for key, value in mode.items()))
+def test_translated_calls(mode):
+    cpu = run(HackCPU.from_assembly(translate_program(FIBONACCI_PROGRAM, **mode)), {}, 200_000)
+
+    assert cpu.read(5) == 55
+
+def test_interpreted_calls():
+    vm = run(VMInterpreter([(name, Parser(source.splitlines()).iter_commands()) for name, source in FIBONACCI_PROGRAM]), {}, 50_000)
+
+    assert vm.read(5) == 55
+
+def test_run_compares_with_cmp_file(capsys):
+    run_main([program_path("StackTest"), "--set", "0=256", "--compare", program_path("StackTest", ".cmp")])
+
+    assert "Comparison failure" not in capsys.readouterr().out
+
+def test_run_fails_when_ram_differs_from_cmp_file(tmp_path):
+    cmp_file = tmp_path / "SimpleAdd.cmp"
+    cmp_file.write_text("|RAM[0]|RAM[256]|\n|257|16|\n")
+
+    with pytest.raises(SystemExit):
+        run_main([program_path("SimpleAdd"), "--set", "0=256", "--compare", str(cmp_file)])